@@ -3,18 +3,26 @@ import io
 import uuid
 import traceback
 from datetime import datetime
-from flask import Flask, request, render_template, jsonify, redirect, url_for, flash, send_file
+from flask import Flask, Response, request, render_template, jsonify, redirect, url_for, flash, send_file, stream_with_context
+from flask import make_response
 from werkzeug.utils import secure_filename
 
-from utils.logging_config import get_app_logger
+from utils.logging_config import get_app_logger, set_correlation_id, reset_correlation_id, get_correlation_id
+from utils import metrics, maintenance, backup, admission
 
 from database import init_db, get_all_transcriptions, get_transcription
 from database import save_custom_instruction, get_all_custom_instructions, get_custom_instruction, delete_custom_instruction
-from database import save_transcription, delete_transcription
+from database import get_default_custom_instruction, set_default_custom_instruction, set_custom_instruction_tempo
+from database import delete_transcription, get_transcription_usage, get_usage_summary
 
-from utils.audio_handler import save_uploaded_file, get_audio_duration, split_audio_file, cleanup_temp_files, get_file_type
-from utils.openai_client import transcribe_audio, post_process_transcription, check_file_size
-from utils.export_utils import generate_pdf, export_plaintext, export_to_word
+from utils.audio_handler import save_uploaded_file, get_audio_duration, validate_tempo_factor
+from utils.audio_handler import TEMPO_FACTOR, MIN_TEMPO_FACTOR, MAX_TEMPO_FACTOR
+from utils.export_utils import iter_plaintext
+from utils.export_engine import render_export, ExportTimeout
+from utils.accounting import BudgetExceeded, check_budget, estimate_job_cost
+from utils.openai_client import POST_PROCESS_SEGMENT_WORDS
+from utils.job_queue import get_job_store, DONE, FAILED, PRIORITIES, PRIORITY_NAMES
+from pipeline import run_pipeline, FINGERPRINT_ENABLED, DUPLICATE_REUSE
 
 # Initialize logger
 logger = get_app_logger()
@@ -42,6 +50,12 @@ def health_check():
     except Exception as e:
         db_status = f"error: {str(e)}"
     
+    # Memory and disk reserved by running jobs
+    try:
+        admission_usage = admission.usage()
+    except Exception as e:
+        admission_usage = {"error": str(e)}
+    
     # Check disk space
     upload_space = shutil.disk_usage(os.path.join(os.getcwd(), 'uploads'))
     temp_space = shutil.disk_usage(os.path.join(os.getcwd(), 'temp_audio'))
@@ -57,147 +71,258 @@ def health_check():
             "uploads_gb": round(upload_space.free / (1024**3), 2),
             "temp_audio_gb": round(temp_space.free / (1024**3), 2)
         },
+        "admission": admission_usage,
         "environment": "production" if not app.debug else "development"
     })
 
+# Prometheus metrics endpoint
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose pipeline metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Correlate every log line of a request
+@app.before_request
+def assign_correlation_id():
+    correlation_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    request.environ['transcribe.correlation_token'] = set_correlation_id(correlation_id[:64])
+
+@app.after_request
+def add_correlation_header(response):
+    correlation_id = get_correlation_id()
+    if correlation_id:
+        response.headers['X-Request-ID'] = correlation_id
+    return response
+
+@app.teardown_request
+def clear_correlation_id(exc):
+    token = request.environ.pop('transcribe.correlation_token', None)
+    if token is not None:
+        reset_correlation_id(token)
+
 # Add context processor for templates
 @app.context_processor
 def inject_now():
     return {'now': datetime.now()}
 
-# Initialize database
-logger.info("Initializing database")
-init_db()
-logger.info("Database initialized")
+def start_background_tasks():
+    """
+    Start the metrics flush, maintenance and backup threads of this process.
+    
+    Called once per serving process, from the gunicorn post_fork hook
+    (gunicorn.conf.py) or when running app.py directly, not on import.
+    """
+    metrics.start_worker_flush()
+    maintenance.start_background_maintenance()
+    backup.start_background_backups()
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'mp3', 'wav', 'mp4', 'm4a', 'ogg', 'flac'}
 
+# Header set by the reverse proxy with the authenticated user name
+USER_HEADER = os.getenv("USER_HEADER", "X-Forwarded-User")
+
+# Hand uploads to queue workers (worker.py) instead of processing them in the
+# request; lets several instances share the work through leased jobs
+JOB_QUEUE = os.getenv("JOB_QUEUE", "0") == "1"
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_request_user():
+    """Identify the user making the request, for usage accounting."""
+    return request.headers.get(USER_HEADER) or request.remote_user or 'anonymous'
+
 @app.route('/')
 def index():
     """Render the main page."""
     return render_template('index.html', 
                           transcriptions=get_all_transcriptions(),
-                          custom_instructions=get_all_custom_instructions())
+                          custom_instructions=get_all_custom_instructions(),
+                          job_queue=JOB_QUEUE,
+                          priorities=PRIORITIES,
+                          duplicate_detection=FINGERPRINT_ENABLED,
+                          duplicate_reuse=DUPLICATE_REUSE)
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    """Handle file upload and transcription."""
+def resolve_custom_instruction(custom_instruction_id):
+    """
+    Look up the instruction chosen for a job, falling back to the default.
+    
+    Returns:
+        (instruction text, instruction ID)
+    """
+    if custom_instruction_id:
+        custom_instruction_id = int(custom_instruction_id)
+        logger.debug(f"Using custom instruction ID: {custom_instruction_id}")
+        custom_instruction_obj = get_custom_instruction(custom_instruction_id)
+        return custom_instruction_obj['instruction_text'], custom_instruction_id
+    
+    # Get default instruction
+    logger.debug("No custom instruction provided, using default")
+    default_instruction = get_default_custom_instruction()
+    if not default_instruction:
+        return "", None
+    return default_instruction['instruction_text'], default_instruction['id']
+
+def reuse_duplicate_choice():
+    """Reuse choice of the upload form; the checkbox follows a hidden "0", so the last value wins."""
+    values = request.form.getlist('reuse_duplicate')
+    if not values:
+        return None
+    return values[-1] == '1'
+
+def accept_upload():
+    """
+    Validate the upload form, resolve the custom instruction and save the file.
+    
+    Returns:
+        (job, None) where job holds the run_pipeline arguments, or
+        (None, response) if the upload was rejected
+    """
     logger.info("Upload route called")
     
     if 'file' not in request.files:
         logger.warning("No file part in request")
         flash('No file part')
-        return redirect(request.url)
+        return None, redirect(request.url)
     
     file = request.files['file']
     
     if file.filename == '':
         logger.warning("Empty filename submitted")
         flash('No selected file')
-        return redirect(request.url)
+        return None, redirect(request.url)
     
-    if file and allowed_file(file.filename):
-        logger.info(f"Processing file: {file.filename}")
-        
-        # Get custom instruction ID
-        custom_instruction_id = request.form.get('custom_instruction_id')
-        if custom_instruction_id:
-            custom_instruction_id = int(custom_instruction_id)
-            logger.info(f"Using custom instruction ID: {custom_instruction_id}")
-            custom_instruction_obj = get_custom_instruction(custom_instruction_id)
-            custom_instruction = custom_instruction_obj['instruction_text']
-        else:
-            # Get default instruction
-            logger.info("No custom instruction provided, using default")
-            instructions = get_all_custom_instructions()
-            custom_instruction = instructions[0]['instruction_text'] if instructions else ""
-            custom_instruction_id = instructions[0]['id'] if instructions else None
-        
-        # Generate a unique filename to prevent collisions
-        original_filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4().hex}_{original_filename}"
-        logger.info(f"Generated unique filename: {unique_filename}")
-        
-        # Save the uploaded file
-        file_path = save_uploaded_file(file, unique_filename)
-        logger.info(f"File saved to: {file_path}")
-        
+    if not (file and allowed_file(file.filename)):
+        logger.warning(f"File type not allowed: {file.filename}")
+        flash('File type not allowed')
+        return None, redirect(url_for('index'))
+    
+    logger.info(f"Processing file: {file.filename}")
+    
+    custom_instruction, custom_instruction_id = resolve_custom_instruction(request.form.get('custom_instruction_id'))
+    
+    # Generate a unique filename to prevent collisions
+    original_filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4().hex}_{original_filename}"
+    logger.debug(f"Generated unique filename: {unique_filename}")
+    
+    # Save the uploaded file
+    file_path = save_uploaded_file(file, unique_filename)
+    logger.info(f"File saved to: {file_path}")
+    metrics.UPLOAD_BYTES.inc(os.path.getsize(file_path))
+    
+    job = {
+        "file_path": file_path,
+        "original_filename": original_filename,
+        "custom_instruction": custom_instruction,
+        "custom_instruction_id": custom_instruction_id,
+        "user_id": get_request_user(),
+        "reuse_duplicate": reuse_duplicate_choice(),
+    }
+    return job, None
+
+def upload_succeeded(job, transcription_id):
+    """Response for a successfully processed upload."""
+    flash('Transcription completed successfully!', 'success')
+    logger.info(f"Transcription process completed successfully for {job['original_filename']}")
+    return redirect(url_for('view_transcription', transcription_id=transcription_id))
+
+def upload_failed(job, error):
+    """Response for an upload whose processing raised an error."""
+    if isinstance(error, BudgetExceeded):
+        flash(str(error), 'error')
+        return redirect(url_for('index'))
+    
+    logger.error(f"Error processing file: {str(error)}")
+    logger.error("".join(traceback.format_exception(error)))
+    flash(f'Error processing file: {str(error)}', 'error')
+    return redirect(url_for('index'))
+
+def upload_rejected(error):
+    """503 response with Retry-After for an upload that does not fit in the memory or disk budget."""
+    flash(str(error), 'error')
+    response = make_response(index(), 503)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    """Handle file upload and transcription."""
+    # Decided from the request length, before the body is read; queued
+    # uploads are only saved here and admitted again by the worker
+    try:
+        reservation = admission.admit(request.content_length, processing=not JOB_QUEUE)
+    except admission.AdmissionRejected as e:
+        return upload_rejected(e)
+    
+    with reservation:
+        return process_upload()
+
+def process_upload():
+    """Save the upload, then queue it or run the pipeline."""
+    job, rejection = accept_upload()
+    if rejection is not None:
+        return rejection
+    
+    if JOB_QUEUE:
+        priority = request.form.get('priority', 'normal')
+        if priority not in PRIORITIES:
+            priority = 'normal'
         try:
-            # Get audio duration
-            logger.info("Getting audio duration")
-            duration = get_audio_duration(file_path)
-            logger.info(f"Audio duration: {duration} seconds")
-            
-            # Get audio format
-            logger.info("Getting audio format")
-            file_type = get_file_type(file_path)
-            logger.info(f"Audio format: {file_type}")
-            
-            # Split file if needed
-            logger.info("Checking if file needs to be split")
-            chunk_files = split_audio_file(file_path)
-            
-            if len(chunk_files) > 1:
-                logger.info(f"File split into {len(chunk_files)} chunks")
-            else:
-                logger.info("File does not need splitting")
-            
-            # Transcribe each chunk
-            logger.info("Starting transcription process")
-            transcription_parts = []
-            for i, chunk_file in enumerate(chunk_files):
-                logger.info(f"Transcribing chunk {i+1}/{len(chunk_files)}")
-                transcription_text = transcribe_audio(chunk_file)
-                transcription_parts.append(transcription_text)
-            
-            # Combine transcriptions
-            logger.info("Combining transcription parts")
-            whisper_transcription = " ".join(transcription_parts)
-            logger.info(f"Whisper transcription completed: {len(whisper_transcription)} characters")
-            
-            # Post-process with GPT-4o
-            logger.info("Starting GPT-4o post-processing")
-            processed_transcription = post_process_transcription(whisper_transcription, custom_instruction)
-            logger.info(f"Post-processing completed: {len(processed_transcription)} characters")
-            
-            # Save to database
-            logger.info("Saving transcription to database")
-            with open(file_path, 'rb') as f:
-                audio_data = f.read()
-            
-            transcription_id = save_transcription(
-                filename=original_filename,
-                file_type=file_type,
-                audio_data=audio_data,
-                whisper_transcription=whisper_transcription,
-                processed_transcription=processed_transcription,
-                duration_seconds=duration,
-                custom_instruction_id=custom_instruction_id
+            # The scheduler serves short recordings first
+            duration = get_audio_duration(job['file_path'])
+            # Refuse now rather than fail the job when a worker picks it up
+            check_budget(
+                estimate_job_cost(duration, job['custom_instruction'], POST_PROCESS_SEGMENT_WORDS),
+                job['user_id'], job['custom_instruction_id']
             )
-            logger.info(f"Transcription saved with ID: {transcription_id}")
-            
-            # Clean up temporary files
-            if len(chunk_files) > 1:
-                logger.info("Cleaning up temporary chunk files")
-                cleanup_temp_files(chunk_files)
-            
-            flash('Transcription completed successfully!', 'success')
-            logger.info(f"Transcription process completed successfully for {original_filename}")
-            return redirect(url_for('view_transcription', transcription_id=transcription_id))
-            
         except Exception as e:
-            logger.error(f"Error processing file: {str(e)}")
-            logger.error(traceback.format_exc())
-            flash(f'Error processing file: {str(e)}', 'error')
-            return redirect(url_for('index'))
+            if isinstance(e, BudgetExceeded) and os.path.exists(job['file_path']):
+                os.remove(job['file_path'])
+            return upload_failed(job, e)
+        job_id = get_job_store().enqueue("transcribe", job, priority=priority, user_id=job['user_id'], cost=duration)
+        logger.info(f"Queued transcription job {job_id} for {job['original_filename']} ({duration:.0f}s, {priority} priority)")
+        return redirect(url_for('job_status', job_id=job_id))
     
-    logger.warning(f"File type not allowed: {file.filename}")
-    flash('File type not allowed')
-    return redirect(url_for('index'))
+    try:
+        transcription_id = run_pipeline(**job)
+    except Exception as e:
+        return upload_failed(job, e)
+    
+    return upload_succeeded(job, transcription_id)
+
+@app.route('/live')
+def live_transcription():
+    """Record from the microphone and transcribe while the meeting is running."""
+    return render_template('live.html', custom_instructions=get_all_custom_instructions())
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Wait page for a queued upload; moves on once a worker has finished it."""
+    job = get_job_store().get(job_id)
+    if not job:
+        flash('Job not found')
+        return redirect(url_for('index'))
+    
+    if job['status'] == DONE:
+        return upload_succeeded(job['payload'], job['result']['transcription_id'])
+    if job['status'] == FAILED:
+        flash(f"Error processing file: {job['error']}", 'error')
+        return redirect(url_for('index'))
+    
+    return render_template('job_status.html', job=job)
+
+@app.route('/api/jobs/<int:job_id>')
+def job_status_api(job_id):
+    """Job state as JSON, for clients polling a queued upload."""
+    job = get_job_store().get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    
+    data = {key: job[key] for key in ("id", "status", "attempts", "worker_id", "result", "error", "cost")}
+    data["priority"] = PRIORITY_NAMES.get(job["priority"], "normal")
+    return jsonify(data)
 
 @app.route('/transcription/<int:transcription_id>')
 def view_transcription(transcription_id):
@@ -209,13 +334,83 @@ def view_transcription(transcription_id):
     
     return render_template('view_transcription.html', 
                           transcription=transcription,
+                          usage=get_transcription_usage(transcription_id),
                           custom_instructions=get_all_custom_instructions())
 
+@app.route('/api/usage')
+def usage_summary():
+    """API usage and cost aggregated by day, instruction or user."""
+    group_by = request.args.get('group_by', 'day')
+    days = request.args.get('days', 30, type=int)
+    try:
+        summary = get_usage_summary(group_by, days)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"group_by": group_by, "days": days, "usage": summary})
+
+@app.route('/api/cache')
+def response_cache_stats():
+    """Hits, misses and size of the post-processing response cache."""
+    from utils.response_cache import get_response_cache
+    
+    cache = get_response_cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+def _remove_from_search_index(transcription_id):
+    from utils import semantic_search
+    
+    try:
+        semantic_search.remove_transcription(transcription_id)
+    except Exception as e:
+        logger.error(f"Could not remove transcription {transcription_id} from the search index: {str(e)}")
+
+def run_search():
+    """
+    Run the semantic search given by the q and k request arguments.
+    
+    Returns:
+        (query, hits, error message)
+    """
+    # Imported here so workers only load numpy and the index once someone searches
+    from utils import semantic_search
+    
+    query = request.args.get('q', '').strip()
+    k = max(1, min(request.args.get('k', 10, type=int), 50))
+    if not query:
+        return query, [], None
+    try:
+        return query, semantic_search.search(query, k), None
+    except semantic_search.IndexMismatch as e:
+        logger.error(f"Semantic search unavailable: {str(e)}")
+        return query, [], 'The search index must be rebuilt (python search_index.py --rebuild)'
+    except Exception as e:
+        logger.error(f"Semantic search failed: {str(e)}")
+        return query, [], f'Search failed: {str(e)}'
+
+@app.route('/search')
+def search_transcriptions():
+    """Find transcript passages by meaning."""
+    query, hits, error = run_search()
+    if error:
+        flash(error, 'error')
+    return render_template('search.html', query=query, hits=hits)
+
+@app.route('/api/search')
+def search_api():
+    """Semantic search as JSON: passages best first, with their transcription."""
+    query, hits, error = run_search()
+    if error:
+        return jsonify({"error": error}), 503
+    return jsonify({"query": query, "hits": hits})
+
 @app.route('/transcription/<int:transcription_id>/delete', methods=['POST'])
 def delete_transcription_route(transcription_id):
     """Delete a transcription."""
     success = delete_transcription(transcription_id)
     if success:
+        _remove_from_search_index(transcription_id)
         flash('Transcription deleted successfully', 'success')
     else:
         flash('Error deleting transcription', 'error')
@@ -237,32 +432,34 @@ def export_transcription(transcription_id, format):
         filename = transcription['original_filename'].rsplit('.', 1)[0]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        if format == 'pdf':
-            logger.info(f"Generating PDF export for transcription ID {transcription_id}")
-            output_path = f"{filename}_{timestamp}.pdf"
-            filepath = generate_pdf(transcription, output_path)
-            logger.info(f"PDF export generated: {filepath}")
-            return send_file(filepath, as_attachment=True, download_name=os.path.basename(filepath))
+        if format in ('pdf', 'docx'):
+            logger.info(f"Generating {format} export for transcription ID {transcription_id}")
+            filepath = render_export(transcription, format)
+            logger.info(f"{format} export generated: {filepath}")
+            
+            # Stream the file from disk; unlinking it now frees the space as
+            # soon as the response closes the handle
+            export_file = open(filepath, 'rb')
+            os.remove(filepath)
+            return send_file(export_file, as_attachment=True, download_name=f"{filename}_{timestamp}.{format}")
         
         elif format == 'text':
-            logger.info(f"Generating plaintext export for transcription ID {transcription_id}")
-            output_path = f"{filename}_{timestamp}.txt"
-            filepath = export_plaintext(transcription, output_path)
-            logger.info(f"Plaintext export generated: {filepath}")
-            return send_file(filepath, as_attachment=True, download_name=os.path.basename(filepath))
-        
-        elif format == 'docx':
-            logger.info(f"Generating Word document export for transcription ID {transcription_id}")
-            output_path = f"{filename}_{timestamp}.docx"
-            filepath = export_to_word(transcription, output_path)
-            logger.info(f"Word document export generated: {filepath}")
-            return send_file(filepath, as_attachment=True, download_name=os.path.basename(filepath))
+            logger.info(f"Streaming plaintext export for transcription ID {transcription_id}")
+            return Response(
+                stream_with_context(iter_plaintext(transcription)),
+                content_type='text/plain; charset=utf-8',
+                headers={'Content-Disposition': f'attachment; filename="{filename}_{timestamp}.txt"'}
+            )
         
         else:
             logger.warning(f"Invalid export format requested: {format}")
             flash('Invalid export format')
             return redirect(url_for('view_transcription', transcription_id=transcription_id))
-            
+    
+    except ExportTimeout as e:
+        logger.error(f"Export timed out for transcription ID {transcription_id}: {str(e)}")
+        flash(f'Export timed out: {str(e)}. Try the plain text export instead.', 'error')
+        return redirect(url_for('view_transcription', transcription_id=transcription_id))
     except Exception as e:
         logger.error(f"Error exporting transcription: {str(e)}")
         logger.error(traceback.format_exc())
@@ -273,7 +470,16 @@ def export_transcription(transcription_id, format):
 def custom_instructions():
     """View all custom instructions."""
     return render_template('custom_instructions.html', 
-                          custom_instructions=get_all_custom_instructions())
+                          custom_instructions=get_all_custom_instructions(),
+                          default_tempo=TEMPO_FACTOR,
+                          min_tempo=MIN_TEMPO_FACTOR,
+                          max_tempo=MAX_TEMPO_FACTOR)
+
+def parse_tempo_factor(value):
+    """Tempo factor from a form field; blank means the global default (None)."""
+    if not value or not value.strip():
+        return None
+    return validate_tempo_factor(value)
 
 @app.route('/custom_instruction', methods=['POST'])
 def add_custom_instruction():
@@ -285,11 +491,44 @@ def add_custom_instruction():
         flash('Name and instruction text are required', 'error')
         return redirect(url_for('custom_instructions'))
     
-    instruction_id = save_custom_instruction(name, instruction_text)
+    try:
+        tempo_factor = parse_tempo_factor(request.form.get('tempo_factor'))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('custom_instructions'))
+    
+    instruction_id = save_custom_instruction(name, instruction_text, tempo_factor)
     
     flash('Custom instruction added successfully', 'success')
     return redirect(url_for('custom_instructions'))
 
+@app.route('/custom_instruction/<int:instruction_id>/default', methods=['POST'])
+def set_default_custom_instruction_route(instruction_id):
+    """Make a custom instruction the default."""
+    success = set_default_custom_instruction(instruction_id)
+    if success:
+        flash('Default instruction updated', 'success')
+    else:
+        flash('Custom instruction not found', 'error')
+    
+    return redirect(url_for('custom_instructions'))
+
+@app.route('/custom_instruction/<int:instruction_id>/tempo', methods=['POST'])
+def set_custom_instruction_tempo_route(instruction_id):
+    """Set the audio speed-up used for a custom instruction's jobs."""
+    try:
+        tempo_factor = parse_tempo_factor(request.form.get('tempo_factor'))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('custom_instructions'))
+    
+    if set_custom_instruction_tempo(instruction_id, tempo_factor):
+        flash('Speed-up updated', 'success')
+    else:
+        flash('Custom instruction not found', 'error')
+    
+    return redirect(url_for('custom_instructions'))
+
 @app.route('/custom_instruction/<int:instruction_id>/delete', methods=['POST'])
 def delete_custom_instruction_route(instruction_id):
     """Delete a custom instruction."""
@@ -302,4 +541,6 @@ def delete_custom_instruction_route(instruction_id):
     return redirect(url_for('custom_instructions'))
 
 if __name__ == '__main__':
+    init_db()
+    start_background_tasks()
     app.run(debug=True)
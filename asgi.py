@@ -0,0 +1,428 @@
+"""
+ASGI entry point for the async serving mode.
+
+    gunicorn -k uvicorn.workers.UvicornWorker --workers 1 --timeout 600 asgi:application
+
+POST /upload is handled on the event loop: the request body is spooled to
+disk, FFmpeg runs as asyncio subprocesses and Whisper/GPT-4o are called with
+the async OpenAI client, so a waiting transcription does not hold a thread
+and one process can have dozens of jobs in flight. The /ws/transcribe
+WebSocket transcribes microphone audio live. Every other route is the
+unchanged Flask app served through asgiref's WSGI adapter.
+"""
+import os
+import json
+import uuid
+import wave
+import asyncio
+import tempfile
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Optional
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app, accept_upload, upload_succeeded, upload_failed, JOB_QUEUE
+from app import resolve_custom_instruction, USER_HEADER
+from pipeline import run_pipeline_async, finalize_live_session
+from utils.logging_config import get_app_logger, correlation_scope
+from utils.audio_handler import TEMP_AUDIO_DIR, ensure_directories_exist
+from utils.openai_client import transcribe_audio
+from utils.accounting import start_usage_tracking, stop_usage_tracking, check_budget, estimate_job_cost
+from utils.accounting import whisper_cost, BudgetExceeded
+from utils.streaming import WindowBuffer, STREAM_SAMPLE_RATE, is_silent, pcm_to_wav
+from utils.streaming import MIN_SAMPLE_RATE, MAX_SAMPLE_RATE, MAX_PENDING_WINDOWS, MAX_WINDOW_SECONDS, RESERVE_SECONDS
+from utils.streaming import IDLE_TIMEOUT_SECONDS
+from utils import metrics, admission
+
+# Initialize logger
+logger = get_app_logger()
+
+# Flask app for all routes without a native async handler
+wsgi_application = WsgiToAsgi(flask_app)
+
+# Request bodies larger than this are spooled to a temporary file
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+async def _read_body(receive, limit: Optional[int]) -> Optional[SpooledTemporaryFile]:
+    """
+    Read the request body into a spooled temporary file.
+    
+    Returns:
+        The body rewound to the start, or None if it exceeds the limit
+    """
+    body = SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            body.close()
+            raise ConnectionError("Client disconnected during upload")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            body.close()
+            return None
+        if chunk:
+            # Once rolled over to disk, writes could block the event loop
+            await asyncio.to_thread(body.write, chunk)
+        if not message.get("more_body"):
+            break
+    body.seek(0)
+    return body
+
+async def _send_response(send, response):
+    """Send a Werkzeug response over ASGI."""
+    headers = [
+        (name.lower().encode("latin1"), value.encode("latin1"))
+        for name, value in response.headers.items()
+    ]
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": b"".join(response.iter_encoded())})
+    response.close()
+
+async def _send_status(send, status: int, text: str, headers: Optional[list] = None):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+def _content_length(scope) -> Optional[int]:
+    for name, value in scope.get("headers", []):
+        if name == b"content-length" and value.isdigit():
+            return int(value)
+    return None
+
+async def handle_upload(scope, receive, send):
+    """Async counterpart of app.upload_file."""
+    # Admit the job before spooling its body
+    try:
+        reservation = await asyncio.to_thread(admission.admit, _content_length(scope))
+    except admission.AdmissionRejected as e:
+        await _send_status(send, 503, str(e), [(b"retry-after", str(e.retry_after).encode("latin1"))])
+        return
+    
+    with reservation:
+        await process_upload(scope, receive, send)
+
+async def process_upload(scope, receive, send):
+    body = await _read_body(receive, flask_app.config.get('MAX_CONTENT_LENGTH'))
+    if body is None:
+        await _send_status(send, 413, "Request Entity Too Large")
+        return
+    
+    adapter = WsgiToAsgiInstance(flask_app)
+    adapter.scope = scope
+    ctx = flask_app.request_context(adapter.build_environ(scope, body))
+    ctx.push()
+    error = None
+    try:
+        try:
+            # before_request hooks run on the loop so context variables they
+            # set (e.g. the correlation ID) are visible to the pipeline
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                # Form parsing and saving the file are blocking I/O
+                job, rejection = await asyncio.to_thread(accept_upload)
+                if rejection is not None:
+                    rv = rejection
+                else:
+                    try:
+                        transcription_id = await run_pipeline_async(**job)
+                    except Exception as e:
+                        rv = upload_failed(job, e)
+                    else:
+                        rv = upload_succeeded(job, transcription_id)
+            response = flask_app.process_response(flask_app.make_response(rv))
+        except Exception as e:
+            error = e
+            response = flask_app.handle_exception(e)
+        await _send_response(send, response)
+    finally:
+        ctx.pop(error)
+        body.close()
+
+def wave_writer(path: str, sample_rate: int):
+    """Open a mono 16-bit WAV file for appending streamed PCM."""
+    recording = wave.open(path, "wb")
+    recording.setnchannels(1)
+    recording.setsampwidth(2)
+    recording.setframerate(sample_rate)
+    return recording
+
+async def _transcribe_window(samples, sample_rate: int) -> str:
+    """Transcribe one closed window of a live session."""
+    def run():
+        with tempfile.NamedTemporaryFile(suffix=".wav", dir=TEMP_AUDIO_DIR, delete=False) as f:
+            f.write(pcm_to_wav(samples, sample_rate))
+        try:
+            return transcribe_audio(f.name, audio_seconds=len(samples) / sample_rate)
+        finally:
+            os.remove(f.name)
+    
+    return await asyncio.to_thread(run)
+
+async def _reject_session(send, code: int, message: str):
+    """Accept a WebSocket only to tell the client why the session is refused, then close it."""
+    logger.warning(f"Rejected live session: {message}")
+    await send({"type": "websocket.accept"})
+    await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": message})})
+    await send({"type": "websocket.close", "code": code})
+
+def _session_cost(usage_records) -> float:
+    return sum(record["cost_usd"] for record in usage_records)
+
+async def handle_transcribe_stream(scope, receive, send):
+    """
+    Live transcription over a WebSocket.
+    
+    The client sends binary messages of 16-bit little-endian mono PCM at
+    the sample_rate query parameter (16 kHz by default) and a text message
+    {"type": "stop"} when the meeting ends. The server answers with
+    {"type": "partial", "index", "start", "end", "text"} for every window
+    as soon as Whisper returns it, and finally {"type": "final",
+    "transcription_id", "url"} once the session is stored like an upload.
+    
+    Sessions are held to the daily budgets and admission control like
+    uploads; a refused session gets an error message and is closed.
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    try:
+        sample_rate = int(query.get("sample_rate", [STREAM_SAMPLE_RATE])[0])
+    except ValueError:
+        sample_rate = 0
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        await _reject_session(send, 1008, f"sample_rate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}")
+        return
+    headers = {name.decode("latin1").lower(): value.decode("latin1") for name, value in scope["headers"]}
+    user_id = headers.get(USER_HEADER.lower()) or "anonymous"
+    instruction_id = query.get("custom_instruction_id", [None])[0]
+    
+    try:
+        custom_instruction, custom_instruction_id = await asyncio.to_thread(
+            resolve_custom_instruction, instruction_id
+        )
+    except Exception as e:
+        await _reject_session(send, 1008, str(e))
+        return
+    
+    # The session must afford at least one window and its post-processing
+    try:
+        await asyncio.to_thread(
+            check_budget, estimate_job_cost(MAX_WINDOW_SECONDS, custom_instruction), user_id, custom_instruction_id
+        )
+    except BudgetExceeded as e:
+        await _reject_session(send, 1008, str(e))
+        return
+    # The session's recording is held on disk until it is stored
+    try:
+        reservation = await asyncio.to_thread(
+            admission.admit, int(RESERVE_SECONDS * sample_rate * 2), label="live session"
+        )
+    except admission.AdmissionRejected as e:
+        await _reject_session(send, 1013, str(e))
+        return
+    
+    with correlation_scope(f"live-{uuid.uuid4().hex[:10]}"), reservation:
+        await send({"type": "websocket.accept"})
+        ensure_directories_exist()
+        recording_path = os.path.join(TEMP_AUDIO_DIR, f"live_{uuid.uuid4().hex}.wav")
+        recording = wave_writer(recording_path, sample_rate)
+        buffer = WindowBuffer(sample_rate)
+        windows: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING_WINDOWS)
+        parts = []
+        connected = True
+        over_budget = False
+        usage_records, usage_token = start_usage_tracking()
+        logger.info(f"Live session started for {user_id} at {sample_rate} Hz")
+        
+        async def send_json(payload):
+            if connected:
+                await send({"type": "websocket.send", "text": json.dumps(payload)})
+        
+        async def queue_window(window):
+            try:
+                windows.put_nowait(window)
+            except asyncio.QueueFull:
+                seconds = len(window[1]) / sample_rate
+                metrics.LIVE_WINDOWS_DROPPED.inc()
+                logger.warning(f"Live transcription is falling behind: dropped {seconds:.1f} seconds of audio")
+                await send_json({
+                    "type": "error",
+                    "message": f"Transcription is falling behind; {seconds:.1f} seconds of audio were not transcribed",
+                })
+        
+        async def transcribe_windows():
+            # Windows are transcribed in order so partials arrive in order
+            nonlocal over_budget
+            index = 0
+            while True:
+                window = await windows.get()
+                if window is None:
+                    return
+                start, samples = window
+                metrics.AUDIO_SECONDS.inc(len(samples) / sample_rate)
+                if over_budget or is_silent(samples, sample_rate):
+                    continue
+                try:
+                    # Usage of the session is only stored when it ends
+                    estimate = _session_cost(usage_records) + whisper_cost(len(samples) / sample_rate)
+                    await asyncio.to_thread(check_budget, estimate, user_id, custom_instruction_id)
+                except BudgetExceeded as e:
+                    over_budget = True
+                    await send_json({"type": "error", "message": f"{str(e)} The rest of the session is not transcribed."})
+                    continue
+                try:
+                    text = await _transcribe_window(samples, sample_rate)
+                except Exception as e:
+                    logger.error(f"Live window transcription failed: {str(e)}")
+                    await send_json({"type": "error", "message": f"Transcription failed: {str(e)}"})
+                    continue
+                parts.append(text)
+                await send_json({
+                    "type": "partial",
+                    "index": index,
+                    "start": round(start / sample_rate, 2),
+                    "end": round((start + len(samples)) / sample_rate, 2),
+                    "text": text,
+                })
+                index += 1
+        
+        consumer = asyncio.create_task(transcribe_windows())
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(receive(), IDLE_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Live session idle for {IDLE_TIMEOUT_SECONDS:.0f}s; ending it")
+                    await send_json({
+                        "type": "error",
+                        "message": f"Nothing received for {IDLE_TIMEOUT_SECONDS:g} seconds; the session is ended and saved.",
+                    })
+                    break
+                if message["type"] == "websocket.disconnect":
+                    connected = False
+                    break
+                if message.get("bytes"):
+                    await asyncio.to_thread(recording.writeframes, message["bytes"])
+                    for window in buffer.add(message["bytes"]):
+                        await queue_window(window)
+                    # Admission reserved this much; the transcript is post-processed in one call
+                    if buffer.window_start >= RESERVE_SECONDS * sample_rate:
+                        logger.warning(f"Live session reached {RESERVE_SECONDS:.0f}s; ending it")
+                        await send_json({
+                            "type": "error",
+                            "message": f"The session reached the maximum length of {RESERVE_SECONDS / 60:g} minutes; "
+                                       "it is ended and saved.",
+                        })
+                        break
+                elif message.get("text"):
+                    try:
+                        command = json.loads(message["text"])
+                    except ValueError:
+                        command = {}
+                    if command.get("type") == "stop":
+                        break
+            
+            # The session is over, so the last windows can wait for room
+            final_window = buffer.flush()
+            if final_window is not None:
+                await windows.put(final_window)
+            await windows.put(None)
+            await consumer
+            recording.close()
+            
+            duration = buffer.window_start / sample_rate
+            if duration == 0:
+                await send_json({"type": "final", "transcription_id": None})
+                return
+            
+            # Post-processing is skipped, not the session lost, if it no longer fits the budget
+            post_process = not over_budget
+            if post_process:
+                post_process_cost = estimate_job_cost(duration, custom_instruction) - whisper_cost(duration)
+                try:
+                    await asyncio.to_thread(
+                        check_budget, _session_cost(usage_records) + post_process_cost, user_id, custom_instruction_id
+                    )
+                except BudgetExceeded as e:
+                    post_process = False
+                    await send_json({"type": "error", "message": f"{str(e)} The session is saved without post-processing."})
+            
+            filename = query.get("filename", [f"Live session {datetime.now():%Y-%m-%d %H:%M}"])[0]
+            transcription_id = await asyncio.to_thread(
+                finalize_live_session,
+                recording_path, " ".join(parts), duration, filename,
+                custom_instruction, custom_instruction_id, user_id, usage_records, post_process
+            )
+            await send_json({
+                "type": "final",
+                "transcription_id": transcription_id,
+                "url": f"/transcription/{transcription_id}",
+            })
+        except Exception as e:
+            logger.error(f"Live session failed: {str(e)}")
+            await send_json({"type": "error", "message": str(e)})
+        finally:
+            consumer.cancel()
+            recording.close()
+            if os.path.exists(recording_path):
+                os.remove(recording_path)
+            stop_usage_tracking(usage_token)
+            if connected:
+                await send({"type": "websocket.close", "code": 1000})
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+# Flask endpoints with a native async implementation
+ASYNC_HANDLERS = {
+    "upload_file": handle_upload,
+}
+
+# WebSocket endpoints by path
+WEBSOCKET_HANDLERS = {
+    "/ws/transcribe": handle_transcribe_stream,
+}
+
+def _async_handler(scope):
+    """Return the native async handler for a request, if there is one."""
+    if JOB_QUEUE:
+        # Uploads are only enqueued; Flask handles that fine
+        return None
+    try:
+        endpoint, _ = flask_app.url_map.bind("localhost").match(scope["path"], method=scope["method"])
+    except HTTPException:
+        return None
+    return ASYNC_HANDLERS.get(endpoint)
+
+async def application(scope, receive, send):
+    """ASGI application."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http":
+        handler = _async_handler(scope)
+        if handler is not None:
+            await handler(scope, receive, send)
+        else:
+            await wsgi_application(scope, receive, send)
+    elif scope["type"] == "websocket" and scope["path"] in WEBSOCKET_HANDLERS:
+        await WEBSOCKET_HANDLERS[scope["path"]](scope, receive, send)
+    else:
+        logger.warning(f"Unsupported ASGI scope: {scope['type']} {scope.get('path')}")
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1003})
@@ -0,0 +1,72 @@
+"""
+Online backups of the transcriptions database (see utils/backup.py).
+
+    python backup.py                      # take a snapshot now, report printed as JSON
+    python backup.py --loop               # take one whenever BACKUP_INTERVAL_SECONDS have passed
+    python backup.py --list
+    python backup.py --restore backups/transcriptions-20250101T020000Z.db.gz
+
+The app takes the same snapshots in the background when BACKUP_ENABLED=1;
+this script is for running them from cron or a separate container instead,
+and for restores. A restore first snapshots the current database (labelled
+"pre-restore") so it can be undone. Stop the app before restoring.
+"""
+import sys
+import json
+import time
+import argparse
+
+from utils.logging_config import get_app_logger
+from utils import backup
+from database import init_db
+
+# Initialize logger
+logger = get_app_logger()
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot, list and restore database backups")
+    parser.add_argument("--loop", action="store_true", help="Keep taking scheduled snapshots")
+    parser.add_argument("--list", action="store_true", help="List the snapshots, newest first")
+    parser.add_argument("--restore", metavar="PATH", help="Replace the database with this snapshot (stop the app first)")
+    parser.add_argument("--no-safety-snapshot", action="store_true",
+                        help="Do not snapshot the current database before restoring")
+    parser.add_argument("--retain", type=int, default=backup.BACKUP_RETAIN_COUNT,
+                        help="Snapshots to keep; 0 keeps all")
+    parser.add_argument("--compression", choices=["gzip", "none"], default=backup.BACKUP_COMPRESSION)
+    args = parser.parse_args()
+    
+    if args.list:
+        for entry in backup.list_backups():
+            print(f"{entry['created_at']:%Y-%m-%d %H:%M:%S} UTC  {entry['bytes'] / (1024 * 1024):>9.1f} MB  {entry['path']}")
+        return
+    
+    if args.restore:
+        if not args.no_safety_snapshot:
+            safety = backup.create_backup(label="pre-restore", compression=args.compression)
+            print(f"Current database saved to {safety['path']}")
+        print(json.dumps(backup.restore_backup(args.restore), indent=2))
+        # Bring a restored older database up to the current schema
+        init_db()
+        return
+    
+    init_db()
+    backup.BACKUP_RETAIN_COUNT = args.retain
+    backup.BACKUP_COMPRESSION = args.compression
+    if not args.loop:
+        with backup.backup_lock() as acquired:
+            if not acquired:
+                sys.exit("A backup is already running in another process")
+            report = backup.create_backup()
+            report["removed"] = backup.prune_backups()
+        print(json.dumps(report, indent=2))
+        return
+    
+    while True:
+        report = backup.run_scheduled_backup()
+        if report is not None:
+            print(json.dumps(report, indent=2))
+            sys.stdout.flush()
+        time.sleep(min(backup.BACKUP_INTERVAL_SECONDS, backup.SCHEDULE_CHECK_SECONDS))
+
+if __name__ == "__main__":
+    main()
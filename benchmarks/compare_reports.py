@@ -0,0 +1,100 @@
+"""
+Compare two benchmark reports and flag regressions.
+
+    python benchmarks/compare_reports.py baseline.json candidate.json --threshold 10
+
+Exits with status 1 when any compared value regressed by more than the
+threshold percentage, so it can gate CI runs between commits.
+"""
+import sys
+import json
+import argparse
+from typing import Dict, Any, List, Tuple
+
+# (path into a case, True if larger is better)
+CASE_VALUES = [
+    (("latency_seconds", "mean"), False),
+    (("latency_seconds", "p95"), False),
+    (("throughput", "audio_seconds_per_second"), True),
+    (("peak_rss_mb", "self"), False),
+]
+
+def _get(data: Dict[str, Any], path: Tuple[str, ...]):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+def _case_values(case: Dict[str, Any]) -> List[Tuple[str, float, bool]]:
+    values = []
+    for path, higher_is_better in CASE_VALUES:
+        value = _get(case, path)
+        if isinstance(value, (int, float)):
+            values.append((".".join(path), float(value), higher_is_better))
+    for stage, stats in case.get("stages", {}).items():
+        values.append((f"stages.{stage}.mean_seconds", float(stats["mean_seconds"]), False))
+    return values
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare matching cases of two reports.
+
+    Args:
+        baseline: Report from the reference commit
+        candidate: Report from the commit under test
+        threshold: Allowed change in percent before a value counts as regressed
+
+    Returns:
+        One row per compared value
+    """
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    rows = []
+    for case in candidate.get("cases", []):
+        reference = baseline_cases.get(case["name"])
+        if reference is None:
+            continue
+        reference_values = {name: value for name, value, _ in _case_values(reference)}
+        for name, value, higher_is_better in _case_values(case):
+            old = reference_values.get(name)
+            if old is None or old == 0:
+                continue
+            change = (value - old) / old * 100
+            worse = -change if higher_is_better else change
+            rows.append({
+                "case": case["name"],
+                "value": name,
+                "baseline": old,
+                "candidate": value,
+                "change_pct": round(change, 2),
+                "regressed": worse > threshold,
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent")
+    parser.add_argument("--json", action="store_true", help="Print rows as JSON")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"Baseline {baseline.get('commit', '?')[:10]} vs candidate {candidate.get('commit', '?')[:10]}")
+        for row in rows:
+            flag = "REGRESSED" if row["regressed"] else ""
+            print(f"{row['case']:<16} {row['value']:<40} {row['baseline']:>10.3f} -> "
+                  f"{row['candidate']:>10.3f} ({row['change_pct']:+.1f}%) {flag}")
+
+    sys.exit(1 if any(row["regressed"] for row in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark transcript compression in the database.
+
+Fills a scratch database with synthetic transcriptions and compares each
+codec (none, zlib, zstd when installed) on database size after VACUUM, the
+latency of reading one transcription and the latency of the listing query.
+
+    python benchmarks/compression_benchmark.py --rows 500 --words 6000 --output compression.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+VOCABULARY = (
+    "the court counsel witness deposition objection sustained overruled plaintiff defendant "
+    "agreement contract clause liability damages settlement exhibit record testimony client "
+    "meeting discussed property estate trust schedule filing motion hearing judge attorney "
+    "question answer yes no um uh so we will would could should said that this there then "
+    "on in at of for with about from to and but or if when because after before during"
+).split()
+
+def synthetic_transcript(rng: random.Random, words: int) -> Dict[str, str]:
+    """A Whisper-like transcript and a cleaned-up, paragraphed version of it."""
+    tokens = [rng.choice(VOCABULARY) for _ in range(words)]
+    whisper = " ".join(tokens)
+    sentences = []
+    for start in range(0, words, 18):
+        sentence = " ".join(t for t in tokens[start:start + 18] if t not in ("um", "uh"))
+        if sentence:
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+    paragraphs = [" ".join(sentences[i:i + 6]) for i in range(0, len(sentences), 6)]
+    return {"whisper": whisper, "processed": "\n\n".join(paragraphs)}
+
+def _time_calls(function, arguments: List[Any]) -> Dict[str, float]:
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p95_ms": round(timings[int(0.95 * (len(timings) - 1))], 3),
+    }
+
+def run_case(database, codec: str, transcripts: List[Dict[str, str]], audio_bytes: int, reads: int) -> Dict[str, Any]:
+    """Load the transcripts into a fresh database with one codec."""
+    if os.path.exists(database.DATABASE_FILE):
+        os.remove(database.DATABASE_FILE)
+    database._text_dictionaries.clear()
+    database.TRANSCRIPT_COMPRESSION = "none"
+    database.init_db()
+
+    # Write plain rows, then migrate them, the way an existing install would
+    audio = os.urandom(audio_bytes)
+    start = time.perf_counter()
+    ids = [
+        database.save_transcription("bench.mp3", "mp3", audio, t["whisper"], t["processed"], 600.0)
+        for t in transcripts
+    ]
+    insert_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    if codec != "none":
+        database.TRANSCRIPT_COMPRESSION = codec
+        database.compress_transcriptions(codec)
+    migrate_seconds = time.perf_counter() - start
+
+    conn = sqlite3.connect(database.DATABASE_FILE)
+    conn.execute("VACUUM")
+    conn.close()
+
+    # Round-trip check
+    sample = database.get_transcription(ids[0])
+    assert sample["processed_transcription"] == transcripts[0]["processed"]
+
+    rng = random.Random(1)
+    read_ids = [rng.choice(ids) for _ in range(reads)]
+    database.get_transcription(read_ids[0])  # warm the dictionary cache
+    return {
+        "codec": codec,
+        "rows": len(ids),
+        "db_size_mb": round(os.path.getsize(database.DATABASE_FILE) / (1024 * 1024), 3),
+        "insert_seconds": round(insert_seconds, 3),
+        "migrate_seconds": round(migrate_seconds, 3),
+        "get_transcription": _time_calls(database.get_transcription, read_ids),
+        "list_transcriptions": _time_calls(lambda _: database.get_all_transcriptions(), range(20)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcript compression")
+    parser.add_argument("--rows", type=int, default=300)
+    parser.add_argument("--words", type=int, default=5000, help="Words per transcript (~1 word per 0.4s of audio)")
+    parser.add_argument("--audio-kb", type=int, default=0, help="Size of the stored audio per row")
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="compression_bench_"))
+    sys.path.insert(0, REPO_ROOT)
+    import database
+    from utils import text_compression
+
+    rng = random.Random(0)
+    transcripts = [synthetic_transcript(rng, args.words) for _ in range(args.rows)]
+    codecs = ["none"] + [codec for codec in text_compression.CODECS if text_compression.available(codec)]
+
+    cases = []
+    for codec in codecs:
+        case = run_case(database, codec, transcripts, args.audio_kb * 1024, args.reads)
+        cases.append(case)
+        print(f"{codec:<5} {case['db_size_mb']:>9.2f} MB  get {case['get_transcription']['mean_ms']:>7.3f} ms  "
+              f"list {case['list_transcriptions']['mean_ms']:>8.3f} ms  migrate {case['migrate_seconds']:.2f}s")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "words": args.words, "cases": cases}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
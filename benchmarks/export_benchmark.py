@@ -0,0 +1,116 @@
+"""
+Benchmark PDF/Word/plaintext export across transcript sizes.
+
+Renders synthetic transcripts of increasing length through the export
+engine (the render process pool, like the /export route) and writes a report
+in the same case format as pipeline_benchmark.py, so two runs can be
+compared with compare_reports.py.
+
+    python benchmarks/export_benchmark.py --pages 1 30 300 --repeat 3 --output export.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from compression_benchmark import synthetic_transcript
+
+# Roughly what fits on a letter page in the PDF export
+WORDS_PER_PAGE = 500
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or "unknown"
+
+def _transcription(pages: int, single_block: bool) -> Dict[str, Any]:
+    texts = synthetic_transcript(random.Random(pages), pages * WORDS_PER_PAGE)
+    processed = texts["processed"].replace("\n\n", " ") if single_block else texts["processed"]
+    return {
+        "id": 1,
+        "original_filename": f"benchmark_{pages}p.mp3",
+        "file_type": "mp3",
+        "created_at": "2025-01-01 00:00:00",
+        "duration_seconds": pages * 200.0,
+        "whisper_transcription": texts["whisper"],
+        "processed_transcription": processed,
+    }
+
+def run_case(export_engine, format: str, pages: int, repeat: int, single_block: bool) -> Dict[str, Any]:
+    transcription = _transcription(pages, single_block)
+    latencies = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        path = export_engine.render_export(transcription, format)
+        latencies.append(time.perf_counter() - start)
+        size = os.path.getsize(path)
+        os.remove(path)
+    latencies.sort()
+    return {
+        "name": f"{format}_{pages}p{'_block' if single_block else ''}",
+        "format": format,
+        "pages": pages,
+        "output_bytes": size,
+        "latency_seconds": {
+            "mean": round(statistics.mean(latencies), 4),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 4),
+            "min": round(latencies[0], 4),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transcript exports")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 30, 300])
+    parser.add_argument("--formats", nargs="+", default=["pdf", "docx"], choices=["pdf", "docx"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single-block", action="store_true",
+                        help="Also render transcripts without paragraph breaks")
+    parser.add_argument("--output", default="export_benchmark.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    os.chdir(tempfile.mkdtemp(prefix="export_bench_"))
+    sys.path.insert(0, REPO_ROOT)
+    from utils import export_engine
+
+    # Start the render processes before timing anything
+    export_engine.get_render_pool()
+
+    cases = []
+    for format in args.formats:
+        for pages in args.pages:
+            for single_block in ([False, True] if args.single_block else [False]):
+                case = run_case(export_engine, format, pages, args.repeat, single_block)
+                cases.append(case)
+                print(f"{case['name']:<16} {case['latency_seconds']['mean']:>8.3f}s  "
+                      f"{case['output_bytes'] / 1024:>9.0f} KB")
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "export_processes": export_engine.EXPORT_PROCESSES,
+        "peak_rss_mb": {
+            "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        },
+        "cases": cases,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    export_engine.get_render_pool().close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-in for the OpenAI HTTP API used by the benchmarks.
+
+Implements the two endpoints the application calls, with configurable latency
+and error rates:
+
+    POST /v1/audio/transcriptions  -> {"text": ...}
+    POST /v1/chat/completions      -> chat completion echoing the user message
+
+Run standalone:
+
+    python benchmarks/fake_openai_server.py --port 8089 --whisper-latency 1.5 --error-rate 0.05
+
+and point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8089/v1.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional, Tuple
+
+WORDS = (
+    "the witness stated that on the evening in question she arrived at the office "
+    "and found the door unlocked counsel asked whether anyone else was present "
+    "and the witness replied that she could not recall the lease was signed in march "
+    "objection sustained please rephrase the question for the record"
+).split()
+
+class FakeOpenAIConfig:
+    """Latency and error settings shared by all request handlers."""
+
+    def __init__(
+        self,
+        whisper_latency: float = 0.5,
+        whisper_latency_per_mb: float = 0.2,
+        chat_latency: float = 1.0,
+        chat_latency_per_1k_tokens: float = 0.5,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        self.whisper_latency = whisper_latency
+        self.whisper_latency_per_mb = whisper_latency_per_mb
+        self.chat_latency = chat_latency
+        self.chat_latency_per_1k_tokens = chat_latency_per_1k_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"transcriptions": 0, "chat_completions": 0, "errors": 0}
+
+    def roll(self) -> Tuple[float, bool]:
+        """Return a jitter multiplier and whether this request should fail."""
+        with self.lock:
+            multiplier = 1.0 + self.random.uniform(-self.jitter, self.jitter)
+            fail = self.random.random() < self.error_rate
+        return multiplier, fail
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+def _fake_text(num_words: int) -> str:
+    # Sentences of 12 words, so long transcripts are post-processed in segments
+    words = [WORDS[i % len(WORDS)] for i in range(max(1, num_words))]
+    return " ".join(word + "." if i % 12 == 11 or i == len(words) - 1 else word for i, word in enumerate(words))
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: FakeOpenAIConfig = FakeOpenAIConfig()
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _fail(self):
+        self.config.count("errors")
+        self._send_json(500, {"error": {"message": "Injected failure", "type": "server_error"}})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.config.lock:
+                self._send_json(200, dict(self.config.stats))
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        multiplier, fail = self.config.roll()
+
+        if self.path.endswith("/audio/transcriptions"):
+            size_mb = len(body) / (1024 * 1024)
+            time.sleep((self.config.whisper_latency + size_mb * self.config.whisper_latency_per_mb) * multiplier)
+            if fail:
+                return self._fail()
+            self.config.count("transcriptions")
+            # Roughly 150 spoken words per MB of 128 kbps audio-minute
+            self._send_json(200, {"text": _fake_text(int(size_mb * 150))})
+
+        elif self.path.endswith("/chat/completions"):
+            request = json.loads(body or b"{}")
+            messages = request.get("messages", [])
+            user_text = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            completion_tokens = len(user_text) // 4
+            time.sleep((self.config.chat_latency
+                        + completion_tokens / 1000 * self.config.chat_latency_per_1k_tokens) * multiplier)
+            if fail:
+                return self._fail()
+            self.config.count("chat_completions")
+            self._send_json(200, {
+                "id": f"chatcmpl-fake-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": user_text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+def start_server(config: FakeOpenAIConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the fake server on a background thread.
+
+    Args:
+        config: Latency and error settings
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+
+    Returns:
+        The running server; server.server_address holds the bound address
+    """
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True)
+    thread.start()
+    return server
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Add the latency/error options shared by the benchmark scripts."""
+    parser.add_argument("--whisper-latency", type=float, default=0.5, help="Base Whisper latency in seconds")
+    parser.add_argument("--whisper-latency-per-mb", type=float, default=0.2, help="Extra Whisper latency per MB")
+    parser.add_argument("--chat-latency", type=float, default=1.0, help="Base GPT-4o latency in seconds")
+    parser.add_argument("--chat-latency-per-1k-tokens", type=float, default=0.5,
+                        help="Extra GPT-4o latency per 1000 completion tokens")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative latency jitter (0.1 = +/-10%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for jitter and errors")
+
+def config_from_args(args: argparse.Namespace) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        whisper_latency=args.whisper_latency,
+        whisper_latency_per_mb=args.whisper_latency_per_mb,
+        chat_latency=args.chat_latency,
+        chat_latency_per_1k_tokens=args.chat_latency_per_1k_tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI API server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(config_from_args(args), args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Fake OpenAI server listening on http://{host}:{port}/v1", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
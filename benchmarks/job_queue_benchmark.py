@@ -0,0 +1,269 @@
+"""
+Multi-process test of the leased job queue (utils/job_queue.py).
+
+Runs synthetic jobs through a SQLite job store with 1, 2, 4... worker
+processes and reports throughput and scaling efficiency. It also checks the
+guarantees the app relies on: every job runs exactly once while its workers
+stay healthy, a job whose worker is killed mid-lease is requeued and
+finished by another worker, a short job submitted behind one user's backlog
+of long recordings runs next, and a long job behind a never-ending stream of
+short ones still starts within JOB_MAX_WAIT_SECONDS.
+
+    python benchmarks/job_queue_benchmark.py --workers 1 2 4 8 --jobs 200 \\
+        --job-seconds 0.05 --output job_queue.json
+
+Exits with status 1 if a check fails.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import multiprocessing
+from typing import Dict, List, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+def _prepare_child(workdir: str, verbose: bool):
+    # Import the app modules from inside the scratch directory so their
+    # logs/ and db/ directories are created there
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    if not verbose:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+
+def _sleep_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Record the execution before returning so duplicates are visible even
+    # if the worker dies before completing the job
+    with open(os.path.join(payload["log_dir"], f"{os.getpid()}.log"), "a") as f:
+        f.write(f"{payload['n']}\n")
+    time.sleep(payload["seconds"])
+    return {"pid": os.getpid()}
+
+def _worker_process(store_url: str, workdir: str, lease_seconds: float, verbose: bool):
+    """Run jobs until the queue has drained."""
+    _prepare_child(workdir, verbose)
+    from utils.job_queue import Worker, open_job_store
+
+    store = open_job_store(store_url)
+    worker = Worker(store, {"sleep": _sleep_job}, lease_seconds=lease_seconds, poll_interval=0.05)
+    while True:
+        if not worker.run_once():
+            counts = store.counts()
+            if counts["queued"] == 0 and counts["leased"] == 0:
+                return
+            time.sleep(0.05)
+
+def _read_executions(log_dir: str) -> List[int]:
+    executions = []
+    for name in os.listdir(log_dir):
+        with open(os.path.join(log_dir, name)) as f:
+            executions.extend(int(line) for line in f if line.strip())
+    return executions
+
+def run_scaling_case(workdir: str, workers: int, jobs: int, job_seconds: float, verbose: bool) -> Dict[str, Any]:
+    """Drain a queue of sleep jobs with the given number of worker processes."""
+    from utils.job_queue import open_job_store
+
+    case_dir = tempfile.mkdtemp(dir=workdir, prefix=f"workers{workers}_")
+    log_dir = os.path.join(case_dir, "executions")
+    os.makedirs(log_dir)
+    store_url = f"sqlite:///{os.path.join(case_dir, 'jobs.db')}"
+    store = open_job_store(store_url)
+    for n in range(jobs):
+        store.enqueue("sleep", {"n": n, "seconds": job_seconds, "log_dir": log_dir})
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(store_url, workdir, 30.0, verbose))
+        for _ in range(workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    executions = _read_executions(log_dir)
+    counts = store.counts()
+    return {
+        "workers": workers,
+        "jobs": jobs,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(jobs / elapsed, 2),
+        "done": counts["done"],
+        "duplicate_executions": len(executions) - len(set(executions)),
+        "lost_jobs": jobs - len(set(executions)),
+    }
+
+def run_crash_case(workdir: str, lease_seconds: float, verbose: bool) -> Dict[str, Any]:
+    """Kill a worker holding a lease and check that its job is finished by another."""
+    from utils.job_queue import open_job_store
+
+    case_dir = tempfile.mkdtemp(dir=workdir, prefix="crash_")
+    log_dir = os.path.join(case_dir, "executions")
+    os.makedirs(log_dir)
+    store_url = f"sqlite:///{os.path.join(case_dir, 'jobs.db')}"
+    store = open_job_store(store_url)
+    job_id = store.enqueue("sleep", {"n": 0, "seconds": lease_seconds * 4, "log_dir": log_dir})
+
+    context = multiprocessing.get_context("spawn")
+    victim = context.Process(target=_worker_process, args=(store_url, workdir, lease_seconds, verbose))
+    victim.start()
+    while store.get(job_id)["status"] != "leased":
+        time.sleep(0.05)
+    os.kill(victim.pid, signal.SIGKILL)
+    victim.join()
+    killed_at = time.perf_counter()
+
+    rescuer = context.Process(target=_worker_process, args=(store_url, workdir, lease_seconds, verbose))
+    rescuer.start()
+    rescuer.join()
+    job = store.get(job_id)
+    return {
+        "lease_seconds": lease_seconds,
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "recovered_after_seconds": round(time.perf_counter() - killed_at, 2),
+        "executions": len(_read_executions(log_dir)),
+    }
+
+def run_scheduling_case(workdir: str, workers: int, backlog: int, time_scale: float,
+                        verbose: bool) -> Dict[str, Any]:
+    """Queue one user's backlog of hour-long recordings, then a colleague's 2-minute memo."""
+    from utils.job_queue import open_job_store
+
+    case_dir = tempfile.mkdtemp(dir=workdir, prefix="scheduling_")
+    log_dir = os.path.join(case_dir, "executions")
+    os.makedirs(log_dir)
+    store_url = f"sqlite:///{os.path.join(case_dir, 'jobs.db')}"
+    store = open_job_store(store_url)
+    for n in range(backlog):
+        store.enqueue("sleep", {"n": n, "seconds": 3600 * time_scale, "log_dir": log_dir},
+                      user_id="backlog", cost=3600)
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(store_url, workdir, 30.0, verbose))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    while store.counts()["leased"] < workers:
+        time.sleep(0.01)
+
+    submitted = time.perf_counter()
+    memo_id = store.enqueue("sleep", {"n": backlog, "seconds": 120 * time_scale, "log_dir": log_dir},
+                            user_id="colleague", cost=120)
+    while store.get(memo_id)["status"] != "done":
+        time.sleep(0.01)
+    memo_seconds = time.perf_counter() - submitted
+    for process in processes:
+        process.join()
+
+    return {
+        "workers": workers,
+        "backlog_jobs": backlog,
+        "memo_seconds": round(memo_seconds, 3),
+        # Worst case: every worker had only just started a long job
+        "memo_bound_seconds": round((3600 + 120) * time_scale, 3),
+        "arrival_order_seconds": round((backlog * 3600 / workers + 120) * time_scale, 3),
+    }
+
+def run_starvation_case(workdir: str, max_wait: float, verbose: bool) -> Dict[str, Any]:
+    """Keep a single worker busy with short jobs and check that a long job still starts."""
+    from utils.job_queue import open_job_store
+
+    case_dir = tempfile.mkdtemp(dir=workdir, prefix="starvation_")
+    log_dir = os.path.join(case_dir, "executions")
+    os.makedirs(log_dir)
+    store_url = f"sqlite:///{os.path.join(case_dir, 'jobs.db')}"
+    store = open_job_store(store_url)
+    long_id = store.enqueue("sleep", {"n": 0, "seconds": 0.01, "log_dir": log_dir}, user_id="long", cost=7200)
+
+    # The worker reads the bound from its environment
+    os.environ["JOB_MAX_WAIT_SECONDS"] = str(max_wait)
+    context = multiprocessing.get_context("spawn")
+    worker = context.Process(target=_worker_process, args=(store_url, workdir, 30.0, verbose))
+    worker.start()
+    del os.environ["JOB_MAX_WAIT_SECONDS"]
+
+    # Short jobs from new users arrive faster than the worker can run them
+    n = 1
+    deadline = time.perf_counter() + max_wait * 10
+    while store.get(long_id)["status"] == "queued" and time.perf_counter() < deadline:
+        store.enqueue("sleep", {"n": n, "seconds": 0.02, "log_dir": log_dir}, user_id=f"user{n}", cost=60)
+        n += 1
+        time.sleep(0.01)
+    job = store.get(long_id)
+    worker.join()
+
+    return {
+        "max_wait_seconds": max_wait,
+        "short_jobs_submitted": n - 1,
+        "long_job_started": job["started_at"] is not None,
+        "long_job_wait_seconds": round(job["started_at"] - job["created_at"], 3) if job["started_at"] else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process test of the leased job queue")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--job-seconds", type=float, default=0.05, help="Simulated work per job")
+    parser.add_argument("--lease-seconds", type=float, default=1.0, help="Lease used by the crash test")
+    parser.add_argument("--backlog", type=int, default=20, help="Long jobs queued ahead of the short one")
+    parser.add_argument("--time-scale", type=float, default=0.0001,
+                        help="Simulated work per second of audio in the scheduling test")
+    parser.add_argument("--max-wait", type=float, default=2.0, help="JOB_MAX_WAIT_SECONDS for the starvation test")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show worker logs")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="job_queue_bench_")
+    _prepare_child(workdir, True)
+
+    cases = []
+    for workers in args.workers:
+        case = run_scaling_case(workdir, workers, args.jobs, args.job_seconds, args.verbose)
+        cases.append(case)
+    base = cases[0]["jobs_per_second"] / cases[0]["workers"]
+    for case in cases:
+        case["scaling_efficiency"] = round(case["jobs_per_second"] / (base * case["workers"]), 2)
+        print(f"{case['workers']:>3} workers: {case['jobs_per_second']:>8.1f} jobs/s "
+              f"(efficiency {case['scaling_efficiency']:.2f}, duplicates {case['duplicate_executions']}, "
+              f"lost {case['lost_jobs']})")
+
+    crash = run_crash_case(workdir, args.lease_seconds, args.verbose)
+    print(f"crash test: job {crash['status']} after {crash['attempts']} attempts, "
+          f"recovered {crash['recovered_after_seconds']}s after the kill")
+
+    scheduling = run_scheduling_case(workdir, 2, args.backlog, args.time_scale, args.verbose)
+    print(f"scheduling: 2-minute job done {scheduling['memo_seconds']}s after submission behind "
+          f"{scheduling['backlog_jobs']} hour-long jobs (arrival order: {scheduling['arrival_order_seconds']}s)")
+
+    starvation = run_starvation_case(workdir, args.max_wait, args.verbose)
+    print(f"starvation: long job waited {starvation['long_job_wait_seconds']}s behind "
+          f"{starvation['short_jobs_submitted']} short jobs (bound {starvation['max_wait_seconds']}s)")
+
+    ok = all(case["duplicate_executions"] == 0 and case["lost_jobs"] == 0 for case in cases)
+    ok = ok and crash["status"] == "done" and crash["attempts"] == 2
+    # Allow for polling and process startup on top of the scheduling bounds
+    ok = ok and scheduling["memo_seconds"] <= scheduling["memo_bound_seconds"] + 1.0
+    ok = ok and starvation["long_job_started"] and starvation["long_job_wait_seconds"] <= args.max_wait + 3.0
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"cases": cases, "crash": crash, "scheduling": scheduling,
+                       "starvation": starvation, "ok": ok}, f, indent=2)
+
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
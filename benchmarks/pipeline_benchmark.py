@@ -0,0 +1,219 @@
+"""
+End-to-end benchmark of the upload_file pipeline.
+
+Generates synthetic audio, starts the fake OpenAI server in a subprocess,
+drives POST /upload through the Flask test client and writes a JSON report
+with per-stage timings (from utils.metrics), peak RSS and throughput.
+
+    python benchmarks/pipeline_benchmark.py --durations 60 600 --formats mp3 wav \\
+        --repeat 3 --concurrency 2 --output bench.json
+
+Compare two reports with benchmarks/compare_reports.py.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+import statistics
+from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Any
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_audio import generate_speech_like_audio
+from fake_openai_server import add_config_arguments
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or "unknown"
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is reported in kilobytes on Linux
+    self_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": round(self_usage / 1024, 1), "children": round(children_usage / 1024, 1)}
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def _stage_deltas(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Per-stage count and total seconds observed between two metric snapshots."""
+    def by_stage(snapshot):
+        data = snapshot.get("transcribe_stage_duration_seconds", {"samples": []})
+        return {labels[0]: value for labels, value in data["samples"]}
+
+    start, end = by_stage(before), by_stage(after)
+    stages = {}
+    for stage, value in end.items():
+        prev = start.get(stage, {"counts": [0] * len(value["counts"]), "sum": 0.0})
+        count = sum(value["counts"]) - sum(prev["counts"])
+        total = value["sum"] - prev["sum"]
+        if count:
+            stages[stage] = {
+                "count": count,
+                "total_seconds": round(total, 4),
+                "mean_seconds": round(total / count, 4),
+            }
+    return stages
+
+def _start_fake_server(args) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "fake_openai_server.py"), "--port", "0",
+           "--whisper-latency", str(args.whisper_latency),
+           "--whisper-latency-per-mb", str(args.whisper_latency_per_mb),
+           "--chat-latency", str(args.chat_latency),
+           "--chat-latency-per-1k-tokens", str(args.chat_latency_per_1k_tokens),
+           "--jitter", str(args.jitter),
+           "--error-rate", str(args.error_rate)]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+
+def run_benchmark(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="transcribe_bench_")
+    audio_dir = os.path.join(workdir, "audio")
+    os.makedirs(audio_dir)
+
+    # Generate inputs before the app is imported so ffmpeg time is not measured
+    inputs = []
+    for duration in args.durations:
+        for fmt in args.formats:
+            path = os.path.join(audio_dir, f"synthetic_{int(duration)}s.{fmt}")
+            print(f"Generating {path}", file=sys.stderr)
+            generate_speech_like_audio(path, duration, sample_rate=args.sample_rate)
+            inputs.append({"name": f"{fmt}_{int(duration)}s", "path": path, "format": fmt, "duration": duration})
+
+    server = _start_fake_server(args)
+    try:
+        base_url = server.stdout.readline().strip().rsplit(" ", 1)[-1]
+        os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+        os.environ["OPENAI_BASE_URL"] = base_url
+        # Every run sends the same synthetic transcript, which would be served
+        # from the response cache; the fake server has no embeddings endpoint
+        os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+        os.environ.setdefault("SEMANTIC_SEARCH_ENABLED", "0")
+
+        # The app keeps its database, uploads and logs relative to the cwd
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_ROOT)
+        import app as app_module
+        from utils import metrics
+        from database import init_db
+        init_db()
+
+        cases = []
+        for item in inputs:
+            file_size = os.path.getsize(item["path"])
+
+            def upload(_):
+                client = app_module.app.test_client()
+                with open(item["path"], "rb") as f:
+                    start = time.perf_counter()
+                    response = client.post(
+                        "/upload",
+                        data={"file": (f, os.path.basename(item["path"]))},
+                        content_type="multipart/form-data",
+                    )
+                    elapsed = time.perf_counter() - start
+                location = response.headers.get("Location", "")
+                return elapsed, response.status_code == 302 and "/transcription/" in location
+
+            before = metrics.collect()
+            case_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(upload, range(args.repeat * args.concurrency)))
+            case_wall = time.perf_counter() - case_start
+            after = metrics.collect()
+
+            latencies = [elapsed for elapsed, _ in results]
+            succeeded = sum(1 for _, ok in results if ok)
+            cases.append({
+                "name": item["name"],
+                "format": item["format"],
+                "audio_seconds": item["duration"],
+                "file_bytes": file_size,
+                "uploads": len(results),
+                "succeeded": succeeded,
+                "failed": len(results) - succeeded,
+                "latency_seconds": {
+                    "mean": round(statistics.mean(latencies), 4),
+                    "p50": round(_percentile(latencies, 50), 4),
+                    "p95": round(_percentile(latencies, 95), 4),
+                    "max": round(max(latencies), 4),
+                },
+                "throughput": {
+                    "jobs_per_minute": round(succeeded / case_wall * 60, 3),
+                    "audio_seconds_per_second": round(item["duration"] * succeeded / case_wall, 3),
+                    "megabytes_per_second": round(file_size * succeeded / case_wall / (1024 * 1024), 3),
+                },
+                "stages": _stage_deltas(before, after),
+                "peak_rss_mb": _peak_rss_mb(),
+            })
+            print(f"{item['name']}: mean {cases[-1]['latency_seconds']['mean']:.2f}s, "
+                  f"{succeeded}/{len(results)} succeeded", file=sys.stderr)
+
+        with urlopen(base_url.rsplit("/v1", 1)[0] + "/stats", timeout=10) as response:
+            server_stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "pipeline",
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "parameters": {
+            "durations": args.durations,
+            "formats": args.formats,
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "whisper_latency": args.whisper_latency,
+            "chat_latency": args.chat_latency,
+            "error_rate": args.error_rate,
+        },
+        "fake_server": server_stats,
+        "peak_rss_mb": _peak_rss_mb(),
+        "cases": cases,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end transcription pipeline benchmark")
+    parser.add_argument("--durations", type=float, nargs="+", default=[60.0, 600.0],
+                        help="Synthetic audio lengths in seconds")
+    parser.add_argument("--formats", nargs="+", default=["mp3"], help="Audio formats (mp3, wav, flac, ogg, m4a)")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--repeat", type=int, default=3, help="Uploads per case and concurrency slot")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent uploads")
+    parser.add_argument("--output", default="pipeline_benchmark.json", help="Write the JSON report here")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the temporary working directory")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    # The benchmark changes into a temporary working directory
+    args.output = os.path.abspath(args.output)
+
+    report = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"Report written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Query latency and recall of the semantic search index at scale.
+
+Fills a throwaway index with synthetic clustered unit vectors (no embedding
+calls), then times queries with exhaustive search and, after training, with
+the IVF index. Recall@k is the share of the exhaustive top k that the IVF
+search also returns. The report uses the same case format as
+pipeline_benchmark.py, so two runs can be compared with compare_reports.py:
+
+    python benchmarks/search_benchmark.py --slices 100000 1000000 --output search.json
+
+A million 256-dimension slices take 1 GB of disk and page cache.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, Any, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rows written per add() call while filling the index
+FILL_BATCH = 20000
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or "unknown"
+
+def _clustered_vectors(np, rng, centers, count: int):
+    """Unit vectors scattered around topic directions, like real text embeddings."""
+    noise = rng.standard_normal((count, centers.shape[1])).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.6 * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "mean": round(statistics.mean(samples), 5),
+        "p95": round(samples[int(0.95 * (len(samples) - 1))], 5),
+        "min": round(samples[0], 5),
+    }
+
+def run_size(semantic_search, np, slices: int, dimensions: int, queries: int, k: int,
+             probes: List[int]) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(slices)
+    index = semantic_search.VectorIndex(tempfile.mkdtemp(prefix="search_bench_"))
+    try:
+        centers = rng.standard_normal((max(16, slices // 2000), dimensions)).astype(np.float32)
+        index.reset("bench", dimensions)
+        fill_started = time.perf_counter()
+        for start in range(0, slices, FILL_BATCH):
+            count = min(FILL_BATCH, slices - start)
+            vectors = _clustered_vectors(np, rng, centers, count)
+            # (batch, row in batch) identifies every slice
+            index.add("bench", start, [(i, i + 1) for i in range(count)], vectors)
+        fill_seconds = time.perf_counter() - fill_started
+        query_vectors = _clustered_vectors(np, rng, centers, queries)
+
+        # Warm the page cache, as a serving index would be
+        index.search(query_vectors[0], k, exact=True)
+        exact_results, exact_latencies = [], []
+        for query in query_vectors:
+            started = time.perf_counter()
+            exact_results.append(index.search(query, k, exact=True))
+            exact_latencies.append(time.perf_counter() - started)
+        cases = [{
+            "name": f"exact_{slices}",
+            "slices": slices,
+            "fill_seconds": round(fill_seconds, 2),
+            "latency_seconds": _latency(exact_latencies),
+        }]
+
+        train_started = time.perf_counter()
+        trained = index.train_ivf()
+        train_seconds = time.perf_counter() - train_started
+        minimum = semantic_search.IVF_MIN_SLICES
+        semantic_search.IVF_MIN_SLICES = 0
+        try:
+            for probe_count in probes:
+                latencies, recalls = [], []
+                for query, expected in zip(query_vectors, exact_results):
+                    started = time.perf_counter()
+                    found = index.search(query, k, probes=probe_count)
+                    latencies.append(time.perf_counter() - started)
+                    expected_keys = {(hit[1], hit[2]) for hit in expected}
+                    recalls.append(len(expected_keys & {(hit[1], hit[2]) for hit in found}) / max(1, len(expected)))
+                cases.append({
+                    "name": f"ivf_{slices}_p{probe_count}",
+                    "slices": slices,
+                    "lists": trained["lists"],
+                    "probes": probe_count,
+                    "train_seconds": round(train_seconds, 2),
+                    "recall_at_k": round(statistics.mean(recalls), 4),
+                    "latency_seconds": _latency(latencies),
+                })
+        finally:
+            semantic_search.IVF_MIN_SLICES = minimum
+        return cases
+    finally:
+        shutil.rmtree(index.path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark semantic search")
+    parser.add_argument("--slices", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--probes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--output", default="search_benchmark.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    os.chdir(tempfile.mkdtemp(prefix="search_bench_"))
+    sys.path.insert(0, REPO_ROOT)
+    import numpy as np
+    from utils import semantic_search
+
+    cases = []
+    for slices in args.slices:
+        for case in run_size(semantic_search, np, slices, args.dimensions, args.queries, args.k, args.probes):
+            cases.append(case)
+            recall = f"  recall@{args.k} {case['recall_at_k']:.3f}" if "recall_at_k" in case else ""
+            print(f"{case['name']:<20} {case['latency_seconds']['mean'] * 1000:>8.1f} ms mean  "
+                  f"{case['latency_seconds']['p95'] * 1000:>8.1f} ms p95{recall}")
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "dimensions": args.dimensions,
+        "k": args.k,
+        "cases": cases,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
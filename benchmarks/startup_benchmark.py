@@ -0,0 +1,128 @@
+"""
+Measure how long the entry points take to import.
+
+Every gunicorn worker, queue worker and maintenance run pays the import cost
+of its entry point before it does anything useful, so heavy dependencies are
+imported where they are first used rather than at module level. This
+benchmark keeps an eye on that: each module is imported in a fresh
+interpreter, the wall time is recorded, and one extra run with
+``-X importtime`` attributes the cost to the modules it imports directly.
+
+The report uses the same case format as pipeline_benchmark.py, with the
+direct imports as stages, so two runs can be compared with
+compare_reports.py:
+
+    python benchmarks/startup_benchmark.py --repeat 5 --output startup.json
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+# Prints the import wall time and peak RSS of the child as JSON
+CHILD_SCRIPT = """
+import json, time, resource
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() or "unknown"
+
+def _run(args: List[str], cwd: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def parse_importtime(output: str, module: str) -> List[Tuple[str, int, float, float]]:
+    """
+    Modules imported while importing ``module``.
+
+    Returns:
+        (name, depth, self seconds, cumulative seconds) in the order the
+        interpreter reported them; depth 1 are the module's direct imports
+    """
+    rows = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, len(indent) // 2, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+
+    # A module's imports are listed before it; its tree starts after the
+    # previous top-level entry
+    end = max(i for i, row in enumerate(rows) if row[0] == module and row[1] == 0)
+    start = end
+    while start > 0 and rows[start - 1][1] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+def run_case(module: str, repeat: int, top: int) -> Dict[str, Any]:
+    cwd = tempfile.mkdtemp(prefix="startup_bench_")
+    # The first import creates and migrates the database; later ones should
+    # only find it current
+    _run(["-c", f"import {module}"], cwd)
+
+    timings = [json.loads(_run(["-c", CHILD_SCRIPT.format(module=module)], cwd).stdout.splitlines()[-1])
+               for _ in range(repeat)]
+    latencies = sorted(timing["seconds"] for timing in timings)
+
+    tree = parse_importtime(_run(["-X", "importtime", "-c", f"import {module}"], cwd).stderr, module)
+    direct = sorted((row for row in tree if row[1] == 1), key=lambda row: row[3], reverse=True)
+    slowest = sorted(tree[:-1], key=lambda row: row[2], reverse=True)[:top]
+    return {
+        "name": f"import_{module}",
+        "module": module,
+        "latency_seconds": {
+            "mean": round(statistics.mean(latencies), 4),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 4),
+            "min": round(latencies[0], 4),
+        },
+        "peak_rss_mb": {"self": round(max(timing["rss_mb"] for timing in timings), 1)},
+        "module_self_seconds": round(tree[-1][2], 4),
+        "stages": {name: {"mean_seconds": round(cumulative, 4)} for name, _, _, cumulative in direct},
+        "slowest_modules": [{"module": name, "self_seconds": round(seconds, 4)} for name, _, seconds, _ in slowest],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark entry point import time")
+    parser.add_argument("--modules", nargs="+", default=["app", "worker", "asgi", "maintenance"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Slowest individual modules to list per case")
+    parser.add_argument("--output", default="startup_benchmark.json")
+    args = parser.parse_args()
+
+    cases = []
+    for module in args.modules:
+        case = run_case(module, args.repeat, args.top)
+        cases.append(case)
+        heaviest = ", ".join(f"{name} {stats['mean_seconds'] * 1000:.0f}ms"
+                             for name, stats in list(case["stages"].items())[:3])
+        print(f"{case['name']:<20} {case['latency_seconds']['mean']:>7.3f}s  "
+              f"{case['peak_rss_mb']['self']:>6.1f} MB  ({heaviest})")
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "cases": cases,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
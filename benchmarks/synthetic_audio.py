@@ -0,0 +1,96 @@
+"""
+Generate synthetic speech-like audio with FFmpeg.
+
+The signal is band-limited pink noise (telephone speech band) amplitude
+modulated at a syllable-like rate, broken up by pauses, so that encoders,
+splitting and silence handling behave roughly as they do on real recordings.
+
+    python benchmarks/synthetic_audio.py out.mp3 --duration 600
+"""
+import os
+import argparse
+import subprocess
+from typing import Optional
+
+# Codec options per output extension
+FORMAT_OPTIONS = {
+    ".mp3": ["-c:a", "libmp3lame", "-b:a", "128k"],
+    ".wav": ["-c:a", "pcm_s16le"],
+    ".flac": ["-c:a", "flac"],
+    ".ogg": ["-c:a", "libvorbis", "-q:a", "4"],
+    ".m4a": ["-c:a", "aac", "-b:a", "128k"],
+    ".mp4": ["-c:a", "aac", "-b:a", "128k"],
+}
+
+def generate_speech_like_audio(
+    output_path: str,
+    duration: float,
+    sample_rate: int = 44100,
+    channels: int = 1,
+    speech_seconds: float = 6.0,
+    pause_seconds: float = 2.0,
+    bitrate: Optional[str] = None
+) -> str:
+    """
+    Generate a speech-like audio file.
+
+    Args:
+        output_path: Destination file; the extension selects the format
+        duration: Length in seconds
+        sample_rate: Output sample rate
+        channels: Output channel count
+        speech_seconds: Length of each "utterance"
+        pause_seconds: Length of the silence between utterances
+        bitrate: Override the default bitrate for lossy formats (e.g. "64k")
+
+    Returns:
+        Path to the generated file
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in FORMAT_OPTIONS:
+        raise ValueError(f"Unsupported output format: {ext}")
+
+    period = speech_seconds + pause_seconds
+    audio_filter = ",".join([
+        "highpass=f=300",
+        "lowpass=f=3400",
+        # Syllable-rate amplitude modulation
+        "tremolo=f=4:d=0.8",
+        # Gate the signal off for the pause part of each period
+        f"volume='if(lt(mod(t,{period}),{speech_seconds}),1,0)':eval=frame",
+    ])
+
+    codec_options = list(FORMAT_OPTIONS[ext])
+    if bitrate and "-b:a" in codec_options:
+        codec_options[codec_options.index("-b:a") + 1] = bitrate
+
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi",
+        "-i", f"anoisesrc=color=pink:amplitude=0.3:sample_rate={sample_rate}:duration={duration}",
+        "-af", audio_filter,
+        "-ac", str(channels),
+        *codec_options,
+        output_path
+    ]
+
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise ValueError(f"Error generating synthetic audio: {result.stderr}")
+
+    return output_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic speech-like audio")
+    parser.add_argument("output", help="Output file (.mp3, .wav, .flac, .ogg, .m4a, .mp4)")
+    parser.add_argument("--duration", type=float, default=60.0, help="Length in seconds")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--bitrate", default=None)
+    args = parser.parse_args()
+
+    generate_speech_like_audio(args.output, args.duration, args.sample_rate, args.channels, bitrate=args.bitrate)
+    print(args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Accuracy versus speed of the tempo mode (TEMPO_FACTOR) on reference clips.
+
+Reference clips are local recordings with a checked transcript, grouped by
+instruction profile in one directory each:
+
+    refs/depositions/witness_1.mp3
+    refs/depositions/witness_1.txt
+    refs/client_meetings/intake.m4a
+    refs/client_meetings/intake.txt
+
+Every clip is sped up by each factor and sent to Whisper. The report records
+the word error rate (WER) against the reference, Whisper latency and billed
+audio per clip and factor. For each profile it recommends the largest factor
+whose mean WER is at most --max-wer-increase above that of the unmodified
+audio. Clips of a few minutes each are enough.
+
+This calls the real Whisper API (OPENAI_API_KEY) and is billed. Run it from
+the repository root:
+
+    python benchmarks/tempo_benchmark.py refs --factors 1.25 1.5 1.75 2.0 --output tempo.json
+
+--apply PROFILE=INSTRUCTION stores the recommended factor on the custom
+instruction with that name, so its jobs use it from then on.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+from typing import Dict, List, Any, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".mp4", ".m4a", ".ogg", ".flac"}
+
+def normalize_words(text: str) -> List[str]:
+    """Lowercase words without punctuation, so formatting does not count as errors."""
+    return re.sub(r"[^\w' ]+", " ", text.lower()).split()
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance divided by the reference length."""
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,                            # deletion
+                current[j - 1] + 1,                         # insertion
+                previous[j - 1] + (ref_word != hyp_word),   # substitution
+            ))
+        previous = current
+    return previous[-1] / len(ref)
+
+def find_clips(refs_dir: str) -> Dict[str, List[Dict[str, str]]]:
+    """Profile name -> clips with an audio file and a reference transcript."""
+    profiles = {}
+    for profile in sorted(os.listdir(refs_dir)):
+        profile_dir = os.path.join(refs_dir, profile)
+        if not os.path.isdir(profile_dir):
+            continue
+        clips = []
+        for name in sorted(os.listdir(profile_dir)):
+            stem, ext = os.path.splitext(name)
+            reference = os.path.join(profile_dir, stem + ".txt")
+            if ext.lower() in AUDIO_EXTENSIONS and os.path.exists(reference):
+                clips.append({"name": name, "audio": os.path.join(profile_dir, name), "reference": reference})
+        if clips:
+            profiles[profile] = clips
+    return profiles
+
+def run_clip(clip: Dict[str, str], factor: float) -> Dict[str, Any]:
+    from utils.audio_handler import apply_tempo, get_audio_duration
+    from utils.openai_client import transcribe_audio
+
+    with open(clip["reference"], encoding="utf-8") as f:
+        reference = f.read()
+    duration = get_audio_duration(clip["audio"])
+    audio_path = apply_tempo(clip["audio"], factor) if factor > 1.0 else clip["audio"]
+    try:
+        start = time.perf_counter()
+        text = transcribe_audio(audio_path, audio_seconds=duration / factor)
+        latency = time.perf_counter() - start
+    finally:
+        if audio_path != clip["audio"]:
+            os.remove(audio_path)
+    return {
+        "clip": clip["name"],
+        "factor": factor,
+        "wer": round(word_error_rate(reference, text), 4),
+        "whisper_seconds": round(latency, 3),
+        "billed_seconds": round(duration / factor, 2),
+    }
+
+def recommend(results: List[Dict[str, Any]], max_increase: float) -> Dict[str, Any]:
+    """Summarize one profile's results by factor and pick the safe factor."""
+    by_factor = {}
+    for result in results:
+        by_factor.setdefault(result["factor"], []).append(result)
+    summary = {
+        factor: {
+            "mean_wer": round(statistics.mean(r["wer"] for r in rows), 4),
+            "whisper_seconds": round(sum(r["whisper_seconds"] for r in rows), 2),
+            "billed_seconds": round(sum(r["billed_seconds"] for r in rows), 2),
+        }
+        for factor, rows in sorted(by_factor.items())
+    }
+    baseline = summary[1.0]["mean_wer"]
+    safe = max(factor for factor, row in summary.items() if row["mean_wer"] - baseline <= max_increase)
+    return {"factors": summary, "baseline_wer": baseline, "recommended_factor": safe}
+
+def apply_recommendations(profiles: Dict[str, Dict[str, Any]], mappings: List[str]):
+    from database import get_all_custom_instructions, set_custom_instruction_tempo
+
+    instructions = {instruction["name"]: instruction["id"] for instruction in get_all_custom_instructions()}
+    for mapping in mappings:
+        profile, _, name = mapping.partition("=")
+        if profile not in profiles or name not in instructions:
+            print(f"skipping {mapping}: unknown profile or instruction")
+            continue
+        factor: Optional[float] = profiles[profile]["recommended_factor"]
+        set_custom_instruction_tempo(instructions[name], factor if factor > 1.0 else None)
+        print(f"{name}: speed-up set to {factor:g}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy versus speed of the tempo mode")
+    parser.add_argument("refs_dir", help="Directory with one subdirectory of reference clips per profile")
+    parser.add_argument("--factors", type=float, nargs="+", default=[1.25, 1.5, 1.75, 2.0])
+    parser.add_argument("--max-wer-increase", type=float, default=0.02,
+                        help="Largest acceptable WER increase over the unmodified audio (absolute)")
+    parser.add_argument("--apply", nargs="*", default=[], metavar="PROFILE=INSTRUCTION",
+                        help="Store the recommended factor on these custom instructions")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    from utils.audio_handler import validate_tempo_factor
+
+    factors = sorted({1.0, *(validate_tempo_factor(factor) for factor in args.factors)})
+    clips = find_clips(args.refs_dir)
+    if not clips:
+        sys.exit(f"No clips with reference transcripts found under {args.refs_dir}")
+
+    profiles = {}
+    for profile, profile_clips in clips.items():
+        results = [run_clip(clip, factor) for clip in profile_clips for factor in factors]
+        profiles[profile] = recommend(results, args.max_wer_increase)
+        profiles[profile]["results"] = results
+        print(f"{profile} ({len(profile_clips)} clips)")
+        baseline = profiles[profile]["factors"][1.0]
+        for factor, row in profiles[profile]["factors"].items():
+            print(f"  {factor:>5.2f}x  WER {row['mean_wer']:.3f}  "
+                  f"Whisper {row['whisper_seconds'] / baseline['whisper_seconds']:.0%} of 1x time, "
+                  f"billed {row['billed_seconds']:.0f}s")
+        print(f"  recommended: {profiles[profile]['recommended_factor']:g}x")
+
+    if args.apply:
+        apply_recommendations(profiles, args.apply)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"max_wer_increase": args.max_wer_increase, "profiles": profiles}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 import sqlite3
 import os
+import json
 import datetime
+import threading
 import traceback
 from typing import Dict, List, Optional, Any, Tuple
 
 from utils.logging_config import get_db_logger
+from utils import text_compression
 
 # Initialize logger
 logger = get_db_logger()
@@ -14,6 +17,39 @@ DB_DIR = os.path.join(os.getcwd(), "db")
 os.makedirs(DB_DIR, exist_ok=True)
 DATABASE_FILE = os.path.join(DB_DIR, "transcriptions.db")
 
+# Compression of stored transcript text: "zlib", "zstd" (needs the optional
+# zstandard package) or "none". Rows are decoded by the codec they were
+# written with, so this can be changed at any time.
+TRANSCRIPT_COMPRESSION = os.getenv("TRANSCRIPT_COMPRESSION", "none").lower()
+TRANSCRIPT_COMPRESSION_LEVEL = int(os.getenv("TRANSCRIPT_COMPRESSION_LEVEL", "6"))
+# Length of the plain-text summary kept for listings
+SUMMARY_LENGTH = 200
+# Audio is copied into and out of original_audio in blocks of this size, so
+# a 500 MB recording is never held in memory at once
+BLOB_BLOCK_SIZE = 1024 * 1024
+
+# Trained dictionaries never change once stored, so they are cached forever
+_text_dictionaries: Dict[int, bytes] = {}
+
+# In-process cache of the custom_instructions table. It is validated against
+# a version counter bumped by triggers on every change, so workers in other
+# processes see each other's edits. PRAGMA data_version on a long-lived
+# connection tells us cheaply whether anyone committed anything at all.
+_instruction_cache: Dict[str, Any] = {"pid": None, "conn": None, "data_version": None, "version": None, "rows": None}
+_instruction_cache_lock = threading.Lock()
+
+# Stored in PRAGMA user_version once init_db has brought a database up to
+# date. Bump it whenever init_db changes, or existing databases keep their
+# old schema.
+SCHEMA_VERSION = 2
+
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table if it is missing."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        logger.info(f"Adding column {table}.{column}")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 def init_db():
     """Initialize the database and create tables if they don't exist."""
     logger.info(f"Initializing database: {DATABASE_FILE}")
@@ -29,6 +65,24 @@ def init_db():
         conn = sqlite3.connect(DATABASE_FILE)
         cursor = conn.cursor()
         
+        # Every worker of every deployment calls this on startup; a database
+        # that is already current costs a single read
+        if cursor.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            logger.info(f"Database schema is up to date (version {SCHEMA_VERSION})")
+            return
+        
+        if cursor.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+            # Lets background maintenance shrink the file in small steps;
+            # must be set before the first table is created, outside a transaction
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
+        # Serialize concurrent migrations; whoever comes second finds them done
+        cursor.execute("BEGIN IMMEDIATE")
+        if cursor.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            logger.info("Database schema was migrated by another process")
+            conn.rollback()
+            return
+        
         # Create custom_instructions table
         logger.info("Creating custom_instructions table if not exists")
         cursor.execute('''
@@ -39,6 +93,26 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         ''')
+        _ensure_column(cursor, "custom_instructions", "is_default", "INTEGER NOT NULL DEFAULT 0")
+        # Speed-up applied before Whisper for this instruction (NULL: TEMPO_FACTOR)
+        _ensure_column(cursor, "custom_instructions", "tempo_factor", "REAL")
+        
+        # Version counters used to validate in-process caches
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('custom_instructions', 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS custom_instructions_version_{event.lower()}
+            AFTER {event} ON custom_instructions
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'custom_instructions';
+            END
+            ''')
         
         # Create transcriptions table
         logger.info("Creating transcriptions table if not exists")
@@ -57,6 +131,80 @@ def init_db():
         )
         ''')
         
+        # Create api_usage table; rows outlive their transcription so that
+        # spend history survives deletions
+        logger.info("Creating api_usage table if not exists")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transcription_id INTEGER,
+            custom_instruction_id INTEGER,
+            user_id TEXT,
+            operation TEXT NOT NULL,
+            model TEXT NOT NULL,
+            audio_seconds FLOAT DEFAULT 0,
+            prompt_tokens INTEGER DEFAULT 0,
+            completion_tokens INTEGER DEFAULT 0,
+            latency_ms INTEGER DEFAULT 0,
+            cost_usd FLOAT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        # Silence removed before transcription, with the time map back to the original
+        _ensure_column(cursor, "transcriptions", "vad_stats", "TEXT")
+        # Speed-up the audio was sent to Whisper at; Whisper times are
+        # multiplied by it to get times in the (silence-stripped) recording
+        _ensure_column(cursor, "transcriptions", "tempo_factor", "REAL NOT NULL DEFAULT 1")
+        # Recordings moved to cold storage by utils.maintenance; original_audio
+        # is NULL once audio_path is set
+        _ensure_column(cursor, "transcriptions", "audio_path", "TEXT")
+        _ensure_column(cursor, "transcriptions", "audio_format", "TEXT")
+        _ensure_column(cursor, "transcriptions", "archived_at", "TIMESTAMP")
+        # Earlier transcription of the same recording found by its acoustic
+        # fingerprint (utils.fingerprint), with the match details
+        _ensure_column(cursor, "transcriptions", "duplicate_of", "INTEGER")
+        _ensure_column(cursor, "transcriptions", "duplicate_stats", "TEXT")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audio_fingerprints (
+            transcription_id INTEGER PRIMARY KEY,
+            duration_seconds REAL NOT NULL,
+            fingerprint BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_audio_fingerprints_duration ON audio_fingerprints (duration_seconds)")
+        
+        # Compressed transcript text. When text_codec is set the plain text
+        # columns are NULL; summary and word_count stay readable for listings.
+        _ensure_column(cursor, "transcriptions", "text_codec", "TEXT")
+        _ensure_column(cursor, "transcriptions", "text_dictionary_id", "INTEGER")
+        _ensure_column(cursor, "transcriptions", "whisper_transcription_z", "BLOB")
+        _ensure_column(cursor, "transcriptions", "processed_transcription_z", "BLOB")
+        _ensure_column(cursor, "transcriptions", "summary", "TEXT")
+        _ensure_column(cursor, "transcriptions", "word_count", "INTEGER")
+        # Backfilled in Python so word_count is split() the same way as new rows
+        cursor.execute('''
+        SELECT id, processed_transcription FROM transcriptions
+        WHERE summary IS NULL AND text_codec IS NULL AND processed_transcription IS NOT NULL
+        ''')
+        cursor.executemany(
+            "UPDATE transcriptions SET summary = :summary, word_count = :word_count WHERE id = :id",
+            [dict(_summary_columns(text), id=row_id) for row_id, text in cursor.fetchall()]
+        )
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS text_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_created_at ON api_usage (created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_user ON api_usage (user_id, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_instruction ON api_usage (custom_instruction_id, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_transcription ON api_usage (transcription_id)")
+        
         # Insert default custom instruction if none exists
         logger.info("Checking for default custom instruction")
         cursor.execute("SELECT COUNT(*) FROM custom_instructions")
@@ -72,13 +220,23 @@ def init_db():
                 "and change words if you think you need to."
             )
             cursor.execute(
-                "INSERT INTO custom_instructions (name, instruction_text) VALUES (?, ?)",
+                "INSERT INTO custom_instructions (name, instruction_text, is_default) VALUES (?, ?, 1)",
                 default_instruction
             )
             logger.info("Default instruction added successfully")
         else:
             logger.info(f"Found {count} existing custom instructions")
+            cursor.execute("SELECT COUNT(*) FROM custom_instructions WHERE is_default = 1")
+            if cursor.fetchone()[0] == 0:
+                # Databases created before the flag existed used the first row
+                # by name; keep using it
+                logger.info("Marking default custom instruction")
+                cursor.execute(
+                    "UPDATE custom_instructions SET is_default = 1 WHERE id = "
+                    "(SELECT id FROM custom_instructions ORDER BY name LIMIT 1)"
+                )
         
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
         logger.info("Database initialization completed successfully")
     except Exception as e:
@@ -101,7 +259,7 @@ def get_db_connection():
         logger.error(traceback.format_exc())
         raise
 
-def save_custom_instruction(name: str, instruction_text: str) -> int:
+def save_custom_instruction(name: str, instruction_text: str, tempo_factor: Optional[float] = None) -> int:
     """Save a new custom instruction to the database."""
     logger.info(f"Saving new custom instruction: {name}")
     
@@ -112,14 +270,15 @@ def save_custom_instruction(name: str, instruction_text: str) -> int:
         logger.debug(f"Instruction text length: {len(instruction_text)} characters")
         
         cursor.execute(
-            "INSERT INTO custom_instructions (name, instruction_text) VALUES (?, ?)",
-            (name, instruction_text)
+            "INSERT INTO custom_instructions (name, instruction_text, tempo_factor) VALUES (?, ?, ?)",
+            (name, instruction_text, tempo_factor)
         )
         
         instruction_id = cursor.lastrowid
         logger.info(f"Custom instruction saved with ID: {instruction_id}")
         
         conn.commit()
+        invalidate_instruction_cache()
         return instruction_id
     except Exception as e:
         logger.error(f"Error saving custom instruction: {str(e)}")
@@ -129,23 +288,87 @@ def save_custom_instruction(name: str, instruction_text: str) -> int:
         if 'conn' in locals():
             conn.close()
 
+def invalidate_instruction_cache():
+    """Drop the cached custom instructions of this process."""
+    with _instruction_cache_lock:
+        _instruction_cache["rows"] = None
+
+def _cached_instructions() -> List[Dict[str, Any]]:
+    """Return the custom instructions, reloading them only if they changed."""
+    with _instruction_cache_lock:
+        cache = _instruction_cache
+        if cache["pid"] != os.getpid():
+            # Connections must not be shared across fork
+            cache.update(pid=os.getpid(), conn=None, data_version=None, version=None, rows=None)
+        if cache["conn"] is None:
+            conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            cache["conn"] = conn
+        conn = cache["conn"]
+        
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if cache["rows"] is not None and data_version == cache["data_version"]:
+            return cache["rows"]
+        
+        row = conn.execute("SELECT version FROM cache_versions WHERE name = 'custom_instructions'").fetchone()
+        version = row[0] if row else None
+        if cache["rows"] is None or version is None or version != cache["version"]:
+            logger.debug("Loading custom instructions into cache")
+            rows = conn.execute("SELECT * FROM custom_instructions ORDER BY name").fetchall()
+            cache["rows"] = [dict(r) for r in rows]
+            cache["version"] = version
+        cache["data_version"] = data_version
+        return cache["rows"]
+
 def get_all_custom_instructions() -> List[Dict[str, Any]]:
-    """Get all custom instructions from the database."""
+    """Get all custom instructions (served from the in-process cache)."""
+    return [dict(instruction) for instruction in _cached_instructions()]
+
+def get_custom_instruction(instruction_id: int) -> Optional[Dict[str, Any]]:
+    """Get a specific custom instruction by ID."""
+    for instruction in _cached_instructions():
+        if instruction['id'] == instruction_id:
+            return dict(instruction)
+    return None
+
+def get_default_custom_instruction() -> Optional[Dict[str, Any]]:
+    """Get the custom instruction flagged as default."""
+    instructions = _cached_instructions()
+    for instruction in instructions:
+        if instruction['is_default']:
+            return dict(instruction)
+    return dict(instructions[0]) if instructions else None
+
+def set_default_custom_instruction(instruction_id: int) -> bool:
+    """Flag a custom instruction as the default, clearing the flag on all others."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM custom_instructions ORDER BY name")
-    instructions = [dict(row) for row in cursor.fetchall()]
+    cursor.execute("SELECT 1 FROM custom_instructions WHERE id = ?", (instruction_id,))
+    if cursor.fetchone() is None:
+        conn.close()
+        return False
+    cursor.execute(
+        "UPDATE custom_instructions SET is_default = (id = ?) WHERE is_default != (id = ?)",
+        (instruction_id, instruction_id)
+    )
+    conn.commit()
     conn.close()
-    return instructions
+    invalidate_instruction_cache()
+    logger.info(f"Custom instruction {instruction_id} set as default")
+    return True
 
-def get_custom_instruction(instruction_id: int) -> Optional[Dict[str, Any]]:
-    """Get a specific custom instruction by ID."""
+def set_custom_instruction_tempo(instruction_id: int, tempo_factor: Optional[float]) -> bool:
+    """Set the speed-up used for an instruction's jobs (None for the global default)."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM custom_instructions WHERE id = ?", (instruction_id,))
-    instruction = cursor.fetchone()
+    cursor.execute("UPDATE custom_instructions SET tempo_factor = ? WHERE id = ?", (tempo_factor, instruction_id))
+    success = cursor.rowcount > 0
+    conn.commit()
     conn.close()
-    return dict(instruction) if instruction else None
+    invalidate_instruction_cache()
+    if success:
+        logger.info(f"Custom instruction {instruction_id} tempo set to {tempo_factor}")
+    return success
 
 def delete_custom_instruction(instruction_id: int) -> bool:
     """Delete a custom instruction by ID."""
@@ -153,22 +376,111 @@ def delete_custom_instruction(instruction_id: int) -> bool:
     cursor = conn.cursor()
     cursor.execute("DELETE FROM custom_instructions WHERE id = ?", (instruction_id,))
     success = cursor.rowcount > 0
+    if success:
+        # Promote another instruction if the default was deleted
+        cursor.execute("SELECT COUNT(*) FROM custom_instructions WHERE is_default = 1")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                "UPDATE custom_instructions SET is_default = 1 WHERE id = "
+                "(SELECT id FROM custom_instructions ORDER BY name LIMIT 1)"
+            )
     conn.commit()
     conn.close()
+    invalidate_instruction_cache()
     return success
 
+def _text_dictionary(cursor, dictionary_id: Optional[int]) -> Optional[bytes]:
+    """Return a stored compression dictionary by ID."""
+    if dictionary_id is None:
+        return None
+    if dictionary_id not in _text_dictionaries:
+        cursor.execute("SELECT data FROM text_dictionaries WHERE id = ?", (dictionary_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Compression dictionary {dictionary_id} not found")
+        _text_dictionaries[dictionary_id] = bytes(row[0])
+    return _text_dictionaries[dictionary_id]
+
+def _summary_columns(processed_transcription: str) -> Dict[str, Any]:
+    """Plain summary and word_count columns read by listings."""
+    return {
+        "summary": processed_transcription[:SUMMARY_LENGTH],
+        "word_count": len(processed_transcription.split()),
+    }
+
+def _encode_texts(cursor, whisper_transcription: str, processed_transcription: str,
+                  codec: Optional[str] = None) -> Dict[str, Any]:
+    """Column values storing both transcripts with the configured codec."""
+    codec = codec or TRANSCRIPT_COMPRESSION
+    summary = _summary_columns(processed_transcription)
+    if codec == "none" or not text_compression.available(codec):
+        if codec != "none":
+            logger.warning(f"Transcript codec {codec} is not available, storing plain text")
+        return {
+            "whisper_transcription": whisper_transcription,
+            "processed_transcription": processed_transcription,
+            "whisper_transcription_z": None,
+            "processed_transcription_z": None,
+            "text_codec": None,
+            "text_dictionary_id": None,
+            **summary,
+        }
+    
+    cursor.execute("SELECT MAX(id) FROM text_dictionaries WHERE codec = ?", (codec,))
+    dictionary_id = cursor.fetchone()[0]
+    dictionary = _text_dictionary(cursor, dictionary_id)
+    level = TRANSCRIPT_COMPRESSION_LEVEL
+    return {
+        "whisper_transcription": None,
+        "processed_transcription": None,
+        "whisper_transcription_z": text_compression.compress(whisper_transcription, codec, level, dictionary),
+        # The processed text is mostly the Whisper text again
+        "processed_transcription_z": text_compression.compress(
+            processed_transcription, codec, level, dictionary, reference=whisper_transcription
+        ),
+        "text_codec": codec,
+        "text_dictionary_id": dictionary_id,
+        **summary,
+    }
+
+def _decode_texts(cursor, row: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the stored transcript columns of a row with plain text."""
+    codec = row.pop("text_codec", None)
+    dictionary_id = row.pop("text_dictionary_id", None)
+    whisper_z = row.pop("whisper_transcription_z", None)
+    processed_z = row.pop("processed_transcription_z", None)
+    if codec:
+        dictionary = _text_dictionary(cursor, dictionary_id)
+        whisper = text_compression.decompress(whisper_z, codec, dictionary)
+        row["whisper_transcription"] = whisper
+        row["processed_transcription"] = text_compression.decompress(
+            processed_z, codec, dictionary, reference=whisper
+        )
+    return row
+
 def save_transcription(
     filename: str,
     file_type: str,
-    audio_data: bytes,
+    audio_path: str,
     whisper_transcription: str,
     processed_transcription: str,
     duration_seconds: float,
-    custom_instruction_id: Optional[int] = None
+    custom_instruction_id: Optional[int] = None,
+    vad_stats: Optional[Dict[str, Any]] = None,
+    tempo_factor: float = 1.0,
+    duplicate_of: Optional[int] = None,
+    duplicate_stats: Optional[Dict[str, Any]] = None
 ) -> int:
-    """Save a transcription to the database."""
+    """
+    Save a transcription to the database.
+    
+    The recording at audio_path is streamed into original_audio: the row is
+    inserted with a zero-filled BLOB of the file's size, which is then
+    written in place block by block within the same transaction.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    texts = _encode_texts(cursor, whisper_transcription, processed_transcription)
     cursor.execute(
         """
         INSERT INTO transcriptions (
@@ -177,34 +489,67 @@ def save_transcription(
             original_audio,
             whisper_transcription,
             processed_transcription,
+            whisper_transcription_z,
+            processed_transcription_z,
+            text_codec,
+            text_dictionary_id,
+            summary,
+            word_count,
             duration_seconds,
-            custom_instruction_id
-        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            custom_instruction_id,
+            vad_stats,
+            tempo_factor,
+            duplicate_of,
+            duplicate_stats
+        ) VALUES (?, ?, zeroblob(?), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             filename,
             file_type,
-            audio_data,
-            whisper_transcription,
-            processed_transcription,
+            os.path.getsize(audio_path),
+            texts["whisper_transcription"],
+            texts["processed_transcription"],
+            texts["whisper_transcription_z"],
+            texts["processed_transcription_z"],
+            texts["text_codec"],
+            texts["text_dictionary_id"],
+            texts["summary"],
+            texts["word_count"],
             duration_seconds,
-            custom_instruction_id
+            custom_instruction_id,
+            json.dumps(vad_stats) if vad_stats is not None else None,
+            tempo_factor,
+            duplicate_of,
+            json.dumps(duplicate_stats) if duplicate_stats is not None else None
         )
     )
     transcription_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    try:
+        with conn.blobopen("transcriptions", "original_audio", transcription_id) as blob, open(audio_path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOB_BLOCK_SIZE), b""):
+                blob.write(block)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     return transcription_id
 
 def get_all_transcriptions() -> List[Dict[str, Any]]:
-    """Get all transcriptions from the database (without audio data)."""
+    """
+    Get all transcriptions from the database for listings.
+    
+    Returns the summary and word count instead of the transcript text, so
+    compressed rows do not have to be decompressed.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         """
         SELECT 
             t.id, t.original_filename, t.file_type, t.created_at, 
-            t.whisper_transcription, t.processed_transcription, 
+            t.summary, t.word_count, 
             t.duration_seconds, t.custom_instruction_id, c.name as instruction_name
         FROM transcriptions t
         LEFT JOIN custom_instructions c ON t.custom_instruction_id = c.id
@@ -223,20 +568,294 @@ def get_transcription(transcription_id: int, include_audio: bool = False) -> Opt
     if include_audio:
         query = "SELECT * FROM transcriptions WHERE id = ?"
     else:
-        query = "SELECT id, original_filename, file_type, created_at, whisper_transcription, processed_transcription, duration_seconds, custom_instruction_id FROM transcriptions WHERE id = ?"
+        query = "SELECT id, original_filename, file_type, created_at, whisper_transcription, processed_transcription, whisper_transcription_z, processed_transcription_z, text_codec, text_dictionary_id, summary, word_count, duration_seconds, custom_instruction_id, vad_stats, tempo_factor, duplicate_of, duplicate_stats FROM transcriptions WHERE id = ?"
     
     cursor.execute(query, (transcription_id,))
     transcription = cursor.fetchone()
+    
+    if not transcription:
+        conn.close()
+        return None
+    transcription = _decode_texts(cursor, dict(transcription))
     conn.close()
+    transcription['vad_stats'] = json.loads(transcription['vad_stats']) if transcription['vad_stats'] else None
+    transcription['duplicate_stats'] = json.loads(transcription['duplicate_stats']) if transcription['duplicate_stats'] else None
+    return transcription
+
+def compress_transcriptions(codec: Optional[str] = None, batch_size: int = 100, retrain: bool = False) -> int:
+    """
+    Re-encode stored transcripts with a codec (TRANSCRIPT_COMPRESSION by default).
     
-    return dict(transcription) if transcription else None
+    Trains a shared dictionary from recent transcripts first if the codec has
+    none yet (or retrain is set). Rows are converted in batches, each in its
+    own transaction, so the migration can be interrupted and resumed. Use
+    codec="none" to store everything as plain text again. The database file
+    only shrinks after a VACUUM.
+    
+    Returns:
+        Number of rows converted
+    """
+    codec = (codec or TRANSCRIPT_COMPRESSION).lower()
+    if codec != "none" and not text_compression.available(codec):
+        raise ValueError(f"Transcript codec {codec} is not available")
+    target = None if codec == "none" else codec
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if target:
+            cursor.execute("SELECT COUNT(*) FROM text_dictionaries WHERE codec = ?", (codec,))
+            if retrain or cursor.fetchone()[0] == 0:
+                cursor.execute("SELECT id FROM transcriptions ORDER BY id DESC LIMIT 500")
+                samples = [get_transcription(row[0])["whisper_transcription"] or "" for row in cursor.fetchall()]
+                dictionary = text_compression.train_dictionary(codec, samples)
+                if dictionary:
+                    cursor.execute("INSERT INTO text_dictionaries (codec, data) VALUES (?, ?)", (codec, dictionary))
+                    conn.commit()
+                    logger.info(f"Trained {codec} dictionary of {len(dictionary)} bytes from {len(samples)} transcripts")
+            cursor.execute("SELECT MAX(id) FROM text_dictionaries WHERE codec = ?", (codec,))
+            dictionary_id = cursor.fetchone()[0]
+        else:
+            dictionary_id = None
+        
+        converted = 0
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT id, whisper_transcription, processed_transcription, whisper_transcription_z, "
+                "processed_transcription_z, text_codec, text_dictionary_id FROM transcriptions "
+                "WHERE id > ? AND NOT (text_codec IS ? AND text_dictionary_id IS ?) ORDER BY id LIMIT ?",
+                (last_id, target, dictionary_id, batch_size)
+            )
+            rows = [dict(row) for row in cursor.fetchall()]
+            if not rows:
+                break
+            for row in rows:
+                row = _decode_texts(cursor, row)
+                texts = _encode_texts(cursor, row["whisper_transcription"] or "",
+                                      row["processed_transcription"] or "", codec)
+                cursor.execute(
+                    "UPDATE transcriptions SET whisper_transcription = ?, processed_transcription = ?, "
+                    "whisper_transcription_z = ?, processed_transcription_z = ?, text_codec = ?, "
+                    "text_dictionary_id = ?, summary = ?, word_count = ? WHERE id = ?",
+                    (texts["whisper_transcription"], texts["processed_transcription"],
+                     texts["whisper_transcription_z"], texts["processed_transcription_z"],
+                     texts["text_codec"], texts["text_dictionary_id"], texts["summary"],
+                     texts["word_count"], row["id"])
+                )
+                last_id = row["id"]
+            conn.commit()
+            converted += len(rows)
+            logger.info(f"Converted {converted} transcriptions to {codec}")
+        return converted
+    finally:
+        conn.close()
+
+def copy_original_audio(transcription_id: int, output_path: str, conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Write a transcription's stored recording (original_audio) to a file in blocks.
+    
+    Args:
+        transcription_id: Transcription whose recording is copied
+        output_path: File to write
+        conn: Connection to read through, e.g. inside a caller's transaction;
+            a new one is opened if not given
+    
+    Returns:
+        Number of bytes written
+    """
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    try:
+        with conn.blobopen("transcriptions", "original_audio", transcription_id, readonly=True) as blob, \
+                open(output_path, "wb") as f:
+            for block in iter(lambda: blob.read(BLOB_BLOCK_SIZE), b""):
+                f.write(block)
+    finally:
+        if own_connection:
+            conn.close()
+    return os.path.getsize(output_path)
 
 def delete_transcription(transcription_id: int) -> bool:
-    """Delete a transcription by ID."""
+    """Delete a transcription by ID, including its archived recording."""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM transcriptions WHERE id = ?", (transcription_id,))
-    success = cursor.rowcount > 0
+    cursor.execute("DELETE FROM transcriptions WHERE id = ? RETURNING audio_path", (transcription_id,))
+    row = cursor.fetchone()
+    cursor.execute("DELETE FROM audio_fingerprints WHERE transcription_id = ?", (transcription_id,))
     conn.commit()
     conn.close()
-    return success
+    if row is None:
+        return False
+    if row['audio_path'] and os.path.exists(row['audio_path']):
+        os.remove(row['audio_path'])
+    return True
+
+def save_audio_fingerprint(transcription_id: int, duration_seconds: float, fingerprint: bytes):
+    """Store the acoustic fingerprint of a transcription's recording."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO audio_fingerprints (transcription_id, duration_seconds, fingerprint) VALUES (?, ?, ?)",
+        (transcription_id, duration_seconds, fingerprint)
+    )
+    conn.commit()
+    conn.close()
+
+def get_fingerprints_by_duration(min_seconds: float, max_seconds: float) -> List[Dict[str, Any]]:
+    """Fingerprints of recordings whose duration lies in the given range."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT transcription_id, duration_seconds, fingerprint FROM audio_fingerprints "
+        "WHERE duration_seconds BETWEEN ? AND ? ORDER BY transcription_id",
+        (min_seconds, max_seconds)
+    )
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+def get_transcriptions_without_fingerprint() -> List[Dict[str, Any]]:
+    """Transcriptions saved before fingerprinting, with where their recording is."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT t.id, t.duration_seconds, t.audio_path, t.original_audio IS NOT NULL AS has_audio "
+        "FROM transcriptions t LEFT JOIN audio_fingerprints f ON f.transcription_id = t.id "
+        "WHERE f.transcription_id IS NULL ORDER BY t.id"
+    )
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+def save_api_usage(
+    usage_records: List[Dict[str, Any]],
+    transcription_id: Optional[int] = None,
+    custom_instruction_id: Optional[int] = None,
+    user_id: Optional[str] = None
+):
+    """Save the API usage records of a job."""
+    if not usage_records:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        """
+        INSERT INTO api_usage (
+            transcription_id,
+            custom_instruction_id,
+            user_id,
+            operation,
+            model,
+            audio_seconds,
+            prompt_tokens,
+            completion_tokens,
+            latency_ms,
+            cost_usd
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                transcription_id,
+                custom_instruction_id,
+                user_id,
+                record['operation'],
+                record['model'],
+                record['audio_seconds'],
+                record['prompt_tokens'],
+                record['completion_tokens'],
+                record['latency_ms'],
+                record['cost_usd']
+            )
+            for record in usage_records
+        ]
+    )
+    conn.commit()
+    conn.close()
+    logger.info(f"Saved {len(usage_records)} API usage records for transcription {transcription_id}")
+
+def get_transcription_usage(transcription_id: int) -> Dict[str, Any]:
+    """Get the summed API usage of a transcription."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT
+            COUNT(*) AS api_calls,
+            COALESCE(SUM(audio_seconds), 0) AS audio_seconds,
+            COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+            COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+            COALESCE(SUM(latency_ms), 0) AS latency_ms,
+            COALESCE(SUM(cost_usd), 0) AS cost_usd
+        FROM api_usage
+        WHERE transcription_id = ?
+        """,
+        (transcription_id,)
+    )
+    usage = dict(cursor.fetchone())
+    conn.close()
+    return usage
+
+def get_usage_summary(group_by: str = "day", days: int = 30) -> List[Dict[str, Any]]:
+    """
+    Get API usage aggregated by day, instruction or user.
+    
+    Args:
+        group_by: One of "day", "instruction" or "user"
+        days: Number of days to look back
+    
+    Returns:
+        One row per group with summed usage and cost
+    """
+    group_columns = {
+        "day": "date(u.created_at)",
+        "instruction": "COALESCE(c.name, 'Unknown')",
+        "user": "COALESCE(u.user_id, 'anonymous')",
+    }
+    if group_by not in group_columns:
+        raise ValueError(f"Invalid group_by: {group_by}")
+    
+    since = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT
+            {group_columns[group_by]} AS grouping,
+            COUNT(DISTINCT u.transcription_id) AS transcriptions,
+            COALESCE(SUM(u.audio_seconds), 0) AS audio_seconds,
+            COALESCE(SUM(u.prompt_tokens), 0) AS prompt_tokens,
+            COALESCE(SUM(u.completion_tokens), 0) AS completion_tokens,
+            COALESCE(AVG(u.latency_ms), 0) AS avg_latency_ms,
+            COALESCE(SUM(u.cost_usd), 0) AS cost_usd
+        FROM api_usage u
+        LEFT JOIN custom_instructions c ON u.custom_instruction_id = c.id
+        WHERE u.created_at >= ?
+        GROUP BY grouping
+        ORDER BY {"grouping DESC" if group_by == "day" else "cost_usd DESC"}
+        """,
+        (since,)
+    )
+    summary = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return summary
+
+def get_spend_today(user_id: Optional[str] = None, custom_instruction_id: Optional[int] = None) -> float:
+    """Get today's API spend (UTC), optionally limited to a user or instruction."""
+    today = datetime.datetime.utcnow().strftime("%Y-%m-%d 00:00:00")
+    query = "SELECT COALESCE(SUM(cost_usd), 0) FROM api_usage WHERE created_at >= ?"
+    params: List[Any] = [today]
+    if user_id is not None:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    if custom_instruction_id is not None:
+        query += " AND custom_instruction_id = ?"
+        params.append(custom_instruction_id)
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    spent = cursor.fetchone()[0]
+    conn.close()
+    return spent
@@ -16,7 +16,7 @@ echo "Checking system and permissions..."
 
 # Create and validate directories with proper ownership
 echo "Setting up directories..."
-for dir in /app/uploads /app/temp_audio /app/logs; do
+for dir in /app/uploads /app/temp_audio /app/logs /app/cold_storage /app/backups; do
     mkdir -p $dir || handle_error "Failed to create directory: $dir"
     
     # Verify current user can write to the directory
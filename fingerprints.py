@@ -0,0 +1,39 @@
+"""
+Manage the acoustic fingerprints used to find duplicate uploads (see utils/fingerprint.py).
+
+    python fingerprints.py --backfill              # fingerprint transcriptions saved before fingerprinting existed
+    python fingerprints.py --check hearing.m4a     # print the earlier transcription this recording duplicates
+
+New uploads are fingerprinted as they are processed. Until the backfill has
+run, re-uploads of older recordings are not recognised.
+"""
+import json
+import argparse
+
+from utils.logging_config import get_app_logger
+from utils import fingerprint
+from utils.audio_handler import get_audio_duration
+from database import init_db
+
+# Initialize logger
+logger = get_app_logger()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage acoustic fingerprints")
+    parser.add_argument("--backfill", action="store_true", help="Fingerprint transcriptions that have no fingerprint yet")
+    parser.add_argument("--check", metavar="FILE", help="Look for an earlier transcription of this recording")
+    args = parser.parse_args()
+
+    if not (args.backfill or args.check):
+        parser.print_help()
+        return
+    init_db()
+    if args.backfill:
+        print(json.dumps(fingerprint.backfill(), indent=2))
+    if args.check:
+        duration = get_audio_duration(args.check)
+        duplicate = fingerprint.find_duplicate(fingerprint.compute_fingerprint(args.check), duration)
+        print(json.dumps(duplicate, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Gunicorn hooks, loaded automatically from the working directory.
+
+The database is initialized once, in the master, before any worker starts;
+importing app.py has no side effects. Each worker starts its own metrics
+flush, maintenance and backup threads after the fork (threads do not survive
+it); lock files make sure only one worker does maintenance and backups.
+"""
+
+def on_starting(server):
+    from database import init_db
+    init_db()
+
+def post_fork(server, worker):
+    from app import start_background_tasks
+    start_background_tasks()
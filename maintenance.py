@@ -0,0 +1,50 @@
+"""
+Storage maintenance for the transcriptions database (see utils/maintenance.py).
+
+    python maintenance.py                 # one run, report printed as JSON
+    python maintenance.py --loop          # run every MAINTENANCE_INTERVAL_SECONDS
+    python maintenance.py --enable-incremental-vacuum
+
+The app runs the same maintenance in the background when MAINTENANCE_ENABLED=1;
+this script is for running it from cron or a separate container instead, and
+for the one-off conversion of databases created before auto-vacuum was set.
+"""
+import sys
+import json
+import time
+import argparse
+
+from utils.logging_config import get_app_logger
+from utils import maintenance
+from database import init_db
+
+# Initialize logger
+logger = get_app_logger()
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old recordings and vacuum the database")
+    parser.add_argument("--loop", action="store_true", help="Keep running every MAINTENANCE_INTERVAL_SECONDS")
+    parser.add_argument("--archive-after-days", type=int, default=maintenance.ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Convert the database to incremental auto-vacuum (stop the app first)")
+    args = parser.parse_args()
+    
+    init_db()
+    if args.enable_incremental_vacuum:
+        print(json.dumps(maintenance.enable_incremental_vacuum(), indent=2))
+        return
+    
+    maintenance.ARCHIVE_AFTER_DAYS = args.archive_after_days
+    while True:
+        report = maintenance.run_maintenance()
+        if report is None:
+            logger.info("Maintenance is already running in another process")
+        else:
+            print(json.dumps(report, indent=2))
+            sys.stdout.flush()
+        if not args.loop:
+            return
+        time.sleep(maintenance.MAINTENANCE_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    main()
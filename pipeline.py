@@ -0,0 +1,542 @@
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from utils.logging_config import get_app_logger
+from utils import metrics, admission
+
+from database import save_transcription, save_api_usage, get_custom_instruction, get_transcription
+
+from utils.audio_handler import get_audio_duration, split_audio_file, cleanup_temp_files, get_file_type
+from utils.audio_handler import TEMP_AUDIO_DIR, ensure_directories_exist
+from utils.audio_handler import get_audio_duration_async, split_audio_file_async, get_file_type_async
+from utils.audio_handler import apply_tempo, apply_tempo_async, TEMPO_FACTOR
+from utils.openai_client import transcribe_audio, post_process_transcription, MAX_FILE_SIZE, POST_PROCESS_SEGMENT_WORDS
+from utils.openai_client import transcribe_audio_async, post_process_transcription_async
+from utils.openai_client import TranscriptSegmenter, post_process_segment, post_process_segment_async
+from utils.accounting import start_usage_tracking, stop_usage_tracking, estimate_job_cost, check_budget
+
+# Initialize logger
+logger = get_app_logger()
+
+# Maximum number of chunks sent to Whisper at once in the async pipeline
+ASYNC_CHUNK_CONCURRENCY = int(os.getenv("ASYNC_CHUNK_CONCURRENCY", "4"))
+# Post-process the segments of a long recording while later chunks are still
+# being transcribed (only with POST_PROCESS_SEGMENT_WORDS set); 0 waits for
+# the whole transcript first
+POST_PROCESS_OVERLAP = os.getenv("POST_PROCESS_OVERLAP", "1") == "1"
+# Segments post-processed at once while transcription goes on
+POST_PROCESS_CONCURRENCY = int(os.getenv("POST_PROCESS_CONCURRENCY", "2"))
+# Fingerprint uploads to recognise re-encoded copies of earlier recordings
+FINGERPRINT_ENABLED = os.getenv("FINGERPRINT_ENABLED", "1") == "1"
+# Use the earlier Whisper transcription of such a copy instead of calling
+# Whisper again; the upload form can override it per upload
+DUPLICATE_REUSE = os.getenv("DUPLICATE_REUSE", "0") == "1"
+
+class OverlappedPostProcessing:
+    """
+    Post-processes a transcription segment by segment while it is being transcribed.
+    
+    Whisper chunks are fed in order. Each segment they complete is submitted
+    to a thread pool right away, in a copy of the caller's context so usage
+    accounting and the correlation ID carry over to the pool thread. result()
+    post-processes the rest and joins the segments in order, which gives the
+    same text as post_process_transcription on the whole transcription.
+    """
+    
+    def __init__(self, custom_instruction: str):
+        self.custom_instruction = custom_instruction
+        self.segmenter = TranscriptSegmenter()
+        self.executor = ThreadPoolExecutor(max_workers=POST_PROCESS_CONCURRENCY, thread_name_prefix="post_process")
+        self.futures = []
+    
+    def _submit(self, segments: List[str]):
+        for segment in segments:
+            context = contextvars.copy_context()
+            self.futures.append(self.executor.submit(context.run, post_process_segment, segment, self.custom_instruction))
+    
+    def feed(self, text: str):
+        """Add the next transcribed chunk; raises if an earlier segment failed, so the job stops early."""
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._submit(self.segmenter.feed(text))
+    
+    def result(self) -> str:
+        early = len(self.futures)
+        self._submit(self.segmenter.finish())
+        if early:
+            logger.info(f"Post-processing {len(self.futures)} segments, {early} started during transcription")
+        return "\n\n".join(future.result() for future in self.futures)
+    
+    def close(self):
+        """Cancel segments not started yet and wait for running ones."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+class OverlappedPostProcessingAsync:
+    """Awaitable version of OverlappedPostProcessing; segments run as tasks, which copy the context themselves."""
+    
+    def __init__(self, custom_instruction: str):
+        self.custom_instruction = custom_instruction
+        self.segmenter = TranscriptSegmenter()
+        self.semaphore = asyncio.Semaphore(POST_PROCESS_CONCURRENCY)
+        self.tasks = []
+    
+    async def _process(self, segment: str) -> str:
+        async with self.semaphore:
+            return await post_process_segment_async(segment, self.custom_instruction)
+    
+    def _submit(self, segments: List[str]):
+        for segment in segments:
+            self.tasks.append(asyncio.create_task(self._process(segment)))
+    
+    def feed(self, text: str):
+        for task in self.tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        self._submit(self.segmenter.feed(text))
+    
+    async def result(self) -> str:
+        early = len(self.tasks)
+        self._submit(self.segmenter.finish())
+        if early:
+            logger.info(f"Post-processing {len(self.tasks)} segments, {early} started during transcription")
+        processed = await asyncio.gather(*self.tasks)
+        return "\n\n".join(processed)
+    
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+def _strip_silence(file_path: str, duration: float):
+    """Run VAD on an upload; returns the VadResult (or None) and the audio to transcribe."""
+    # Imported here so the web process does not load numpy until the first job
+    from utils.vad import strip_silence
+    
+    ensure_directories_exist()
+    with metrics.time_stage("vad"):
+        vad = strip_silence(file_path, duration, TEMP_AUDIO_DIR)
+    if vad is None:
+        return None, file_path, duration
+    metrics.VAD_REMOVED_SECONDS.inc(vad.removed_seconds)
+    return vad, vad.file_path, vad.kept_seconds
+
+def _vad_report(vad, file_path: str, chunk_count: int, transcribe_seconds: float):
+    """Log and return the per-job VAD stats stored with the transcription."""
+    if vad is None:
+        return None
+    from utils.vad import estimate_chunks
+    
+    stats = vad.stats(estimate_chunks(os.path.getsize(file_path), MAX_FILE_SIZE), chunk_count, transcribe_seconds)
+    logger.info(
+        f"VAD saved {stats['removed_seconds']}s of audio, {stats['chunks_before'] - stats['chunks_after']} chunk(s) "
+        f"and ~{stats['latency_saved_seconds']}s of transcription time"
+    )
+    return stats
+
+def _remove_vad_file(vad):
+    if vad is not None and os.path.exists(vad.file_path):
+        os.remove(vad.file_path)
+
+def _tempo_factor(custom_instruction_id: Optional[int]) -> float:
+    """Speed-up for a job: the instruction's own setting, else TEMPO_FACTOR."""
+    instruction = get_custom_instruction(custom_instruction_id) if custom_instruction_id else None
+    if instruction and instruction.get('tempo_factor'):
+        return instruction['tempo_factor']
+    return TEMPO_FACTOR
+
+def _log_tempo(factor: float, billed_duration: float):
+    logger.info(f"Audio sped up {factor:g}x: {billed_duration:.1f}s sent to Whisper as {billed_duration / factor:.1f}s")
+
+def _remove_tempo_file(tempo_path: Optional[str]):
+    if tempo_path is not None and os.path.exists(tempo_path):
+        os.remove(tempo_path)
+
+def _index_transcription(transcription_id: int, processed_transcription: str):
+    """Add a saved transcription to the semantic search index; a failure only costs search coverage."""
+    # numpy and the index are loaded with the first saved job
+    from utils import semantic_search
+    
+    try:
+        semantic_search.index_transcription(transcription_id, processed_transcription)
+    except Exception as e:
+        logger.error(f"Could not index transcription {transcription_id} for semantic search: {str(e)}")
+
+def _check_duplicate(file_path: str, duration: float):
+    """Fingerprint an upload and find an earlier transcription of the same recording."""
+    if not FINGERPRINT_ENABLED:
+        return None, None
+    # numpy is loaded with the first job, not at app import
+    try:
+        from utils import fingerprint
+    except ImportError as e:
+        logger.error(f"Duplicate detection unavailable: {str(e)}")
+        return None, None
+    return fingerprint.check_upload(file_path, duration)
+
+def _reusable_transcription(duplicate, reuse_duplicate: Optional[bool]):
+    """Return the earlier transcription to reuse for a near-duplicate upload, or None."""
+    if duplicate is None:
+        return None
+    if reuse_duplicate is None:
+        reuse_duplicate = DUPLICATE_REUSE
+    if not reuse_duplicate:
+        return None
+    earlier = get_transcription(duplicate['transcription_id'])
+    if not earlier or not earlier.get('whisper_transcription'):
+        return None
+    logger.info(f"Reusing the Whisper transcription of transcription {earlier['id']}")
+    metrics.DUPLICATE_UPLOADS.labels("reused").inc()
+    return earlier
+
+def _duplicate_stats(duplicate, earlier):
+    if duplicate is None:
+        return None
+    return dict(duplicate, reused=earlier is not None)
+
+def _store_fingerprint(transcription_id: int, duration: float, fingerprint):
+    if fingerprint is not None:
+        from utils.fingerprint import store_fingerprint
+        store_fingerprint(transcription_id, duration, fingerprint)
+
+def run_pipeline(
+    file_path: str,
+    original_filename: str,
+    custom_instruction: str,
+    custom_instruction_id: Optional[int],
+    user_id: Optional[str] = None,
+    reuse_duplicate: Optional[bool] = None
+) -> int:
+    """
+    Transcribe, post-process and store an uploaded recording.
+    
+    Args:
+        file_path: Path to the saved upload
+        original_filename: Filename as uploaded by the user
+        custom_instruction: Instruction text for GPT-4o post-processing
+        custom_instruction_id: ID of the instruction, stored with the transcription
+        user_id: User the API usage is attributed to
+        reuse_duplicate: Reuse the Whisper transcription of an earlier upload of
+            the same recording instead of transcribing again; None uses DUPLICATE_REUSE
+    
+    Returns:
+        ID of the saved transcription
+    
+    Raises:
+        BudgetExceeded: If the job would exceed a configured budget
+    """
+    metrics.QUEUE_DEPTH.inc()
+    usage_records, usage_token = start_usage_tracking()
+    chunk_files = []
+    vad = None
+    tempo_path = None
+    post_processing = None
+    
+    try:
+        with metrics.time_stage("probe"):
+            # Get audio duration
+            logger.debug("Getting audio duration")
+            duration = get_audio_duration(file_path)
+            logger.info(f"Audio duration: {duration} seconds")
+            
+            # Get audio format
+            logger.debug("Getting audio format")
+            file_type = get_file_type(file_path)
+            logger.info(f"Audio format: {file_type}")
+        metrics.AUDIO_SECONDS.inc(duration)
+        admission.refine(duration)
+        
+        # A re-encoded copy of an earlier upload can reuse its Whisper transcription
+        fingerprint, duplicate = _check_duplicate(file_path, duration)
+        earlier = _reusable_transcription(duplicate, reuse_duplicate)
+        if earlier is not None:
+            whisper_transcription = earlier['whisper_transcription']
+            vad_stats = earlier['vad_stats']
+            tempo_factor = earlier['tempo_factor'] or 1.0
+            check_budget(estimate_job_cost(0.0, custom_instruction), user_id, custom_instruction_id)
+        else:
+            # Remove long silences so Whisper is not billed for them
+            vad, audio_path, billed_duration = _strip_silence(file_path, duration)
+            
+            # Speed up slow speech so Whisper bills and processes less audio
+            tempo_factor = _tempo_factor(custom_instruction_id)
+            if tempo_factor > 1.0:
+                with metrics.time_stage("tempo"):
+                    tempo_path = apply_tempo(audio_path, tempo_factor)
+                _log_tempo(tempo_factor, billed_duration)
+                audio_path, billed_duration = tempo_path, billed_duration / tempo_factor
+            
+            # Refuse the job before any API spend if it would exceed a budget
+            check_budget(estimate_job_cost(billed_duration, custom_instruction, POST_PROCESS_SEGMENT_WORDS), user_id, custom_instruction_id)
+            
+            # Split file if needed
+            logger.debug("Checking if file needs to be split")
+            with metrics.time_stage("split"):
+                chunk_files = split_audio_file(audio_path)
+            
+            if len(chunk_files) > 1:
+                logger.info(f"File split into {len(chunk_files)} chunks")
+            else:
+                logger.info("File does not need splitting")
+            
+            # Transcribe each chunk; completed segments of a long transcript are
+            # post-processed meanwhile
+            logger.debug("Starting transcription process")
+            if POST_PROCESS_OVERLAP and POST_PROCESS_SEGMENT_WORDS > 0 and len(chunk_files) > 1:
+                post_processing = OverlappedPostProcessing(custom_instruction)
+            transcription_parts = []
+            chunk_duration = billed_duration / len(chunk_files)
+            transcribe_started = time.perf_counter()
+            for i, chunk_file in enumerate(chunk_files):
+                logger.debug(f"Transcribing chunk {i+1}/{len(chunk_files)}")
+                transcription_text = transcribe_audio(chunk_file, audio_seconds=chunk_duration)
+                transcription_parts.append(transcription_text)
+                if post_processing is not None:
+                    post_processing.feed(transcription_text)
+            vad_stats = _vad_report(vad, file_path, len(chunk_files), time.perf_counter() - transcribe_started)
+            
+            # Combine transcriptions
+            logger.debug("Combining transcription parts")
+            whisper_transcription = " ".join(transcription_parts)
+            logger.info(f"Whisper transcription completed: {len(whisper_transcription)} characters")
+        
+        # Post-process with GPT-4o
+        logger.debug("Starting GPT-4o post-processing")
+        if post_processing is not None:
+            processed_transcription = post_processing.result()
+        else:
+            processed_transcription = post_process_transcription(whisper_transcription, custom_instruction)
+        logger.info(f"Post-processing completed: {len(processed_transcription)} characters")
+        
+        # Save to database
+        logger.debug("Saving transcription to database")
+        with metrics.time_stage("db_save"):
+            transcription_id = save_transcription(
+                filename=original_filename,
+                file_type=file_type,
+                audio_path=file_path,
+                whisper_transcription=whisper_transcription,
+                processed_transcription=processed_transcription,
+                duration_seconds=duration,
+                custom_instruction_id=custom_instruction_id,
+                vad_stats=vad_stats,
+                tempo_factor=tempo_factor,
+                duplicate_of=duplicate['transcription_id'] if duplicate else None,
+                duplicate_stats=_duplicate_stats(duplicate, earlier)
+            )
+        logger.info(f"Transcription saved with ID: {transcription_id}")
+        _store_fingerprint(transcription_id, duration, fingerprint)
+        _index_transcription(transcription_id, processed_transcription)
+        save_api_usage(usage_records, transcription_id, custom_instruction_id, user_id)
+        return transcription_id
+    except Exception:
+        # API calls made before the failure are still billed
+        save_api_usage(usage_records, None, custom_instruction_id, user_id)
+        raise
+    finally:
+        if post_processing is not None:
+            post_processing.close()
+        # Clean up temporary files
+        if len(chunk_files) > 1:
+            logger.debug("Cleaning up temporary chunk files")
+            cleanup_temp_files(chunk_files)
+        _remove_vad_file(vad)
+        _remove_tempo_file(tempo_path)
+        stop_usage_tracking(usage_token)
+        metrics.QUEUE_DEPTH.dec()
+
+async def run_pipeline_async(
+    file_path: str,
+    original_filename: str,
+    custom_instruction: str,
+    custom_instruction_id: Optional[int],
+    user_id: Optional[str] = None,
+    reuse_duplicate: Optional[bool] = None
+) -> int:
+    """
+    Awaitable version of run_pipeline for the ASGI serving mode.
+    
+    FFmpeg runs as asyncio subprocesses, OpenAI calls use the async client
+    and chunks are transcribed concurrently (up to ASYNC_CHUNK_CONCURRENCY),
+    so a waiting job holds no thread. SQLite and file reads run in the
+    default thread pool.
+    """
+    metrics.QUEUE_DEPTH.inc()
+    usage_records, usage_token = start_usage_tracking()
+    chunk_files = []
+    vad = None
+    tempo_path = None
+    transcribe_tasks = []
+    post_processing = None
+    
+    try:
+        with metrics.time_stage("probe"):
+            duration, file_type = await asyncio.gather(
+                get_audio_duration_async(file_path),
+                get_file_type_async(file_path)
+            )
+            logger.info(f"Audio duration: {duration} seconds")
+            logger.info(f"Audio format: {file_type}")
+        metrics.AUDIO_SECONDS.inc(duration)
+        await asyncio.to_thread(admission.refine, duration)
+        
+        fingerprint, duplicate = await asyncio.to_thread(_check_duplicate, file_path, duration)
+        earlier = await asyncio.to_thread(_reusable_transcription, duplicate, reuse_duplicate)
+        if earlier is not None:
+            whisper_transcription = earlier['whisper_transcription']
+            vad_stats = earlier['vad_stats']
+            tempo_factor = earlier['tempo_factor'] or 1.0
+            await asyncio.to_thread(
+                check_budget, estimate_job_cost(0.0, custom_instruction), user_id, custom_instruction_id
+            )
+        else:
+            vad, audio_path, billed_duration = await asyncio.to_thread(_strip_silence, file_path, duration)
+            
+            tempo_factor = await asyncio.to_thread(_tempo_factor, custom_instruction_id)
+            if tempo_factor > 1.0:
+                with metrics.time_stage("tempo"):
+                    tempo_path = await apply_tempo_async(audio_path, tempo_factor)
+                _log_tempo(tempo_factor, billed_duration)
+                audio_path, billed_duration = tempo_path, billed_duration / tempo_factor
+            
+            # Refuse the job before any API spend if it would exceed a budget
+            await asyncio.to_thread(
+                check_budget, estimate_job_cost(billed_duration, custom_instruction, POST_PROCESS_SEGMENT_WORDS), user_id, custom_instruction_id
+            )
+            
+            with metrics.time_stage("split"):
+                chunk_files = await split_audio_file_async(audio_path)
+            
+            if len(chunk_files) > 1:
+                logger.info(f"File split into {len(chunk_files)} chunks")
+            else:
+                logger.info("File does not need splitting")
+            
+            # Transcribe chunks concurrently; gather keeps the results in order
+            chunk_duration = billed_duration / len(chunk_files)
+            semaphore = asyncio.Semaphore(ASYNC_CHUNK_CONCURRENCY)
+            
+            async def transcribe_chunk(chunk_file: str) -> str:
+                async with semaphore:
+                    return await transcribe_audio_async(chunk_file, audio_seconds=chunk_duration)
+            
+            # Chunks finish in any order; they are awaited in order so completed
+            # segments can be post-processed while later chunks are transcribed
+            if POST_PROCESS_OVERLAP and POST_PROCESS_SEGMENT_WORDS > 0 and len(chunk_files) > 1:
+                post_processing = OverlappedPostProcessingAsync(custom_instruction)
+            transcribe_started = time.perf_counter()
+            transcribe_tasks = [asyncio.create_task(transcribe_chunk(chunk)) for chunk in chunk_files]
+            transcription_parts = []
+            for task in transcribe_tasks:
+                transcription_parts.append(await task)
+                if post_processing is not None:
+                    post_processing.feed(transcription_parts[-1])
+            vad_stats = _vad_report(vad, file_path, len(chunk_files), time.perf_counter() - transcribe_started)
+            whisper_transcription = " ".join(transcription_parts)
+        logger.info(f"Whisper transcription completed: {len(whisper_transcription)} characters")
+        
+        if post_processing is not None:
+            processed_transcription = await post_processing.result()
+        else:
+            processed_transcription = await post_process_transcription_async(whisper_transcription, custom_instruction)
+        logger.info(f"Post-processing completed: {len(processed_transcription)} characters")
+        
+        def save():
+            return save_transcription(
+                filename=original_filename,
+                file_type=file_type,
+                audio_path=file_path,
+                whisper_transcription=whisper_transcription,
+                processed_transcription=processed_transcription,
+                duration_seconds=duration,
+                custom_instruction_id=custom_instruction_id,
+                vad_stats=vad_stats,
+                tempo_factor=tempo_factor,
+                duplicate_of=duplicate['transcription_id'] if duplicate else None,
+                duplicate_stats=_duplicate_stats(duplicate, earlier)
+            )
+        
+        with metrics.time_stage("db_save"):
+            transcription_id = await asyncio.to_thread(save)
+        logger.info(f"Transcription saved with ID: {transcription_id}")
+        await asyncio.to_thread(_store_fingerprint, transcription_id, duration, fingerprint)
+        await asyncio.to_thread(_index_transcription, transcription_id, processed_transcription)
+        await asyncio.to_thread(save_api_usage, usage_records, transcription_id, custom_instruction_id, user_id)
+        return transcription_id
+    except Exception:
+        # API calls made before the failure are still billed
+        await asyncio.to_thread(save_api_usage, usage_records, None, custom_instruction_id, user_id)
+        raise
+    finally:
+        # Chunks still being transcribed after a failure
+        for task in transcribe_tasks:
+            task.cancel()
+        await asyncio.gather(*transcribe_tasks, return_exceptions=True)
+        if post_processing is not None:
+            await post_processing.close()
+        if len(chunk_files) > 1:
+            await asyncio.to_thread(cleanup_temp_files, chunk_files)
+        _remove_vad_file(vad)
+        _remove_tempo_file(tempo_path)
+        stop_usage_tracking(usage_token)
+        metrics.QUEUE_DEPTH.dec()
+
+def finalize_live_session(
+    recording_path: str,
+    whisper_transcription: str,
+    duration: float,
+    filename: str,
+    custom_instruction: str,
+    custom_instruction_id: Optional[int],
+    user_id: Optional[str] = None,
+    usage_records: Optional[list] = None,
+    post_process: bool = True
+) -> int:
+    """
+    Post-process and store a live streaming session as a normal transcription.
+    
+    Args:
+        recording_path: WAV file with the whole session
+        whisper_transcription: Partial transcripts of the session joined in order
+        duration: Session length in seconds
+        filename: Name the transcription is listed under
+        custom_instruction: Instruction text for GPT-4o post-processing
+        custom_instruction_id: ID of the instruction, stored with the transcription
+        user_id: User the API usage is attributed to
+        usage_records: Usage collected while the session's windows were transcribed
+        post_process: False stores the Whisper transcript as the processed text,
+            e.g. when post-processing would exceed a budget
+    
+    Returns:
+        ID of the saved transcription
+    """
+    usage_records = usage_records if usage_records is not None else []
+    try:
+        if not whisper_transcription.strip():
+            processed_transcription = ""
+        elif post_process:
+            processed_transcription = post_process_transcription(whisper_transcription, custom_instruction)
+        else:
+            processed_transcription = whisper_transcription
+        
+        with metrics.time_stage("db_save"):
+            transcription_id = save_transcription(
+                filename=filename,
+                file_type="wav",
+                audio_path=recording_path,
+                whisper_transcription=whisper_transcription,
+                processed_transcription=processed_transcription,
+                duration_seconds=duration,
+                custom_instruction_id=custom_instruction_id
+            )
+        logger.info(f"Live session saved with ID: {transcription_id}")
+        _index_transcription(transcription_id, processed_transcription)
+        save_api_usage(usage_records, transcription_id, custom_instruction_id, user_id)
+        return transcription_id
+    except Exception:
+        save_api_usage(usage_records, None, custom_instruction_id, user_id)
+        raise
@@ -0,0 +1,51 @@
+"""
+Manage the semantic search index (see utils/semantic_search.py).
+
+    python search_index.py --stats
+    python search_index.py --backfill         # index transcriptions saved before the index existed
+    python search_index.py --rebuild          # re-index everything, e.g. after changing EMBEDDING_PROVIDER
+    python search_index.py --train-ivf        # cluster a large index for fast approximate search
+    python search_index.py --query "ending the lease" -k 5
+
+New transcriptions are indexed as they are saved. Searches during a rebuild
+only see the transcriptions indexed so far. Train the IVF index again after
+the collection has grown a lot, so its lists stay balanced.
+"""
+import json
+import argparse
+
+from utils.logging_config import get_app_logger
+from utils import semantic_search
+from database import init_db
+
+# Initialize logger
+logger = get_app_logger()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the semantic search index")
+    parser.add_argument("--stats", action="store_true", help="Print the size and layout of the index")
+    parser.add_argument("--backfill", action="store_true", help="Index transcriptions that are not indexed yet")
+    parser.add_argument("--rebuild", action="store_true", help="Re-index every transcription")
+    parser.add_argument("--train-ivf", action="store_true", help="Train the IVF index")
+    parser.add_argument("--lists", type=int, help="IVF lists (default: square root of the slice count)")
+    parser.add_argument("--query", help="Run a search and print the hits")
+    parser.add_argument("-k", type=int, default=10, help="Hits to return for --query")
+    args = parser.parse_args()
+    
+    init_db()
+    index = semantic_search.get_index()
+    if args.rebuild:
+        print(json.dumps(semantic_search.rebuild(), indent=2))
+    elif args.backfill:
+        print(json.dumps(semantic_search.backfill(), indent=2))
+    if args.train_ivf:
+        print(json.dumps(index.train_ivf(args.lists), indent=2))
+    if args.query:
+        for hit in semantic_search.search(args.query, args.k):
+            print(f"{hit['score']:.3f}  #{hit['transcription_id']} {hit['original_filename']}")
+            print(f"       {hit['text'][:200]}")
+    if args.stats or not (args.rebuild or args.backfill or args.train_ivf or args.query):
+        print(json.dumps(index.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
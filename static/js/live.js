@@ -0,0 +1,135 @@
+// Live transcription client: captures the microphone, converts it to 16 kHz
+// 16-bit mono PCM and streams it to /ws/transcribe.
+(function () {
+    const SAMPLE_RATE = 16000;
+    const startBtn = document.getElementById('start_btn');
+    const stopBtn = document.getElementById('stop_btn');
+    const statusText = document.getElementById('status');
+    const transcript = document.getElementById('transcript');
+
+    // Runs on the audio thread; posts Int16 PCM blocks of ~100 ms
+    const workletSource = `
+        class PcmSender extends AudioWorkletProcessor {
+            constructor() {
+                super();
+                this.block = new Int16Array(${SAMPLE_RATE / 10});
+                this.length = 0;
+            }
+            process(inputs) {
+                const input = inputs[0][0];
+                if (input) {
+                    for (let i = 0; i < input.length; i++) {
+                        const s = Math.max(-1, Math.min(1, input[i]));
+                        this.block[this.length++] = s < 0 ? s * 0x8000 : s * 0x7fff;
+                        if (this.length === this.block.length) {
+                            this.port.postMessage(this.block.buffer.slice(0));
+                            this.length = 0;
+                        }
+                    }
+                }
+                return true;
+            }
+        }
+        registerProcessor('pcm-sender', PcmSender);
+    `;
+
+    let socket = null;
+    let context = null;
+    let stream = null;
+
+    function setStatus(text) {
+        statusText.textContent = text;
+    }
+
+    function addPartial(message) {
+        const paragraph = document.createElement('p');
+        const time = document.createElement('span');
+        time.className = 'text-muted me-2';
+        time.textContent = new Date(message.start * 1000).toISOString().substr(11, 8);
+        paragraph.appendChild(time);
+        paragraph.appendChild(document.createTextNode(message.text));
+        transcript.appendChild(paragraph);
+    }
+
+    function stopAudio() {
+        if (context) {
+            context.close();
+            context = null;
+        }
+        if (stream) {
+            stream.getTracks().forEach(track => track.stop());
+            stream = null;
+        }
+    }
+
+    async function start() {
+        const params = new URLSearchParams({
+            sample_rate: SAMPLE_RATE,
+            custom_instruction_id: document.getElementById('custom_instruction_id').value
+        });
+        const name = document.getElementById('session_name').value.trim();
+        if (name) {
+            params.set('filename', name);
+        }
+
+        stream = await navigator.mediaDevices.getUserMedia({
+            audio: {channelCount: 1, echoCancellation: true, noiseSuppression: true}
+        });
+        context = new AudioContext({sampleRate: SAMPLE_RATE});
+        const moduleUrl = URL.createObjectURL(new Blob([workletSource], {type: 'application/javascript'}));
+        await context.audioWorklet.addModule(moduleUrl);
+        const source = context.createMediaStreamSource(stream);
+        const sender = new AudioWorkletNode(context, 'pcm-sender');
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/transcribe?${params}`);
+        socket.binaryType = 'arraybuffer';
+        socket.onopen = () => {
+            sender.port.onmessage = event => {
+                if (socket && socket.readyState === WebSocket.OPEN) {
+                    socket.send(event.data);
+                }
+            };
+            source.connect(sender);
+            setStatus('Recording...');
+        };
+        socket.onmessage = event => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'partial') {
+                addPartial(message);
+            } else if (message.type === 'error') {
+                setStatus(message.message);
+            } else if (message.type === 'final') {
+                if (message.url) {
+                    window.location.href = message.url;
+                } else {
+                    setStatus('Nothing was recorded.');
+                }
+            }
+        };
+        socket.onclose = () => {
+            stopAudio();
+            startBtn.disabled = false;
+            stopBtn.disabled = true;
+        };
+
+        startBtn.disabled = true;
+        stopBtn.disabled = false;
+    }
+
+    startBtn.addEventListener('click', () => {
+        start().catch(error => {
+            stopAudio();
+            setStatus(`Could not start recording: ${error.message}`);
+        });
+    });
+
+    stopBtn.addEventListener('click', () => {
+        stopAudio();
+        stopBtn.disabled = true;
+        setStatus('Finishing transcription...');
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({type: 'stop'}));
+        }
+    });
+})();
@@ -0,0 +1,174 @@
+import os
+import math
+import datetime
+import contextvars
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+
+from utils.logging_config import get_app_logger
+from database import get_spend_today
+
+# Initialize logger
+logger = get_app_logger()
+
+# Pricing in USD, overridable when OpenAI changes its rates
+WHISPER_PRICE_PER_MINUTE = float(os.getenv("WHISPER_PRICE_PER_MINUTE", "0.006"))
+CHAT_INPUT_PRICE_PER_1M = float(os.getenv("CHAT_INPUT_PRICE_PER_1M", "2.50"))
+CHAT_OUTPUT_PRICE_PER_1M = float(os.getenv("CHAT_OUTPUT_PRICE_PER_1M", "10.00"))
+EMBEDDING_PRICE_PER_1M = float(os.getenv("EMBEDDING_PRICE_PER_1M", "0.02"))
+
+# Daily budgets in USD; 0 disables the corresponding check
+DAILY_BUDGET_USD = float(os.getenv("DAILY_BUDGET_USD", "0"))
+USER_DAILY_BUDGET_USD = float(os.getenv("USER_DAILY_BUDGET_USD", "0"))
+INSTRUCTION_DAILY_BUDGET_USD = float(os.getenv("INSTRUCTION_DAILY_BUDGET_USD", "0"))
+
+# Rough token rate of transcribed speech (~150 words per minute), used to
+# estimate the GPT-4o cost of a job before it runs
+ESTIMATED_TOKENS_PER_AUDIO_SECOND = 3.5
+ESTIMATED_WORDS_PER_TOKEN = 0.75
+
+# Usage records collected for the job running in the current context
+_usage_records: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "usage_records", default=None
+)
+
+class BudgetExceeded(Exception):
+    """Raised when a job would push spend over a configured budget."""
+
+    def __init__(self, message: str, scope: str, spent: float, budget: float):
+        super().__init__(message)
+        self.scope = scope
+        self.spent = spent
+        self.budget = budget
+
+def whisper_cost(audio_seconds: float) -> float:
+    """Cost of transcribing the given amount of audio with Whisper."""
+    return audio_seconds / 60 * WHISPER_PRICE_PER_MINUTE
+
+def chat_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost of a GPT-4o chat completion."""
+    return (prompt_tokens * CHAT_INPUT_PRICE_PER_1M + completion_tokens * CHAT_OUTPUT_PRICE_PER_1M) / 1_000_000
+
+def embedding_cost(prompt_tokens: int) -> float:
+    """Cost of embedding text for semantic search."""
+    return prompt_tokens * EMBEDDING_PRICE_PER_1M / 1_000_000
+
+def estimate_job_cost(duration_seconds: float, instruction_text: str = "", segment_words: int = 0) -> float:
+    """
+    Estimate the API cost of transcribing and post-processing a recording.
+
+    Args:
+        duration_seconds: Audio duration
+        instruction_text: Custom instruction sent as the system prompt
+        segment_words: Segment size if the transcript is post-processed in
+            segments (POST_PROCESS_SEGMENT_WORDS); the instruction is sent with each
+
+    Returns:
+        Estimated cost in USD
+    """
+    transcript_tokens = int(duration_seconds * ESTIMATED_TOKENS_PER_AUDIO_SECOND)
+    segments = 1
+    if segment_words > 0:
+        segments = max(1, math.ceil(transcript_tokens * ESTIMATED_WORDS_PER_TOKEN / segment_words))
+    prompt_tokens = transcript_tokens + segments * (len(instruction_text) // 4)
+    return whisper_cost(duration_seconds) + chat_cost(prompt_tokens, transcript_tokens)
+
+def seconds_until_budget_reset() -> float:
+    """Seconds until the daily budgets start over (midnight UTC)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    midnight = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+def start_usage_tracking() -> Tuple[List[Dict[str, Any]], contextvars.Token]:
+    """
+    Start collecting the API usage of OpenAI calls made in the current context.
+
+    Returns:
+        List that receives one usage record per API call, and a token for
+        stop_usage_tracking
+    """
+    records: List[Dict[str, Any]] = []
+    return records, _usage_records.set(records)
+
+def stop_usage_tracking(token: contextvars.Token):
+    """Stop the usage tracking started by start_usage_tracking."""
+    _usage_records.reset(token)
+
+@contextmanager
+def track_usage():
+    """
+    Collect the API usage of every OpenAI call made inside the block.
+
+    Yields:
+        List that receives one usage record per API call
+    """
+    records, token = start_usage_tracking()
+    try:
+        yield records
+    finally:
+        stop_usage_tracking(token)
+
+def record_usage(
+    operation: str,
+    model: str,
+    latency_seconds: float,
+    audio_seconds: float = 0.0,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0
+):
+    """
+    Record the usage of one API call for the job in the current context.
+
+    Calls made outside track_usage() are ignored.
+    """
+    records = _usage_records.get()
+    if records is None:
+        return
+    if operation == "transcription":
+        cost = whisper_cost(audio_seconds)
+    elif operation == "embedding":
+        cost = embedding_cost(prompt_tokens)
+    else:
+        cost = chat_cost(prompt_tokens, completion_tokens)
+    records.append({
+        "operation": operation,
+        "model": model,
+        "audio_seconds": audio_seconds,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "latency_ms": int(latency_seconds * 1000),
+        "cost_usd": cost,
+    })
+
+def check_budget(estimated_cost: float, user_id: Optional[str] = None,
+                 custom_instruction_id: Optional[int] = None):
+    """
+    Refuse a job if its estimated cost would exceed a configured daily budget.
+
+    Args:
+        estimated_cost: Estimated cost of the job in USD
+        user_id: User submitting the job
+        custom_instruction_id: Instruction the job will use
+
+    Raises:
+        BudgetExceeded: If any budget would be exceeded
+    """
+    checks = [
+        ("global", DAILY_BUDGET_USD, {}),
+        ("user", USER_DAILY_BUDGET_USD, {"user_id": user_id}),
+        ("instruction", INSTRUCTION_DAILY_BUDGET_USD, {"custom_instruction_id": custom_instruction_id}),
+    ]
+    for scope, budget, filters in checks:
+        if budget <= 0 or any(value is None for value in filters.values()):
+            continue
+        spent = get_spend_today(**filters)
+        if spent + estimated_cost > budget:
+            logger.warning(
+                f"Job refused: {scope} daily budget ${budget:.2f} would be exceeded "
+                f"(spent ${spent:.2f}, estimated ${estimated_cost:.2f})"
+            )
+            raise BudgetExceeded(
+                f"Daily {scope} budget of ${budget:.2f} would be exceeded "
+                f"(spent today ${spent:.2f}, this job ~${estimated_cost:.2f}). Try again tomorrow.",
+                scope, spent, budget
+            )
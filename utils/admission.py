@@ -0,0 +1,399 @@
+"""
+Memory and disk admission control for uploads and transcription jobs.
+
+With MAX_CONTENT_LENGTH at 500 MB and a container limit of a few GB, a
+handful of concurrent large uploads can get the app OOM-killed or fill the
+uploads volume. Before a job starts, its footprint is estimated from the
+request length (and, once the file is probed, its duration) and reserved in
+a small ledger that all workers on the host share. A job is admitted when
+
+- the reservations of running jobs plus its own stay within the memory
+  budget (ADMISSION_MEMORY_BUDGET_MB, by default ADMISSION_MEMORY_FRACTION
+  of the container's memory limit),
+- the memory the kernel reports as available covers its estimate, and
+- the free space on the uploads volume, less what running jobs have
+  reserved, covers its estimate plus ADMISSION_DISK_RESERVE_MB.
+
+Otherwise it waits up to ADMISSION_WAIT_SECONDS for running jobs to finish
+and is then rejected with AdmissionRejected, which carries a Retry-After
+hint. A job is always admitted by the memory budget when nothing else is
+running, so one larger than the whole budget still gets processed on its own.
+
+Reservations are scoped to the host, so containers sharing the db/ volume
+each have their own budget. Reservations of processes that died are
+dropped on the next admission.
+"""
+import os
+import time
+import uuid
+import socket
+import shutil
+import sqlite3
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, Tuple
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import DB_DIR
+
+# Initialize logger
+logger = get_app_logger()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_LEDGER_PATH = os.getenv("ADMISSION_LEDGER_PATH", os.path.join(DB_DIR, "admission.db"))
+# Memory all running jobs may reserve; 0 derives it from the memory limit
+ADMISSION_MEMORY_BUDGET_MB = float(os.getenv("ADMISSION_MEMORY_BUDGET_MB", "0"))
+# Share of the container (or machine) memory limit used as the budget; the
+# rest is left to the app processes themselves
+ADMISSION_MEMORY_FRACTION = float(os.getenv("ADMISSION_MEMORY_FRACTION", "0.6"))
+# Free space always left on the uploads volume
+ADMISSION_DISK_RESERVE_MB = float(os.getenv("ADMISSION_DISK_RESERVE_MB", "1024"))
+# How long an upload waits for room before it is rejected
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "30"))
+# How long a queue worker waits for room before giving the job back
+ADMISSION_WORKER_WAIT_SECONDS = float(os.getenv("ADMISSION_WORKER_WAIT_SECONDS", "600"))
+# Retry-After sent with a rejection
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "60"))
+# Reservations older than this are dropped even if their process still runs
+ADMISSION_MAX_HOLD_SECONDS = float(os.getenv("ADMISSION_MAX_HOLD_SECONDS", str(6 * 3600)))
+
+# Footprint model, per job. Two ffmpeg processes run at a time at most
+# (decode and encode during VAD), and the OpenAI SDK reads a whole chunk of
+# up to 25 MB into memory to send it
+JOB_BASE_MEMORY_BYTES = int(float(os.getenv("ADMISSION_JOB_MEMORY_MB", "160")) * 1024 * 1024)
+CHUNK_MEMORY_BYTES = 25 * 1024 * 1024
+# Derived files (VAD and tempo output) are MP3s of at most this many bytes
+# per second of audio
+DERIVED_BYTES_PER_SECOND = 8000
+POLL_INTERVAL_SECONDS = 0.5
+
+HOSTNAME = socket.gethostname()
+
+_current: contextvars.ContextVar[Optional["Reservation"]] = contextvars.ContextVar(
+    "admission_reservation", default=None
+)
+
+class AdmissionRejected(Exception):
+    """Raised when a job does not fit in the memory or disk budget."""
+
+    def __init__(self, message: str, retry_after: int, resource: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.resource = resource
+
+def estimate_footprint(upload_bytes: int, duration: Optional[float] = None,
+                       processing: bool = True) -> Dict[str, int]:
+    """
+    Peak memory and disk use of a job.
+
+    Args:
+        upload_bytes: Size of the upload (the request length before it is read)
+        duration: Probed duration in seconds, if known
+        processing: False for uploads that are only saved and queued
+
+    Returns:
+        {"memory_bytes": ..., "disk_bytes": ...}
+    """
+    upload_bytes = max(0, int(upload_bytes or 0))
+    # The request body is spooled to a temporary file, then saved to uploads/
+    disk = 2 * upload_bytes
+    if not processing:
+        return {"memory_bytes": 0, "disk_bytes": disk}
+    if duration is None:
+        # Chunks of the upload plus derived files no larger than it
+        derived = 2 * upload_bytes
+    else:
+        # Chunks of the upload plus the VAD and tempo outputs
+        derived = upload_bytes + int(2 * duration * DERIVED_BYTES_PER_SECOND)
+    memory = JOB_BASE_MEMORY_BYTES + min(upload_bytes, CHUNK_MEMORY_BYTES)
+    return {"memory_bytes": memory, "disk_bytes": disk + derived}
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+def _meminfo() -> Dict[str, int]:
+    info = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                info[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return info
+
+def memory_limit() -> Optional[int]:
+    """Memory limit of the container (cgroup v2 or v1), else the machine's total memory."""
+    total = _meminfo().get("MemTotal")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = _read_int(path)
+        # v1 reports "no limit" as a huge number
+        if limit is not None and (total is None or limit < total):
+            return limit
+    return total
+
+def memory_available() -> Optional[int]:
+    """Memory that can still be allocated before the container limit or the kernel runs out."""
+    available = _meminfo().get("MemAvailable")
+    limit = memory_limit()
+    for path in ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        usage = _read_int(path)
+        if usage is not None and limit is not None:
+            headroom = limit - usage
+            available = headroom if available is None else min(available, headroom)
+            break
+    return available
+
+def memory_budget() -> Optional[int]:
+    if ADMISSION_MEMORY_BUDGET_MB > 0:
+        return int(ADMISSION_MEMORY_BUDGET_MB * 1024 * 1024)
+    limit = memory_limit()
+    return int(limit * ADMISSION_MEMORY_FRACTION) if limit else None
+
+def _disk_free() -> int:
+    path = os.path.join(os.getcwd(), "uploads")
+    return shutil.disk_usage(path if os.path.isdir(path) else os.getcwd()).free
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Ledger:
+    """Reservations of running jobs in a SQLite file shared by the workers of all hosts."""
+
+    def __init__(self, path: str = ADMISSION_LEDGER_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS reservations (
+                id TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                label TEXT,
+                memory_bytes INTEGER NOT NULL,
+                disk_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _purge_stale(self, conn: sqlite3.Connection):
+        rows = conn.execute("SELECT id, pid FROM reservations WHERE host = ?", (HOSTNAME,)).fetchall()
+        dead = [row["id"] for row in rows if not _pid_alive(row["pid"])]
+        if dead:
+            logger.warning(f"Dropping {len(dead)} admission reservation(s) of processes that exited")
+            conn.executemany("DELETE FROM reservations WHERE id = ?", [(reservation_id,) for reservation_id in dead])
+        conn.execute("DELETE FROM reservations WHERE created_at < ?", (time.time() - ADMISSION_MAX_HOLD_SECONDS,))
+
+    def try_reserve(self, footprint: Dict[str, int], label: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Reserve the footprint if it fits.
+
+        Returns:
+            (reservation ID, None), or (None, the resource that is short)
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge_stale(conn)
+                running, reserved_memory, reserved_disk = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(memory_bytes), 0), COALESCE(SUM(disk_bytes), 0) "
+                    "FROM reservations WHERE host = ?", (HOSTNAME,)
+                ).fetchone()
+                short = _short_resource(footprint, running, reserved_memory, reserved_disk)
+                if short is not None:
+                    conn.execute("COMMIT")
+                    return None, short
+                reservation_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO reservations (id, host, pid, label, memory_bytes, disk_bytes, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (reservation_id, HOSTNAME, os.getpid(), label, footprint["memory_bytes"],
+                     footprint["disk_bytes"], time.time())
+                )
+                conn.execute("COMMIT")
+                return reservation_id, None
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update(self, reservation_id: str, footprint: Dict[str, int]):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE reservations SET memory_bytes = ?, disk_bytes = ? WHERE id = ?",
+                (footprint["memory_bytes"], footprint["disk_bytes"], reservation_id)
+            )
+
+    def release(self, reservation_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+
+    def usage(self) -> Dict[str, Any]:
+        """Reservations of running jobs on this host."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS jobs, COALESCE(SUM(memory_bytes), 0) AS memory_bytes, "
+                "COALESCE(SUM(disk_bytes), 0) AS disk_bytes FROM reservations WHERE host = ?", (HOSTNAME,)
+            ).fetchone()
+        return dict(row)
+
+def _short_resource(footprint: Dict[str, int], running: int, reserved_memory: int,
+                    reserved_disk: int) -> Optional[str]:
+    """Name of the resource the job does not fit in, or None."""
+    budget = memory_budget()
+    if running and budget is not None and reserved_memory + footprint["memory_bytes"] > budget:
+        return "memory"
+    available = memory_available()
+    if running and available is not None and footprint["memory_bytes"] > available:
+        return "memory"
+    # Running jobs have written part of their reservation already, so this
+    # errs on the side of caution
+    if footprint["disk_bytes"] + reserved_disk + ADMISSION_DISK_RESERVE_MB * 1024 * 1024 > _disk_free():
+        return "disk"
+    return None
+
+class Reservation:
+    """
+    Admitted job; release it (or leave the with block) when the job is done.
+
+    While entered, refine() in the same context updates its footprint.
+    """
+
+    def __init__(self, ledger: Optional[Ledger], reservation_id: Optional[str], upload_bytes: int,
+                 footprint: Dict[str, int]):
+        self.ledger = ledger
+        self.reservation_id = reservation_id
+        self.upload_bytes = upload_bytes
+        self.footprint = footprint
+        self._token = None
+
+    def refine(self, duration: float):
+        """Replace the estimate made from the request length with one from the probed duration."""
+        if self.ledger is None:
+            return
+        self.footprint = estimate_footprint(self.upload_bytes, duration)
+        try:
+            self.ledger.update(self.reservation_id, self.footprint)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update admission reservation: {str(e)}")
+
+    def release(self):
+        if self.ledger is None or self.reservation_id is None:
+            return
+        try:
+            self.ledger.release(self.reservation_id)
+        except sqlite3.Error as e:
+            # The next admission drops it once this process exits
+            logger.error(f"Could not release admission reservation: {str(e)}")
+        self.reservation_id = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.release()
+        return False
+
+_ledger: Optional[Ledger] = None
+
+def get_ledger() -> Ledger:
+    global _ledger
+    if _ledger is None:
+        _ledger = Ledger()
+    return _ledger
+
+def admit(upload_bytes: Optional[int], duration: Optional[float] = None, processing: bool = True,
+          wait_seconds: Optional[float] = None, label: str = "") -> Reservation:
+    """
+    Reserve memory and disk for a job, waiting for room if necessary.
+
+    Args:
+        upload_bytes: Request length or file size
+        duration: Probed duration, if already known
+        processing: False for uploads that are only saved and queued
+        wait_seconds: How long to wait for room (default ADMISSION_WAIT_SECONDS)
+        label: Shown in logs, e.g. the filename
+
+    Returns:
+        Reservation to hold while the job runs
+
+    Raises:
+        AdmissionRejected: If the job still does not fit after waiting
+    """
+    upload_bytes = int(upload_bytes or 0)
+    footprint = estimate_footprint(upload_bytes, duration, processing)
+    if not ADMISSION_ENABLED:
+        return Reservation(None, None, upload_bytes, footprint)
+
+    wait_seconds = ADMISSION_WAIT_SECONDS if wait_seconds is None else wait_seconds
+    ledger = get_ledger()
+    started = time.monotonic()
+    logged = False
+    while True:
+        reservation_id, short = ledger.try_reserve(footprint, label)
+        waited = time.monotonic() - started
+        if reservation_id is not None:
+            metrics.ADMISSION_DECISIONS.labels("waited" if logged else "admitted").inc()
+            if logged:
+                metrics.ADMISSION_WAIT_SECONDS.observe(waited)
+                logger.info(f"Admitted {label or 'job'} after waiting {waited:.1f}s")
+            return Reservation(ledger, reservation_id, upload_bytes, footprint)
+        if waited >= wait_seconds:
+            break
+        if not logged:
+            logger.info(
+                f"Not enough {short} for {label or 'job'} "
+                f"({footprint['memory_bytes'] / (1024 * 1024):.0f} MB memory, "
+                f"{footprint['disk_bytes'] / (1024 * 1024):.0f} MB disk); waiting up to {wait_seconds:.0f}s"
+            )
+            logged = True
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+    metrics.ADMISSION_DECISIONS.labels("rejected").inc()
+    logger.warning(f"Rejected {label or 'job'}: not enough {short}")
+    raise AdmissionRejected(
+        f"The server is busy (not enough {short} for this upload right now). "
+        f"Please try again in {ADMISSION_RETRY_AFTER_SECONDS} seconds.",
+        ADMISSION_RETRY_AFTER_SECONDS, short
+    )
+
+def refine(duration: float):
+    """Refine the current job's reservation, if any, with its probed duration."""
+    reservation = _current.get()
+    if reservation is not None:
+        reservation.refine(duration)
+
+def usage() -> Dict[str, Any]:
+    """Reserved and available memory and disk on this host, for the health check."""
+    report = {"enabled": ADMISSION_ENABLED}
+    if ADMISSION_ENABLED:
+        report.update(get_ledger().usage())
+    report["memory_budget_bytes"] = memory_budget()
+    report["memory_available_bytes"] = memory_available()
+    report["disk_free_bytes"] = _disk_free()
+    return report
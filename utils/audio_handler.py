@@ -1,10 +1,10 @@
 import os
+import asyncio
 import tempfile
 import subprocess
 import math
 from typing import List, Dict, Any, Optional, Tuple
 import shutil
-from pydub import AudioSegment
 
 from utils.openai_client import MAX_FILE_SIZE, check_file_size
 
@@ -13,6 +13,16 @@ TEMP_AUDIO_DIR = "temp_audio"
 # Directory for uploaded files
 UPLOAD_DIR = "uploads"
 
+# Speed-up applied to recordings before transcription. Whisper bills and
+# processes by audio length, so 1.5 cuts both by a third; 1.0 disables it.
+# Custom instructions can override it (see benchmarks/tempo_benchmark.py).
+TEMPO_FACTOR = float(os.getenv("TEMPO_FACTOR", "1.0"))
+# Range accepted for the speed-up; above 2x recognition degrades quickly
+MIN_TEMPO_FACTOR = 1.0
+MAX_TEMPO_FACTOR = 2.0
+# Bitrate of the sped-up mono MP3 sent to Whisper
+TEMPO_BITRATE = os.getenv("TEMPO_BITRATE", "64k")
+
 def ensure_directories_exist():
     """Ensure that temporary and upload directories exist."""
     for directory in [TEMP_AUDIO_DIR, UPLOAD_DIR]:
@@ -26,7 +36,7 @@ def save_uploaded_file(file, filename: str) -> str:
     Args:
         file: File object from Flask request
         filename: Name of the file
-        
+    
     Returns:
         Path to the saved file
     """
@@ -35,50 +45,60 @@ def save_uploaded_file(file, filename: str) -> str:
     file.save(file_path)
     return file_path
 
+async def _run_async(cmd: List[str]) -> Tuple[int, str, str]:
+    """Run a subprocess without blocking the event loop."""
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+
+def _duration_cmd(file_path: str) -> List[str]:
+    return [
+        "ffprobe", 
+        "-v", "error", 
+        "-show_entries", "format=duration", 
+        "-of", "default=noprint_wrappers=1:nokey=1", 
+        file_path
+    ]
+
 def get_audio_duration(file_path: str) -> float:
     """
     Get the duration of an audio file in seconds using FFmpeg.
     
     Args:
         file_path: Path to the audio file
-        
+    
     Returns:
         Duration in seconds
     """
-    cmd = [
-        "ffprobe", 
-        "-v", "error", 
-        "-show_entries", "format=duration", 
-        "-of", "default=noprint_wrappers=1:nokey=1", 
-        file_path
-    ]
-    
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    result = subprocess.run(_duration_cmd(file_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     
     if result.returncode != 0:
         raise ValueError(f"Error getting audio duration: {result.stderr}")
     
     return float(result.stdout.strip())
 
-def split_audio_file(file_path: str) -> List[str]:
+async def get_audio_duration_async(file_path: str) -> float:
+    """Awaitable version of get_audio_duration."""
+    returncode, stdout, stderr = await _run_async(_duration_cmd(file_path))
+    
+    if returncode != 0:
+        raise ValueError(f"Error getting audio duration: {stderr}")
+    
+    return float(stdout.strip())
+
+def _split_commands(file_path: str, duration: float) -> List[Tuple[str, List[str]]]:
     """
-    Split audio file into chunks of appropriate size for Whisper API.
+    Plan the FFmpeg commands that split a file into Whisper-sized chunks.
     
     Args:
         file_path: Path to the audio file
-        
+        duration: Duration of the file in seconds
+    
     Returns:
-        List of paths to the split audio files
+        List of (chunk path, FFmpeg command) pairs
     """
-    ensure_directories_exist()
-    
-    # Calculate file size and determine if splitting is needed
-    if check_file_size(file_path):
-        return [file_path]  # No need to split
-    
-    # Get audio duration
-    duration = get_audio_duration(file_path)
-    
     # Get file size
     file_size = os.path.getsize(file_path)
     
@@ -96,7 +116,7 @@ def split_audio_file(file_path: str) -> List[str]:
     file_name = os.path.basename(file_path)
     file_name_without_ext, ext = os.path.splitext(file_name)
     
-    chunk_files = []
+    commands = []
     
     for i in range(num_chunks):
         start_time = i * chunk_duration
@@ -111,7 +131,29 @@ def split_audio_file(file_path: str) -> List[str]:
             "-c", "copy",  # Copy without re-encoding
             chunk_file
         ]
-        
+        commands.append((chunk_file, cmd))
+    
+    return commands
+
+def split_audio_file(file_path: str) -> List[str]:
+    """
+    Split audio file into chunks of appropriate size for Whisper API.
+    
+    Args:
+        file_path: Path to the audio file
+    
+    Returns:
+        List of paths to the split audio files
+    """
+    ensure_directories_exist()
+    
+    # Calculate file size and determine if splitting is needed
+    if check_file_size(file_path):
+        return [file_path]  # No need to split
+    
+    chunk_files = []
+    
+    for chunk_file, cmd in _split_commands(file_path, get_audio_duration(file_path)):
         result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         if result.returncode != 0:
@@ -121,6 +163,26 @@ def split_audio_file(file_path: str) -> List[str]:
     
     return chunk_files
 
+async def split_audio_file_async(file_path: str) -> List[str]:
+    """Awaitable version of split_audio_file."""
+    ensure_directories_exist()
+    
+    if check_file_size(file_path):
+        return [file_path]  # No need to split
+    
+    commands = _split_commands(file_path, await get_audio_duration_async(file_path))
+    chunk_files = []
+    
+    for chunk_file, cmd in commands:
+        returncode, _, stderr = await _run_async(cmd)
+        
+        if returncode != 0:
+            raise ValueError(f"Error splitting audio file: {stderr}")
+        
+        chunk_files.append(chunk_file)
+    
+    return chunk_files
+
 def cleanup_temp_files(file_paths: List[str]):
     """
     Clean up temporary files and directories.
@@ -138,17 +200,79 @@ def cleanup_temp_files(file_paths: List[str]):
             if os.path.exists(dir_path) and not os.listdir(dir_path):
                 os.rmdir(dir_path)
 
-def get_file_type(file_path: str) -> str:
+def validate_tempo_factor(factor: float) -> float:
     """
-    Get the file type/format using FFmpeg.
+    Check that a speed-up is within the supported range.
+    
+    Raises:
+        ValueError: If it is outside MIN_TEMPO_FACTOR..MAX_TEMPO_FACTOR
+    """
+    factor = float(factor)
+    if not MIN_TEMPO_FACTOR <= factor <= MAX_TEMPO_FACTOR:
+        raise ValueError(f"Tempo factor must be between {MIN_TEMPO_FACTOR:g} and {MAX_TEMPO_FACTOR:g}")
+    return factor
+
+def _tempo_cmd(file_path: str, factor: float, output_path: str) -> List[str]:
+    # atempo time-stretches without changing pitch
+    return [
+        "ffmpeg", "-v", "error", "-y",
+        "-i", file_path,
+        "-vn",
+        "-filter:a", f"atempo={factor:g}",
+        "-ac", "1", "-ar", "16000",
+        "-c:a", "libmp3lame", "-b:a", TEMPO_BITRATE,
+        output_path
+    ]
+
+def _tempo_output_path() -> str:
+    ensure_directories_exist()
+    fd, output_path = tempfile.mkstemp(suffix=".mp3", dir=TEMP_AUDIO_DIR)
+    os.close(fd)
+    return output_path
+
+def apply_tempo(file_path: str, factor: float) -> str:
+    """
+    Speed up a recording without changing its pitch.
     
     Args:
         file_path: Path to the audio file
-        
+        factor: Speed-up, e.g. 1.5 plays 90 seconds of audio in 60
+    
     Returns:
-        File type/format
+        Path to the sped-up MP3 in the temporary directory
     """
-    cmd = [
+    output_path = _tempo_output_path()
+    result = subprocess.run(_tempo_cmd(file_path, validate_tempo_factor(factor), output_path),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    if result.returncode != 0:
+        os.remove(output_path)
+        raise ValueError(f"Error changing audio tempo: {result.stderr.decode('utf-8')}")
+    
+    return output_path
+
+async def apply_tempo_async(file_path: str, factor: float) -> str:
+    """Awaitable version of apply_tempo."""
+    output_path = _tempo_output_path()
+    returncode, _, stderr = await _run_async(_tempo_cmd(file_path, validate_tempo_factor(factor), output_path))
+    
+    if returncode != 0:
+        os.remove(output_path)
+        raise ValueError(f"Error changing audio tempo: {stderr}")
+    
+    return output_path
+
+def rescale_time(seconds: float, factor: float) -> float:
+    """
+    Convert a time in sped-up audio to the audio before the speed-up.
+    
+    When silence was stripped first, pass the result to
+    TimeMap.to_original to get the time in the uploaded recording.
+    """
+    return seconds * factor
+
+def _file_type_cmd(file_path: str) -> List[str]:
+    return [
         "ffprobe", 
         "-v", "error", 
         "-select_streams", "a:0", 
@@ -156,10 +280,29 @@ def get_file_type(file_path: str) -> str:
         "-of", "default=noprint_wrappers=1:nokey=1", 
         file_path
     ]
+
+def get_file_type(file_path: str) -> str:
+    """
+    Get the file type/format using FFmpeg.
     
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    Args:
+        file_path: Path to the audio file
+    
+    Returns:
+        File type/format
+    """
+    result = subprocess.run(_file_type_cmd(file_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     
     if result.returncode != 0:
         raise ValueError(f"Error getting file type: {result.stderr}")
     
     return result.stdout.strip()
+
+async def get_file_type_async(file_path: str) -> str:
+    """Awaitable version of get_file_type."""
+    returncode, stdout, stderr = await _run_async(_file_type_cmd(file_path))
+    
+    if returncode != 0:
+        raise ValueError(f"Error getting file type: {stderr}")
+    
+    return stdout.strip()
@@ -0,0 +1,320 @@
+"""
+Online backups of the transcriptions database.
+
+Copying db/transcriptions.db with cp while a transcription is being saved
+can produce a torn, unusable snapshot, and copying it under a lock stalls
+every request for as long as the copy takes. Backups therefore use SQLite's
+online backup API: the database is copied BACKUP_STEP_PAGES pages at a time,
+each step holding the read lock only for a few milliseconds, with a pause
+in between so the app's own reads and writes go first. If another
+connection commits while a backup is in progress, SQLite restarts the copy
+so that the snapshot stays consistent; a backup that keeps being restarted
+is abandoned and retried on the next schedule.
+
+Every snapshot is checked with PRAGMA quick_check, gzip-compressed (unless
+BACKUP_COMPRESSION=none) and written to BACKUP_DIR under a name carrying
+its UTC timestamp. Only the newest BACKUP_RETAIN_COUNT snapshots are kept.
+
+Recordings already moved to cold storage by maintenance are plain files
+and are not part of these snapshots.
+"""
+import os
+import re
+import gzip
+import time
+import fcntl
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import DATABASE_FILE, DB_DIR
+
+# Initialize logger
+logger = get_app_logger()
+
+# Take scheduled snapshots in a background thread of the app (one process at a time)
+BACKUP_ENABLED = os.getenv("BACKUP_ENABLED", "0") == "1"
+BACKUP_INTERVAL_SECONDS = float(os.getenv("BACKUP_INTERVAL_SECONDS", "86400"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.getcwd(), "backups"))
+# Snapshots to keep; 0 keeps all of them
+BACKUP_RETAIN_COUNT = int(os.getenv("BACKUP_RETAIN_COUNT", "14"))
+# "gzip" or "none"
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip").lower()
+BACKUP_COMPRESSION_LEVEL = int(os.getenv("BACKUP_COMPRESSION_LEVEL", "6"))
+
+# Pages copied per step (4 MB with the default 4 KB pages), and the pause between steps
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "1024"))
+BACKUP_STEP_PAUSE_SECONDS = float(os.getenv("BACKUP_STEP_PAUSE_SECONDS", "0.02"))
+# Restarts caused by concurrent writes before a backup attempt is given up
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "20"))
+
+LOCK_FILE = os.path.join(DB_DIR, "backup.lock")
+BACKUP_NAME = re.compile(r"^transcriptions-(\d{8}T\d{6}Z)(?:-[\w.-]+)?\.db(?:\.gz)?$")
+# The scheduler checks whether a snapshot is due this often
+SCHEDULE_CHECK_SECONDS = 300
+
+class BackupError(Exception):
+    """Raised when a snapshot cannot be taken or restored."""
+
+@contextmanager
+def backup_lock():
+    """
+    Hold the backup lock for the duration of the block.
+
+    Yields:
+        True if this process holds the lock, False if another one does
+    """
+    os.makedirs(DB_DIR, exist_ok=True)
+    with open(LOCK_FILE, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class _TooManyRestarts(Exception):
+    pass
+
+def _online_copy(source_file: str, target_file: str, step_pages: int, pause: float,
+                 max_restarts: int) -> Dict[str, Any]:
+    """Copy a live database page range by page range with the backup API."""
+    report = {"pages": 0, "steps": 0, "restarts": 0}
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        report["steps"] += 1
+        report["pages"] = total
+        # The remaining count only goes up when a write restarted the copy
+        if last_remaining is not None and remaining >= last_remaining:
+            report["restarts"] += 1
+            metrics.BACKUP_RESTARTS.inc()
+            if report["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_file, timeout=30)
+    target = sqlite3.connect(target_file)
+    try:
+        source.backup(target, pages=step_pages, progress=progress)
+    except _TooManyRestarts:
+        raise BackupError(
+            f"Backup restarted {report['restarts']} times by concurrent writes; "
+            "it will be retried on the next schedule"
+        )
+    finally:
+        target.close()
+        source.close()
+    return report
+
+def _check_snapshot(path: str):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"Snapshot failed its integrity check: {result}")
+
+def list_backups(backup_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Snapshots in the backup directory, newest first."""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    backups = []
+    for name in os.listdir(backup_dir):
+        match = BACKUP_NAME.match(name)
+        if match:
+            path = os.path.join(backup_dir, name)
+            backups.append({
+                "path": path,
+                "created_at": datetime.strptime(match.group(1), "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc),
+                "bytes": os.path.getsize(path),
+            })
+    return sorted(backups, key=lambda backup: backup["created_at"], reverse=True)
+
+def prune_backups(retain: Optional[int] = None, backup_dir: Optional[str] = None) -> List[str]:
+    """Delete all but the newest ``retain`` snapshots (BACKUP_RETAIN_COUNT); returns the deleted paths."""
+    retain = BACKUP_RETAIN_COUNT if retain is None else retain
+    if retain <= 0:
+        return []
+    removed = []
+    for backup in list_backups(backup_dir)[retain:]:
+        os.remove(backup["path"])
+        removed.append(backup["path"])
+        logger.info(f"Removed old backup {backup['path']}")
+    return removed
+
+def create_backup(label: Optional[str] = None, backup_dir: Optional[str] = None,
+                  compression: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Take a consistent snapshot of the live database.
+
+    Args:
+        label: Optional suffix for the file name, e.g. "pre-restore"
+        backup_dir: Defaults to BACKUP_DIR
+        compression: "gzip" or "none"; defaults to BACKUP_COMPRESSION
+
+    Returns:
+        Report with the snapshot's path, sizes and copy statistics
+
+    Raises:
+        BackupError: If the copy kept being restarted or the snapshot is damaged
+    """
+    backup_dir = backup_dir or BACKUP_DIR
+    compression = (compression or BACKUP_COMPRESSION).lower()
+    if compression not in ("gzip", "none"):
+        raise ValueError(f"Unknown backup compression: {compression}")
+    os.makedirs(backup_dir, exist_ok=True)
+
+    started = time.monotonic()
+    created_at = datetime.now(timezone.utc)
+    name = f"transcriptions-{created_at:%Y%m%dT%H%M%SZ}{'-' + label if label else ''}.db"
+    path = os.path.join(backup_dir, name + (".gz" if compression == "gzip" else ""))
+
+    # Work on hidden files in the backup directory, so a half-written
+    # snapshot is never listed and the final rename is atomic
+    fd, snapshot = tempfile.mkstemp(dir=backup_dir, prefix=".snapshot_", suffix=".db")
+    os.close(fd)
+    try:
+        copy = _online_copy(DATABASE_FILE, snapshot, BACKUP_STEP_PAGES, BACKUP_STEP_PAUSE_SECONDS,
+                            BACKUP_MAX_RESTARTS)
+        copied_at = time.monotonic()
+        _check_snapshot(snapshot)
+        database_bytes = os.path.getsize(snapshot)
+
+        if compression == "gzip":
+            fd, compressed = tempfile.mkstemp(dir=backup_dir, prefix=".snapshot_", suffix=".db.gz")
+            try:
+                with os.fdopen(fd, "wb") as raw, \
+                        gzip.GzipFile(filename=name, mode="wb", fileobj=raw,
+                                      compresslevel=BACKUP_COMPRESSION_LEVEL) as f, \
+                        open(snapshot, "rb") as source:
+                    shutil.copyfileobj(source, f, 1024 * 1024)
+                os.replace(compressed, path)
+            except BaseException:
+                os.remove(compressed)
+                raise
+        else:
+            os.replace(snapshot, path)
+    except Exception:
+        metrics.BACKUPS.labels("failed").inc()
+        raise
+    finally:
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+
+    metrics.BACKUPS.labels("ok").inc()
+    report = {
+        "path": path,
+        "created_at": created_at.isoformat(),
+        "database_bytes": database_bytes,
+        "backup_bytes": os.path.getsize(path),
+        "copy_seconds": round(copied_at - started, 2),
+        "seconds": round(time.monotonic() - started, 2),
+        **copy,
+    }
+    logger.info(
+        f"Backup {path}: {database_bytes / (1024 * 1024):.1f} MB database, "
+        f"{report['backup_bytes'] / (1024 * 1024):.1f} MB on disk, copied in {report['steps']} step(s) "
+        f"with {report['restarts']} restart(s) in {report['seconds']}s"
+    )
+    return report
+
+def restore_backup(path: str) -> Dict[str, Any]:
+    """
+    Replace the contents of the live database with a snapshot.
+
+    The snapshot is checked before anything is overwritten, and it is copied
+    in with the backup API in one step, so connections that are open keep
+    working and see the restored data. Stop the app first anyway: in-process
+    caches are not guaranteed to notice the change, and writes made after
+    the snapshot was taken are lost.
+
+    Raises:
+        BackupError: If the snapshot is damaged
+    """
+    if not os.path.exists(path):
+        raise BackupError(f"Backup not found: {path}")
+    os.makedirs(DB_DIR, exist_ok=True)
+    fd, snapshot = tempfile.mkstemp(dir=DB_DIR, prefix=".restore_", suffix=".db")
+    os.close(fd)
+    try:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as source, open(snapshot, "wb") as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+        else:
+            shutil.copyfile(path, snapshot)
+        _check_snapshot(snapshot)
+
+        source = sqlite3.connect(snapshot)
+        target = sqlite3.connect(DATABASE_FILE, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        database_bytes = os.path.getsize(DATABASE_FILE)
+    finally:
+        os.remove(snapshot)
+
+    logger.info(f"Restored database from {path} ({database_bytes / (1024 * 1024):.1f} MB)")
+    return {"path": path, "database_bytes": database_bytes}
+
+def backup_due() -> bool:
+    """True if the newest snapshot is older than BACKUP_INTERVAL_SECONDS (or there is none)."""
+    backups = list_backups()
+    if not backups:
+        return True
+    age = (datetime.now(timezone.utc) - backups[0]["created_at"]).total_seconds()
+    return age >= BACKUP_INTERVAL_SECONDS
+
+def run_scheduled_backup() -> Optional[Dict[str, Any]]:
+    """
+    Take a snapshot if one is due, then apply the retention.
+
+    Returns:
+        Report of the snapshot, or None if none was due or another process
+        is taking one
+    """
+    with backup_lock() as acquired:
+        if not acquired:
+            logger.debug("A backup is running in another process")
+            return None
+        # Every gunicorn worker runs the scheduler; the first one to find a
+        # snapshot due takes it
+        if not backup_due():
+            return None
+        report = create_backup()
+        report["removed"] = prune_backups()
+        return report
+
+def _backup_loop():
+    while True:
+        time.sleep(min(BACKUP_INTERVAL_SECONDS, SCHEDULE_CHECK_SECONDS))
+        try:
+            run_scheduled_backup()
+        except Exception as e:
+            logger.error(f"Scheduled backup failed: {str(e)}")
+
+_backup_thread: Optional[threading.Thread] = None
+
+def start_background_backups():
+    """Start the backup scheduler thread for this worker if BACKUP_ENABLED is set."""
+    global _backup_thread
+    if not BACKUP_ENABLED or (_backup_thread is not None and _backup_thread.is_alive()):
+        return
+    _backup_thread = threading.Thread(target=_backup_loop, name="backup", daemon=True)
+    _backup_thread.start()
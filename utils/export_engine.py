@@ -0,0 +1,144 @@
+"""
+Export rendering off the request thread.
+
+PDF and Word exports of long transcripts take seconds to minutes of CPU.
+They are rendered by a small pool of long-lived worker processes, which
+build their styles and templates once and keep them. Every render has a
+deadline: a worker that misses it is killed and replaced, so a pathological
+transcript cannot hold a render slot forever. The rendered file is then
+streamed to the client from disk and deleted when the response closes.
+Plaintext needs no layout and is streamed straight from the transcript.
+"""
+import os
+import time
+import queue
+import tempfile
+import threading
+import multiprocessing
+from typing import Dict, Any, Optional
+
+from utils.logging_config import get_app_logger
+from utils.export_utils import RENDERERS, serve_render_requests
+from utils import metrics
+
+# Initialize logger
+logger = get_app_logger()
+
+# Render processes per app worker; 0 renders in the request thread without a deadline
+EXPORT_PROCESSES = int(os.getenv("EXPORT_PROCESSES", "1"))
+# Must stay well below the gunicorn worker timeout (120 s in the Dockerfile),
+# or gunicorn kills the worker before the export can time out
+EXPORT_TIMEOUT_SECONDS = float(os.getenv("EXPORT_TIMEOUT_SECONDS", "60"))
+
+FILE_EXTENSIONS = {'pdf': 'pdf', 'docx': 'docx', 'text': 'txt'}
+
+class ExportTimeout(Exception):
+    """Raised when rendering an export takes longer than its deadline."""
+
+class _RenderProcess:
+    """One worker process and the parent's end of its pipe."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve_render_requests, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class RenderPool:
+    """
+    Fixed set of render processes, each handling one export at a time.
+
+    Args:
+        size: Number of processes
+        timeout: Default render deadline in seconds
+    """
+
+    def __init__(self, size: int = EXPORT_PROCESSES, timeout: float = EXPORT_TIMEOUT_SECONDS):
+        # Spawned processes do not inherit the app's threads or locks
+        self._context = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        self._idle: "queue.Queue[_RenderProcess]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(_RenderProcess(self._context))
+
+    def render(self, format: str, transcription: Dict[str, Any], output_path: str,
+               timeout: Optional[float] = None) -> str:
+        """
+        Render an export in a worker process.
+
+        Raises:
+            ExportTimeout: If the render misses its deadline (waiting for a
+                free process counts towards it)
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise ExportTimeout(f"No export worker became free within {timeout:.0f} seconds")
+
+        try:
+            worker.conn.send((format, transcription, output_path))
+            if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                logger.warning(f"Export render exceeded {timeout:.0f}s, restarting worker {worker.process.pid}")
+                worker.kill()
+                worker = _RenderProcess(self._context)
+                raise ExportTimeout(f"Export took longer than {timeout:.0f} seconds")
+            status, value = worker.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            # The worker died (e.g. out of memory); replace it
+            worker.kill()
+            worker = _RenderProcess(self._context)
+            raise RuntimeError("Export worker exited unexpectedly")
+        finally:
+            self._idle.put(worker)
+
+        if status != "ok":
+            raise RuntimeError(value)
+        return value
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+_pool: Optional[RenderPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+def get_render_pool() -> RenderPool:
+    """Return this process's render pool, starting it on first use."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Each gunicorn worker gets its own pool
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = RenderPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+def render_export(transcription: Dict[str, Any], format: str) -> str:
+    """
+    Render a PDF or Word export to a temporary file.
+
+    Returns:
+        Path of the file; the caller deletes it once it has been sent
+    """
+    fd, output_path = tempfile.mkstemp(suffix=f".{FILE_EXTENSIONS[format]}", prefix="export_")
+    os.close(fd)
+    try:
+        with metrics.time_stage("export_render"):
+            if EXPORT_PROCESSES > 0:
+                return get_render_pool().render(format, transcription, output_path)
+            return RENDERERS[format](transcription, output_path)
+    except Exception as e:
+        if isinstance(e, ExportTimeout):
+            metrics.EXPORT_TIMEOUTS.labels(format).inc()
+        os.remove(output_path)
+        raise
@@ -1,14 +1,88 @@
 import os
 import io
-from typing import Optional, Dict, Any
+import re
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterator, List
 from datetime import datetime
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from xml.sax.saxutils import escape
+
+# reportlab and python-docx are imported inside the renderers: they are only
+# needed in the export worker processes, and loading them (with lxml) is a
+# large part of the app's import time
+
+# Longer transcript blocks are broken at sentence ends before layout. ReportLab
+# re-wraps the remainder of a paragraph every time it splits it across pages,
+# so one huge block costs quadratic time.
+MAX_PARAGRAPH_CHARS = 2000
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+@lru_cache(maxsize=1)
+def _pdf_styles() -> Dict[str, Any]:
+    """Paragraph and table styles, built once per process."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
+    
+    styles = getSampleStyleSheet()
+    return {
+        'title': styles['Title'],
+        'heading': styles['Heading2'],
+        'metadata_table': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+            ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('PADDING', (0, 0), (-1, -1), 6),
+        ]),
+        # Custom style for transcription text
+        'transcription': ParagraphStyle(
+            'TranscriptionStyle',
+            parent=styles['Normal'],
+            spaceBefore=6,
+            spaceAfter=6,
+            leading=14
+        ),
+    }
+
+@lru_cache(maxsize=1)
+def _docx_template() -> bytes:
+    """Empty Word document with the export styles applied, built once per process."""
+    from docx import Document
+    from docx.shared import Pt
+    
+    doc = Document()
+    # Table text size comes from the table style instead of per-run formatting
+    doc.styles['Table Grid'].font.size = Pt(10)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def transcript_paragraphs(text: str, max_chars: int = MAX_PARAGRAPH_CHARS) -> Iterator[str]:
+    """
+    Split a transcript into paragraphs for layout.
+    
+    Paragraphs are separated by blank lines; paragraphs longer than
+    max_chars are further split at sentence boundaries.
+    """
+    for paragraph in text.split('\n\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            yield paragraph
+            continue
+        
+        current: List[str] = []
+        length = 0
+        for sentence in _SENTENCE_END.split(paragraph):
+            if current and length + len(sentence) > max_chars:
+                yield ' '.join(current)
+                current, length = [], 0
+            current.append(sentence)
+            length += len(sentence) + 1
+        if current:
+            yield ' '.join(current)
 
 def generate_pdf(transcription: Dict[str, Any], output_path: Optional[str] = None) -> str:
     """
@@ -17,7 +91,7 @@ def generate_pdf(transcription: Dict[str, Any], output_path: Optional[str] = Non
     Args:
         transcription: Transcription dictionary from the database
         output_path: Path to save the PDF file (optional)
-        
+    
     Returns:
         Path to the generated PDF file
     """
@@ -27,32 +101,18 @@ def generate_pdf(transcription: Dict[str, Any], output_path: Optional[str] = Non
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"{filename}_{timestamp}.pdf"
     
-    # Create a PDF buffer
-    buffer = io.BytesIO()
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
     
-    # Create the PDF document
-    doc = SimpleDocTemplate(buffer, pagesize=letter, title=f"Transcription - {transcription['original_filename']}")
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style = styles['Title']
-    heading_style = styles['Heading2']
-    normal_style = styles['Normal']
-    
-    # Custom style for transcription text
-    transcription_style = ParagraphStyle(
-        'TranscriptionStyle',
-        parent=normal_style,
-        spaceBefore=6,
-        spaceAfter=6,
-        leading=14
-    )
+    # Render straight to the output file; large documents never sit in memory twice
+    doc = SimpleDocTemplate(output_path, pagesize=letter, title=f"Transcription - {transcription['original_filename']}")
+    styles = _pdf_styles()
     
     # Create document content
     content = []
     
     # Add title
-    content.append(Paragraph(f"Transcription: {transcription['original_filename']}", title_style))
+    content.append(Paragraph(escape(f"Transcription: {transcription['original_filename']}"), styles['title']))
     content.append(Spacer(1, 12))
     
     # Add metadata table
@@ -64,38 +124,23 @@ def generate_pdf(transcription: Dict[str, Any], output_path: Optional[str] = Non
     ]
     
     metadata_table = Table(metadata, colWidths=[100, 350])
-    metadata_table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
+    metadata_table.setStyle(styles['metadata_table'])
     
     content.append(metadata_table)
     content.append(Spacer(1, 20))
     
     # Add processed transcription
-    content.append(Paragraph("Processed Transcription:", heading_style))
+    content.append(Paragraph("Processed Transcription:", styles['heading']))
     content.append(Spacer(1, 6))
     
-    # Split the processed transcription into paragraphs and add each as a Paragraph
-    for paragraph in transcription['processed_transcription'].split('\n\n'):
-        if paragraph.strip():
-            content.append(Paragraph(paragraph, transcription_style))
-            content.append(Spacer(1, 6))
+    # Transcript text is plain text, not ReportLab markup
+    for paragraph in transcript_paragraphs(transcription['processed_transcription']):
+        content.append(Paragraph(escape(paragraph), styles['transcription']))
+        content.append(Spacer(1, 6))
     
     # Build the PDF document
     doc.build(content)
     
-    # Get the PDF content from the buffer
-    pdf_content = buffer.getvalue()
-    buffer.close()
-    
-    # Write the PDF to a file
-    with open(output_path, 'wb') as f:
-        f.write(pdf_content)
-    
     return output_path
 
 def export_plaintext(transcription: Dict[str, Any], output_path: Optional[str] = None) -> str:
@@ -105,7 +150,7 @@ def export_plaintext(transcription: Dict[str, Any], output_path: Optional[str] =
     Args:
         transcription: Transcription dictionary from the database
         output_path: Path to save the text file (optional)
-        
+    
     Returns:
         Path to the generated text file
     """
@@ -115,20 +160,26 @@ def export_plaintext(transcription: Dict[str, Any], output_path: Optional[str] =
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"{filename}_{timestamp}.txt"
     
-    # Create the text content
-    content = f"Transcription: {transcription['original_filename']}\n"
-    content += f"Duration: {transcription['duration_seconds']:.2f} seconds\n"
-    content += f"File Type: {transcription['file_type']}\n"
-    content += f"Date: {transcription['created_at']}\n\n"
-    content += f"Processed Transcription:\n\n"
-    content += transcription['processed_transcription']
-    
     # Write the text to a file
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+        for part in iter_plaintext(transcription):
+            f.write(part)
     
     return output_path
 
+def iter_plaintext(transcription: Dict[str, Any]) -> Iterator[str]:
+    """Yield the plaintext export in pieces, for streaming responses."""
+    yield (
+        f"Transcription: {transcription['original_filename']}\n"
+        f"Duration: {transcription['duration_seconds']:.2f} seconds\n"
+        f"File Type: {transcription['file_type']}\n"
+        f"Date: {transcription['created_at']}\n\n"
+        f"Processed Transcription:\n\n"
+    )
+    text = transcription['processed_transcription']
+    for start in range(0, len(text), 64 * 1024):
+        yield text[start:start + 64 * 1024]
+
 def export_to_word(transcription: Dict[str, Any], output_path: Optional[str] = None) -> str:
     """
     Export a transcription as a Microsoft Word document.
@@ -136,7 +187,7 @@ def export_to_word(transcription: Dict[str, Any], output_path: Optional[str] = N
     Args:
         transcription: Transcription dictionary from the database
         output_path: Path to save the Word file (optional)
-        
+    
     Returns:
         Path to the generated Word file
     """
@@ -146,8 +197,12 @@ def export_to_word(transcription: Dict[str, Any], output_path: Optional[str] = N
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"{filename}_{timestamp}.docx"
     
-    # Create a new Document
-    doc = Document()
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
+    # Create a new Document from the cached template
+    doc = Document(io.BytesIO(_docx_template()))
     
     # Add title
     title = doc.add_heading(f"Transcription: {transcription['original_filename']}", level=1)
@@ -177,13 +232,6 @@ def export_to_word(transcription: Dict[str, Any], output_path: Optional[str] = N
     cells[0].text = 'Date:'
     cells[1].text = str(transcription['created_at'])
     
-    # Format table
-    for row in table.rows:
-        for cell in row.cells:
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(10)
-                    
     # Add some space
     doc.add_paragraph()
     
@@ -191,15 +239,40 @@ def export_to_word(transcription: Dict[str, Any], output_path: Optional[str] = N
     doc.add_heading('Processed Transcription', level=2)
     
     # Split the transcription into paragraphs and add each as a separate paragraph
-    for paragraph_text in transcription['processed_transcription'].split('\n\n'):
-        if paragraph_text.strip():
-            p = doc.add_paragraph(paragraph_text)
-            # Set line spacing
-            p.paragraph_format.line_spacing = 1.15
-            # Add some space after each paragraph
-            p.paragraph_format.space_after = Pt(8)
+    for paragraph_text in transcript_paragraphs(transcription['processed_transcription']):
+        p = doc.add_paragraph(paragraph_text)
+        # Set line spacing
+        p.paragraph_format.line_spacing = 1.15
+        # Add some space after each paragraph
+        p.paragraph_format.space_after = Pt(8)
     
     # Save the document
     doc.save(output_path)
     
     return output_path
+
+RENDERERS = {
+    'pdf': generate_pdf,
+    'docx': export_to_word,
+    'text': export_plaintext,
+}
+
+def serve_render_requests(conn):
+    """
+    Render loop of an export worker process (see utils/export_engine.py).
+    
+    Receives (format, transcription, output_path) tuples and answers
+    ("ok", output_path) or ("error", message) until the pipe closes.
+    """
+    # Build the cached styles before the first request arrives
+    _pdf_styles()
+    _docx_template()
+    while True:
+        try:
+            format, transcription, output_path = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(("ok", RENDERERS[format](transcription, output_path)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
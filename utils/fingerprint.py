@@ -0,0 +1,265 @@
+"""
+Acoustic fingerprints for finding re-encoded copies of a recording.
+
+The same hearing often arrives twice, once as the court's WAV and once as a
+phone-converted M4A. The bytes differ completely, so the copies are matched
+by how they sound instead. The recording is decoded to 5512 Hz mono and cut
+into 0.37 s frames every 46 ms. Each frame becomes 32 bits, in the style of
+Haitsma and Kalker: every bit is the sign of the change, from the previous
+frame, in the energy difference between two neighbouring bands. There are 33
+log-spaced bands between 300 and 2000 Hz. Near-silent frames are stored as 0
+and ignored when comparing. An hour of audio gives a fingerprint of about
+300 KB.
+
+Re-encoding flips a small share of the bits; unrelated audio differs in about
+half of them. Two fingerprints are aligned by voting on the offsets of
+identical frames, which also handles copies that start a few seconds later.
+Their bit error rate is then measured where they overlap. Fingerprints are
+stored in the audio_fingerprints table, and lookups only compare recordings
+of similar duration, which that table indexes.
+"""
+import os
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import save_audio_fingerprint, get_fingerprints_by_duration, get_transcriptions_without_fingerprint
+from database import copy_original_audio
+
+# Initialize logger
+logger = get_app_logger()
+
+# Recordings this similar are the same: bit error rate over the overlap, and
+# the share of the shorter recording the overlap covers
+FINGERPRINT_MAX_BIT_ERROR_RATE = float(os.getenv("FINGERPRINT_MAX_BIT_ERROR_RATE", "0.35"))
+FINGERPRINT_MIN_COVERAGE = float(os.getenv("FINGERPRINT_MIN_COVERAGE", "0.8"))
+# Only recordings whose durations differ by at most this much (seconds, or
+# share of the duration if larger) are compared
+FINGERPRINT_DURATION_TOLERANCE_SECONDS = float(os.getenv("FINGERPRINT_DURATION_TOLERANCE_SECONDS", "15"))
+FINGERPRINT_DURATION_TOLERANCE_FRACTION = float(os.getenv("FINGERPRINT_DURATION_TOLERANCE_FRACTION", "0.02"))
+
+SAMPLE_RATE = 5512
+FRAME_LENGTH = 2048
+HOP_LENGTH = 256
+BANDS = 33
+MIN_FREQUENCY = 300.0
+MAX_FREQUENCY = 2000.0
+# Frames this far below the recording's median level count as silence
+SILENCE_DB = 30.0
+# Frames transformed at once
+BLOCK_FRAMES = 512
+# An alignment needs at least this many identical frames
+MIN_VOTES = 5
+
+def _band_matrix() -> np.ndarray:
+    """(FFT bins, BANDS) matrix summing the power spectrum into log-spaced bands."""
+    edges = np.geomspace(MIN_FREQUENCY, MAX_FREQUENCY, BANDS + 1)
+    frequencies = np.fft.rfftfreq(FRAME_LENGTH, 1 / SAMPLE_RATE)
+    band = np.searchsorted(edges, frequencies, side="right") - 1
+    matrix = np.zeros((len(frequencies), BANDS), dtype=np.float32)
+    inside = (band >= 0) & (band < BANDS)
+    matrix[np.flatnonzero(inside), band[inside]] = 1.0
+    return matrix
+
+_BAND_MATRIX = _band_matrix()
+_WINDOW = np.hanning(FRAME_LENGTH).astype(np.float32)
+
+def _decode_cmd(file_path: str) -> List[str]:
+    return [
+        "ffmpeg", "-v", "error",
+        "-i", file_path,
+        "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "-"
+    ]
+
+def _band_energies(samples: np.ndarray) -> np.ndarray:
+    """Band energies of every complete frame in samples, shape (frames, BANDS)."""
+    frames = (len(samples) - FRAME_LENGTH) // HOP_LENGTH + 1
+    if frames <= 0:
+        return np.empty((0, BANDS), dtype=np.float32)
+    windows = np.lib.stride_tricks.sliding_window_view(samples, FRAME_LENGTH)[::HOP_LENGTH][:frames]
+    spectrum = np.abs(np.fft.rfft(windows * _WINDOW, axis=1)) ** 2
+    return (spectrum.astype(np.float32) @ _BAND_MATRIX)
+
+def fingerprint_from_energies(energies: np.ndarray) -> np.ndarray:
+    """32-bit frame fingerprints from band energies; silent frames are 0."""
+    if len(energies) < 2:
+        return np.empty(0, dtype=np.uint32)
+    energies = energies.astype(np.float64) + 1e-9
+    differences = energies[:, :-1] - energies[:, 1:]
+    bits = (differences[1:] - differences[:-1]) > 0
+    fingerprint = np.packbits(bits, axis=1, bitorder="little").view("<u4")[:, 0].astype(np.uint32)
+    levels = 10 * np.log10(energies[1:].sum(axis=1))
+    fingerprint[levels < np.median(levels) - SILENCE_DB] = 0
+    return fingerprint
+
+def fingerprint_samples(samples: np.ndarray) -> np.ndarray:
+    """Fingerprint of mono PCM at SAMPLE_RATE (floats in [-1, 1] or int16)."""
+    samples = np.asarray(samples, dtype=np.float32)
+    energies = []
+    step = BLOCK_FRAMES * HOP_LENGTH
+    for start in range(0, max(1, len(samples) - FRAME_LENGTH + 1), step):
+        energies.append(_band_energies(samples[start:start + step + FRAME_LENGTH - HOP_LENGTH]))
+    return fingerprint_from_energies(np.concatenate(energies))
+
+def compute_fingerprint(file_path: str) -> np.ndarray:
+    """Fingerprint of a recording, decoded and transformed block by block by FFmpeg."""
+    block_bytes = BLOCK_FRAMES * HOP_LENGTH * 2
+    energies = []
+    tail = np.empty(0, dtype=np.float32)
+    odd_byte = b""
+    process = subprocess.Popen(_decode_cmd(file_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            data = odd_byte + data
+            usable = len(data) - len(data) % 2
+            odd_byte = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768
+            buffer = np.concatenate((tail, samples))
+            block = _band_energies(buffer)
+            energies.append(block)
+            # Keep the samples the next frame starts with
+            tail = buffer[len(block) * HOP_LENGTH:]
+        _, stderr = process.communicate()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    if process.returncode != 0:
+        raise ValueError(f"Error decoding audio for fingerprinting: {stderr.decode('utf-8', 'replace')}")
+    if not energies:
+        return np.empty(0, dtype=np.uint32)
+    return fingerprint_from_energies(np.concatenate(energies))
+
+def _align(query: np.ndarray, reference: np.ndarray) -> Optional[Tuple[int, int]]:
+    """Frame offset of query within reference with the most identical frames, and that count."""
+    order = np.argsort(reference, kind="stable")
+    ordered = reference[order]
+    positions = np.flatnonzero(query)
+    found = np.minimum(np.searchsorted(ordered, query[positions]), len(ordered) - 1)
+    same = ordered[found] == query[positions]
+    if not same.any():
+        return None
+    offsets, votes = np.unique(positions[same] - order[found[same]], return_counts=True)
+    best = int(np.argmax(votes))
+    return int(offsets[best]), int(votes[best])
+
+def compare(query: np.ndarray, reference: np.ndarray) -> Optional[Dict[str, Any]]:
+    """
+    Align two fingerprints and measure how much they differ.
+
+    Returns:
+        Where the query starts in the reference (seconds; negative if it
+        starts earlier), bit error rate and coverage of the overlap, or None
+        if they cannot be aligned
+    """
+    if len(query) == 0 or len(reference) == 0:
+        return None
+    alignment = _align(query, reference)
+    if alignment is None or alignment[1] < MIN_VOTES:
+        return None
+    offset, votes = alignment
+    # query[i] lines up with reference[i - offset]
+    start, end = max(0, offset), min(len(query), len(reference) + offset)
+    if end <= start:
+        return None
+    a, b = query[start:end], reference[start - offset:end - offset]
+    compared = (a != 0) & (b != 0)
+    if not compared.any():
+        return None
+    errors = np.unpackbits(np.bitwise_xor(a[compared], b[compared]).view(np.uint8)).mean()
+    # Silent frames are never compared, so they do not count against coverage
+    audible = min(np.count_nonzero(query), np.count_nonzero(reference))
+    return {
+        "offset_seconds": round(-offset * HOP_LENGTH / SAMPLE_RATE, 2),
+        "bit_error_rate": round(float(errors), 4),
+        "coverage": round(min(1.0, float(compared.sum()) / audible), 4),
+        "votes": votes,
+    }
+
+def is_match(comparison: Optional[Dict[str, Any]]) -> bool:
+    return (comparison is not None
+            and comparison["bit_error_rate"] <= FINGERPRINT_MAX_BIT_ERROR_RATE
+            and comparison["coverage"] >= FINGERPRINT_MIN_COVERAGE)
+
+def find_duplicate(fingerprint: np.ndarray, duration: float) -> Optional[Dict[str, Any]]:
+    """
+    Find the stored recording that the fingerprint matches best.
+
+    Returns:
+        The comparison with the earlier transcription_id added, or None
+    """
+    tolerance = max(FINGERPRINT_DURATION_TOLERANCE_SECONDS, duration * FINGERPRINT_DURATION_TOLERANCE_FRACTION)
+    best = None
+    for candidate in get_fingerprints_by_duration(duration - tolerance, duration + tolerance):
+        comparison = compare(fingerprint, np.frombuffer(candidate["fingerprint"], dtype="<u4"))
+        if is_match(comparison) and (best is None or comparison["bit_error_rate"] < best["bit_error_rate"]):
+            best = dict(comparison, transcription_id=candidate["transcription_id"])
+    return best
+
+def check_upload(file_path: str, duration: float) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+    """
+    Fingerprint an upload and look for an earlier transcription of the same recording.
+
+    A failure only costs duplicate detection, so it is logged, not raised.
+
+    Returns:
+        (fingerprint, duplicate match), either None if unavailable
+    """
+    try:
+        with metrics.time_stage("fingerprint"):
+            fingerprint = compute_fingerprint(file_path)
+            duplicate = find_duplicate(fingerprint, duration)
+    except Exception as e:
+        logger.error(f"Could not fingerprint {file_path}: {str(e)}")
+        return None, None
+    if duplicate is not None:
+        metrics.DUPLICATE_UPLOADS.labels("detected").inc()
+        logger.info(
+            f"Upload is a near-duplicate of transcription {duplicate['transcription_id']} "
+            f"({duplicate['bit_error_rate']:.0%} bits differ over {duplicate['coverage']:.0%} of the recording)"
+        )
+    return fingerprint, duplicate
+
+def store_fingerprint(transcription_id: int, duration: float, fingerprint: Optional[np.ndarray]):
+    """Save an upload's fingerprint once its transcription exists; failures are logged."""
+    if fingerprint is None:
+        return
+    try:
+        save_audio_fingerprint(transcription_id, duration, fingerprint.astype("<u4").tobytes())
+    except Exception as e:
+        logger.error(f"Could not store the fingerprint of transcription {transcription_id}: {str(e)}")
+
+def backfill() -> Dict[str, int]:
+    """Fingerprint the recordings of transcriptions saved before fingerprinting existed."""
+    report = {"fingerprinted": 0, "failed": 0, "missing_audio": 0}
+    for row in get_transcriptions_without_fingerprint():
+        path, temporary = row["audio_path"], False
+        if not path and row["has_audio"]:
+            fd, path = tempfile.mkstemp(suffix=".audio")
+            os.close(fd)
+            temporary = True
+        if not path or not os.path.exists(path):
+            report["missing_audio"] += 1
+            continue
+        try:
+            if temporary:
+                copy_original_audio(row["id"], path)
+            save_audio_fingerprint(row["id"], row["duration_seconds"] or 0.0,
+                                   compute_fingerprint(path).astype("<u4").tobytes())
+            report["fingerprinted"] += 1
+        except Exception as e:
+            logger.error(f"Could not fingerprint transcription {row['id']}: {str(e)}")
+            report["failed"] += 1
+        finally:
+            if temporary:
+                os.remove(path)
+    logger.info(f"Fingerprint backfill: {report}")
+    return report
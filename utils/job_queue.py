@@ -0,0 +1,488 @@
+"""
+Lease-based job distribution for running several app instances against
+shared storage.
+
+Producers enqueue jobs; workers claim one at a time with an expiring lease,
+heartbeat while they work and complete or fail the job with the lease token
+they were given. A job whose lease runs out (its worker crashed or hung) is
+put back in the queue, so it is processed by exactly one live worker at a
+time and never lost. Each claim issues a new token, so a stale worker can no
+longer complete, fail or heartbeat a job that has been handed to someone
+else.
+
+Queued jobs are not served in arrival order. Each claim takes the job with
+the lowest score, measured in seconds of audio:
+
+    cost + fair share weight * the user's recently started work
+         - priority level * JOB_PRIORITY_STEP_SECONDS
+         - JOB_AGING_RATE * seconds waited
+
+so short recordings overtake long ones, a user with a backlog does not crowd
+out everyone else, and every job's score falls the longer it waits. Jobs
+that have waited JOB_MAX_WAIT_SECONDS are served first, oldest first, which
+bounds how long any job can wait.
+
+The store is pluggable: JOB_STORE_URL selects a backend by URL scheme
+(sqlite:///path/to/jobs.db by default) and register_backend() adds others.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Any, Iterable
+
+from utils.logging_config import get_app_logger, correlation_scope
+from utils import metrics
+from database import DB_DIR, _ensure_column
+
+# Initialize logger
+logger = get_app_logger()
+
+# Store location; the default lives next to the main database so it is on the
+# same shared volume
+JOB_STORE_URL = os.getenv("JOB_STORE_URL", f"sqlite:///{os.path.join(DB_DIR, 'jobs.db')}")
+# How long a claimed job stays reserved without a heartbeat
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Attempts before a job whose worker keeps dying or failing is given up on
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Idle workers poll the store this often
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+# Scheduling; see the module docstring. One priority level is worth this many
+# seconds of audio
+JOB_PRIORITY_STEP_SECONDS = float(os.getenv("JOB_PRIORITY_STEP_SECONDS", "3600"))
+# Seconds of audio a job is credited for every second it waits
+JOB_AGING_RATE = float(os.getenv("JOB_AGING_RATE", "10"))
+# Jobs that have waited this long are served before all others
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "1800"))
+# A user's share is the audio of their jobs started within this window
+JOB_FAIR_SHARE_WINDOW = float(os.getenv("JOB_FAIR_SHARE_WINDOW", "3600"))
+JOB_FAIR_SHARE_WEIGHT = float(os.getenv("JOB_FAIR_SHARE_WEIGHT", "1"))
+
+# Priority levels accepted by enqueue()
+PRIORITIES = {"low": -1, "normal": 0, "high": 1}
+PRIORITY_NAMES = {level: name for name, level in PRIORITIES.items()}
+
+# Job states
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+class JobStore:
+    """
+    Interface of a job store backend.
+
+    Jobs are returned as dicts with id, kind, payload, status, attempts,
+    max_attempts, lease_token, worker_id, lease_expires_at, result, error,
+    priority, user_id, cost, queued_at, started_at, created_at and
+    updated_at.
+    """
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None,
+                priority: str = "normal", user_id: Optional[str] = None, cost: float = 0.0) -> int:
+        """
+        Add a job to the queue and return its ID.
+
+        Args:
+            kind: Handler the job is for
+            payload: JSON-serializable handler argument
+            max_attempts: Attempts before the job is failed
+            priority: One of PRIORITIES
+            user_id: User whose fair share the job counts against
+            cost: Size of the job in seconds of audio
+        """
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, kinds: Optional[Iterable[str]] = None,
+              lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        """
+        Lease the queued job with the lowest score (see the module docstring).
+
+        Returns:
+            The job including its lease_token, or None if the queue is empty
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: int, lease_token: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend a lease. Returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def complete(self, job_id: int, lease_token: str, result: Any = None) -> bool:
+        """Mark a leased job done. Returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def fail(self, job_id: int, lease_token: str, error: str, retry: bool = True) -> bool:
+        """
+        Give up a leased job. It is requeued if retry is set and it has
+        attempts left, and marked failed otherwise.
+
+        Returns:
+            False if the lease was lost
+        """
+        raise NotImplementedError
+
+    def defer(self, job_id: int, lease_token: str, error: str, delay_seconds: float) -> bool:
+        """
+        Put a leased job back in the queue, not to be claimed for delay_seconds.
+        The attempt is not counted.
+
+        Returns:
+            False if the lease was lost
+        """
+        raise NotImplementedError
+
+    def requeue_expired(self) -> int:
+        """Requeue (or fail, when out of attempts) jobs whose lease expired."""
+        raise NotImplementedError
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Return a job by ID."""
+        raise NotImplementedError
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each state."""
+        raise NotImplementedError
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store in a SQLite database.
+
+    Claims are a single UPDATE ... RETURNING, which SQLite runs under its
+    write lock, so concurrent workers in any number of processes (or
+    containers sharing the file over a local volume) never lease the same job.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                lease_token TEXT,
+                worker_id TEXT,
+                lease_expires_at REAL,
+                result TEXT,
+                error TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                user_id TEXT,
+                cost REAL NOT NULL DEFAULT 0,
+                queued_at REAL,
+                started_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            # Scheduling columns for stores created before them
+            cursor = conn.cursor()
+            _ensure_column(cursor, "jobs", "priority", "INTEGER NOT NULL DEFAULT 0")
+            _ensure_column(cursor, "jobs", "user_id", "TEXT")
+            _ensure_column(cursor, "jobs", "cost", "REAL NOT NULL DEFAULT 0")
+            _ensure_column(cursor, "jobs", "queued_at", "REAL")
+            _ensure_column(cursor, "jobs", "started_at", "REAL")
+            conn.execute("UPDATE jobs SET queued_at = created_at WHERE queued_at IS NULL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, kind, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (status, lease_expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, started_at)")
+
+    @classmethod
+    def from_url(cls, url: str) -> "SQLiteJobStore":
+        # sqlite:///relative/path or sqlite:////absolute/path
+        return cls(url[len("sqlite:///"):])
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: Optional[int] = None,
+                priority: str = "normal", user_id: Optional[str] = None, cost: float = 0.0) -> int:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown job priority: {priority}")
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, max_attempts, priority, user_id, cost, queued_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), max_attempts or JOB_MAX_ATTEMPTS, PRIORITIES[priority],
+                 user_id, max(0.0, cost), now, now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker_id: str, kinds: Optional[Iterable[str]] = None,
+              lease_seconds: float = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        self.requeue_expired()
+        now = time.time()
+        kinds = list(kinds or [])
+        params = {
+            "token": uuid.uuid4().hex, "worker_id": worker_id, "expires": now + lease_seconds, "now": now,
+            "overdue": now - JOB_MAX_WAIT_SECONDS, "window": now - JOB_FAIR_SHARE_WINDOW,
+            "share_weight": JOB_FAIR_SHARE_WEIGHT, "priority_step": JOB_PRIORITY_STEP_SECONDS,
+            "aging": JOB_AGING_RATE,
+        }
+        params.update({f"kind{i}": kind for i, kind in enumerate(kinds)})
+        kind_filter = f"AND q.kind IN ({','.join(f':kind{i}' for i in range(len(kinds)))})" if kinds else ""
+        with self._connect() as conn:
+            row = conn.execute(f'''
+            UPDATE jobs
+            SET status = 'leased', attempts = attempts + 1, lease_token = :token, worker_id = :worker_id,
+                lease_expires_at = :expires, started_at = :now, updated_at = :now
+            WHERE id = (
+                SELECT q.id FROM jobs q
+                WHERE q.status = 'queued' AND q.queued_at <= :now {kind_filter}
+                ORDER BY
+                    q.queued_at < :overdue DESC,
+                    CASE WHEN q.queued_at < :overdue THEN q.queued_at END,
+                    q.cost
+                        + :share_weight * (
+                            SELECT COALESCE(SUM(u.cost), 0) FROM jobs u
+                            WHERE u.user_id = q.user_id AND u.started_at > :window AND u.id != q.id
+                        )
+                        - :priority_step * q.priority
+                        - :aging * (:now - q.queued_at),
+                    q.id
+                LIMIT 1
+            )
+            RETURNING *
+            ''', params).fetchone()
+        job = self._row_to_job(row)
+        if job is not None:
+            metrics.JOB_WAIT_SECONDS.labels(
+                job["kind"], PRIORITY_NAMES.get(job["priority"], "normal"), job_size(job["cost"])
+            ).observe(now - job["queued_at"])
+        return job
+
+    def heartbeat(self, job_id: int, lease_token: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (now + lease_seconds, now, job_id, lease_token)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, lease_token: str, result: Any = None) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_expires_at = NULL, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (json.dumps(result), time.time(), job_id, lease_token)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, lease_token: str, error: str, retry: bool = True) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN ? AND attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                "error = ?, lease_token = NULL, lease_expires_at = NULL, queued_at = ?, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (retry, error, now, now, job_id, lease_token)
+            )
+            return cursor.rowcount == 1
+
+    def defer(self, job_id: int, lease_token: str, error: str, delay_seconds: float) -> bool:
+        now = time.time()
+        # A queued_at in the future keeps the job from being claimed until then
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, error = ?, "
+                "lease_token = NULL, lease_expires_at = NULL, queued_at = ?, updated_at = ? "
+                "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                (error, now + max(0.0, delay_seconds), now, job_id, lease_token)
+            )
+            return cursor.rowcount == 1
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                "error = 'Lease expired (worker ' || worker_id || ')', "
+                "lease_token = NULL, lease_expires_at = NULL, queued_at = ?, updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires_at < ?",
+                (now, now, now)
+            )
+            expired = cursor.rowcount
+        if expired:
+            logger.warning(f"Requeued {expired} job(s) with expired leases")
+            metrics.LEASES_EXPIRED.inc(expired)
+        return expired
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {state: 0 for state in (QUEUED, LEASED, DONE, FAILED)}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+def job_size(cost: float) -> str:
+    """Size class of a job for metrics labels."""
+    if cost <= 300:
+        return "short"
+    if cost <= 1800:
+        return "medium"
+    return "long"
+
+# URL scheme -> factory taking the full URL
+_backends: Dict[str, Callable[[str], JobStore]] = {
+    "sqlite": SQLiteJobStore.from_url,
+}
+_default_store: Optional[JobStore] = None
+_default_store_lock = threading.Lock()
+
+def register_backend(scheme: str, factory: Callable[[str], JobStore]):
+    """Make a job store backend available under a JOB_STORE_URL scheme."""
+    _backends[scheme] = factory
+
+def open_job_store(url: Optional[str] = None) -> JobStore:
+    """Open the job store at a URL (JOB_STORE_URL by default)."""
+    url = url or JOB_STORE_URL
+    scheme = url.split("://", 1)[0]
+    if scheme not in _backends:
+        raise ValueError(f"Unknown job store backend: {scheme}")
+    return _backends[scheme](url)
+
+def get_job_store() -> JobStore:
+    """Return the process-wide job store for JOB_STORE_URL."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = open_job_store()
+        return _default_store
+
+class NonRetryableError(Exception):
+    """Raised by a job handler for failures that retrying cannot fix."""
+
+class RetryLater(Exception):
+    """Raised by a job handler to put the job back until a later time, without using up an attempt."""
+
+    def __init__(self, message: str, delay_seconds: float):
+        super().__init__(message)
+        self.delay_seconds = delay_seconds
+
+class Worker:
+    """
+    Claims and runs jobs until stopped.
+
+    Args:
+        store: Job store to pull from
+        handlers: Job kind -> callable taking the payload; its return value
+            is stored as the job result
+        worker_id: Name recorded on leased jobs (defaults to host:pid:random)
+        lease_seconds: Lease length; heartbeats renew it every third of that
+        poll_interval: Sleep between claims while the queue is empty
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+        worker_id: Optional[str] = None,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        poll_interval: float = JOB_POLL_INTERVAL
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def _heartbeat_loop(self, job: Dict[str, Any], done: threading.Event):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.store.heartbeat(job["id"], job["lease_token"], self.lease_seconds):
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {job['id']}")
+                return
+
+    def run_once(self) -> bool:
+        """
+        Claim and run a single job.
+
+        Returns:
+            True if a job was run, False if the queue was empty
+        """
+        job = self.store.claim(self.worker_id, self.handlers.keys(), self.lease_seconds)
+        if job is None:
+            return False
+
+        with correlation_scope(f"job-{job['id']}"):
+            logger.info(f"Worker {self.worker_id} claimed {job['kind']} job {job['id']} (attempt {job['attempts']})")
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job, done), daemon=True)
+            heartbeat.start()
+            try:
+                result = self.handlers[job["kind"]](job["payload"])
+            except RetryLater as e:
+                logger.info(f"Job {job['id']} deferred for {e.delay_seconds:.0f}s: {str(e)}")
+                recorded = self.store.defer(job["id"], job["lease_token"], str(e), e.delay_seconds)
+                outcome = "deferred"
+            except Exception as e:
+                retry = not isinstance(e, NonRetryableError)
+                logger.error(f"Job {job['id']} failed: {str(e)}")
+                logger.error(traceback.format_exc())
+                recorded = self.store.fail(job["id"], job["lease_token"], str(e), retry=retry)
+                outcome = "failed"
+            else:
+                recorded = self.store.complete(job["id"], job["lease_token"], result)
+                outcome = "done"
+                logger.info(f"Job {job['id']} completed")
+            finally:
+                done.set()
+                heartbeat.join()
+
+            if not recorded:
+                # Another worker owns the job now; its outcome wins
+                logger.warning(f"Discarded outcome of job {job['id']}: lease no longer held")
+                outcome = "lease_lost"
+            metrics.JOB_OUTCOMES.labels(job["kind"], outcome).inc()
+        return True
+
+    def run(self):
+        """Run jobs until stop() is called."""
+        logger.info(f"Worker {self.worker_id} started for {', '.join(self.handlers)}")
+        while not self.stop_event.is_set():
+            try:
+                ran = self.run_once()
+            except sqlite3.Error as e:
+                logger.error(f"Job store error: {str(e)}")
+                ran = False
+            if not ran:
+                self.stop_event.wait(self.poll_interval)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self):
+        self.stop_event.set()
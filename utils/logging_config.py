@@ -1,26 +1,53 @@
 import os
-import logging
-from logging.handlers import RotatingFileHandler
 import sys
-from datetime import datetime
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import zlib
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from datetime import datetime, timezone
+from typing import Optional
 
 # Ensure logs directory exists
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
+# Output format: "text" (colored console, plain files) or "json" (one object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Hand records to a background thread so handlers never block the caller
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") == "1"
+# Fraction of requests/jobs whose DEBUG records are kept (0 disables DEBUG)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0"))
+# Set to 0 to keep transcript text out of the logs
+LOG_TRANSCRIPT_SNIPPETS = os.getenv("LOG_TRANSCRIPT_SNIPPETS", "1") == "1"
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+
+# Correlation ID of the request or job currently being handled
+_correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlation_id", default=None)
+
+# Standard LogRecord attributes, used to find user-supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
 # Create a custom formatter
 class CustomFormatter(logging.Formatter):
     """Custom formatter with colored output for console"""
-    
+
     grey = "\x1b[38;20m"
     green = "\x1b[32;20m"
     yellow = "\x1b[33;20m"
     red = "\x1b[31;20m"
     bold_red = "\x1b[31;1m"
     reset = "\x1b[0m"
-    
-    FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    
+
+    FORMAT = TEXT_FORMAT
+
     FORMATS = {
         logging.DEBUG: grey + FORMAT + reset,
         logging.INFO: green + FORMAT + reset,
@@ -28,44 +55,199 @@ class CustomFormatter(logging.Formatter):
         logging.ERROR: red + FORMAT + reset,
         logging.CRITICAL: bold_red + FORMAT + reset
     }
-    
+
+    def __init__(self):
+        super().__init__(self.FORMAT)
+        # Build one formatter per level up front instead of one per record
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self._formatters.get(record.levelno, self._formatters[logging.INFO])
         return formatter.format(record)
 
+class JsonFormatter(logging.Formatter):
+    """Formatter emitting one JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": _correlation_id_or_none(record),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RecordQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting, tracebacks included, to the listener's handlers"""
+
+    def prepare(self, record):
+        # The stock prepare() formats the record and drops exc_info, so the
+        # JSON formatter could no longer put the traceback in its own field.
+        # Only the message is resolved here, while its arguments are current.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+def _correlation_id_or_none(record):
+    correlation_id = getattr(record, "correlation_id", None)
+    return None if correlation_id == "-" else correlation_id
+
+class CorrelationFilter(logging.Filter):
+    """Attach the current correlation ID and apply DEBUG sampling"""
+
+    def filter(self, record):
+        correlation_id = _correlation_id.get()
+        record.correlation_id = correlation_id or "-"
+        if record.levelno <= logging.DEBUG:
+            return _debug_sampled(correlation_id)
+        return True
+
+def _debug_sampled(correlation_id: Optional[str]) -> bool:
+    """Decide whether DEBUG records are kept, consistently per correlation ID."""
+    if LOG_DEBUG_SAMPLE_RATE <= 0:
+        return False
+    if LOG_DEBUG_SAMPLE_RATE >= 1:
+        return True
+    if correlation_id is None:
+        return random.random() < LOG_DEBUG_SAMPLE_RATE
+    return (zlib.crc32(correlation_id.encode()) % 10000) < LOG_DEBUG_SAMPLE_RATE * 10000
+
+def get_correlation_id() -> Optional[str]:
+    """Return the correlation ID of the current request or job, if any"""
+    return _correlation_id.get()
+
+def set_correlation_id(correlation_id: Optional[str]) -> contextvars.Token:
+    """Set the correlation ID for the current context and return a reset token"""
+    return _correlation_id.set(correlation_id)
+
+def reset_correlation_id(token: contextvars.Token):
+    """Restore the correlation ID that was active before set_correlation_id"""
+    _correlation_id.reset(token)
+
+@contextmanager
+def correlation_scope(correlation_id: str):
+    """Attach a correlation ID to every record logged inside the block"""
+    token = _correlation_id.set(correlation_id)
+    try:
+        yield correlation_id
+    finally:
+        _correlation_id.reset(token)
+
+def snippet(text: str, length: int = 100) -> str:
+    """Return a loggable snippet of transcript text, or a placeholder when disabled"""
+    if not LOG_TRANSCRIPT_SNIPPETS:
+        return f"<{len(text)} characters redacted>"
+    return f"{text[:length]}..."
+
+# Background listeners, one per queued logger
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+def _stop_listeners():
+    with _listeners_lock:
+        for listener in _listeners.values():
+            listener.stop()
+        _listeners.clear()
+
+def _stop_listeners_before_fork():
+    # Drain the queues first, so pending records are written once, not by
+    # both processes
+    for listener in _listeners.values():
+        listener.stop()
+
+def _restart_listeners():
+    # Listener threads do not survive fork (e.g. gunicorn --preload); both
+    # processes get new listeners on the same queues and handlers
+    for name, listener in list(_listeners.items()):
+        replacement = QueueListener(listener.queue, *listener.handlers,
+                                    respect_handler_level=listener.respect_handler_level)
+        replacement.start()
+        _listeners[name] = replacement
+
+atexit.register(_stop_listeners)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_stop_listeners_before_fork, after_in_parent=_restart_listeners,
+                        after_in_child=_restart_listeners)
+
+def _is_configured(logger, name):
+    if LOG_QUEUE:
+        with _listeners_lock:
+            listener = _listeners.get(name)
+        return listener is not None and any(isinstance(h, RecordQueueHandler) for h in logger.handlers)
+    return bool(logger.handlers)
+
 def setup_logger(name, log_file=None, level=logging.INFO):
     """Set up logger with file and console handlers"""
-    
+
     logger = logging.getLogger(name)
-    logger.setLevel(level)
+    # Every module calls get_app_logger() at import; set up once per process
+    # instead of opening another log file and listener each time
+    if _is_configured(logger, name):
+        return logger
     logger.propagate = False  # Prevent duplicate logs
-    
+
+    # DEBUG records are only emitted for sampled requests/jobs
+    if LOG_DEBUG_SAMPLE_RATE > 0:
+        level = min(level, logging.DEBUG)
+    logger.setLevel(level)
+
     # Clear existing handlers to avoid duplicates
     if logger.handlers:
         logger.handlers = []
-    
+    with _listeners_lock:
+        listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    handlers = []
+
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
-    console_handler.setFormatter(CustomFormatter())
-    logger.addHandler(console_handler)
-    
+    console_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else CustomFormatter())
+    handlers.append(console_handler)
+
     # Create file handler if a log file is specified
     if log_file:
         if not log_file.startswith('logs/'):
             log_file = f"logs/{log_file}"
-        
+
         # Create rotating file handler (10MB max, keep 5 backups)
         file_handler = RotatingFileHandler(
-            log_file, 
+            log_file,
             maxBytes=10*1024*1024,  # 10MB
             backupCount=5
         )
         file_handler.setLevel(level)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logger.addHandler(file_handler)
-    
+        file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+        handlers.append(file_handler)
+
+    if LOG_QUEUE:
+        # The correlation filter must run on the calling thread, before the
+        # record is handed to the listener thread
+        log_queue = queue.SimpleQueue()
+        queue_handler = RecordQueueHandler(log_queue)
+        queue_handler.addFilter(CorrelationFilter())
+        logger.addHandler(queue_handler)
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        with _listeners_lock:
+            _listeners[name] = listener
+    else:
+        for handler in handlers:
+            handler.addFilter(CorrelationFilter())
+            logger.addHandler(handler)
+
     return logger
 
 # Create main application logger
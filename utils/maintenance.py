@@ -0,0 +1,321 @@
+"""
+Background storage maintenance for the transcriptions database.
+
+Uploads are stored in transcriptions.original_audio as received, often as
+large WAV or FLAC files, and SQLite never gives the space of deleted rows
+back to the filesystem on its own. Maintenance does two things, in small
+steps so that it never holds the database for long, and then drops expired
+entries from the post-processing response cache:
+
+- Recordings older than ARCHIVE_AFTER_DAYS are re-encoded to low-bitrate
+  Opus and moved to COLD_STORAGE_DIR. The row keeps the file's path and
+  its BLOB is cleared.
+- Free pages are returned to the filesystem with PRAGMA incremental_vacuum,
+  a few hundred pages per transaction with a pause in between. This needs
+  auto_vacuum=INCREMENTAL, which new databases get from init_db. Existing
+  databases are converted once, offline, with `python maintenance.py
+  --enable-incremental-vacuum`.
+
+Every run returns a report of the space reclaimed, which is also logged and
+exported as metrics. With several gunicorn workers, a lock file makes sure
+only one of them runs maintenance at a time.
+"""
+import os
+import time
+import fcntl
+import sqlite3
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import DATABASE_FILE, DB_DIR, copy_original_audio
+
+# Initialize logger
+logger = get_app_logger()
+
+# Run maintenance in a background thread of the app (one process at a time)
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "0") == "1"
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# Wall time one run may spend on each of archiving and vacuuming
+MAINTENANCE_TIME_BUDGET_SECONDS = float(os.getenv("MAINTENANCE_TIME_BUDGET_SECONDS", "60"))
+
+# Recordings older than this are moved to cold storage; 0 disables archiving
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+COLD_STORAGE_DIR = os.getenv("COLD_STORAGE_DIR", os.path.join(os.getcwd(), "cold_storage"))
+# Opus bitrate for archived speech; 24k keeps voices clearly intelligible
+ARCHIVE_BITRATE = os.getenv("ARCHIVE_BITRATE", "24k")
+ARCHIVE_FORMAT = "opus"
+
+# Pages freed per incremental_vacuum transaction, and the pause between them
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "256"))
+VACUUM_STEP_PAUSE_SECONDS = float(os.getenv("VACUUM_STEP_PAUSE_SECONDS", "0.05"))
+
+LOCK_FILE = os.path.join(DB_DIR, "maintenance.lock")
+# PRAGMA auto_vacuum values
+AUTO_VACUUM_INCREMENTAL = 2
+
+def _connect() -> sqlite3.Connection:
+    # Autocommit, so every statement is its own short transaction
+    conn = sqlite3.connect(DATABASE_FILE, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _database_bytes(conn: sqlite3.Connection) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+
+@contextmanager
+def maintenance_lock():
+    """
+    Hold the maintenance lock for the duration of the block.
+
+    Yields:
+        True if this process holds the lock, False if another one does
+    """
+    os.makedirs(DB_DIR, exist_ok=True)
+    with open(LOCK_FILE, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _encode_opus(input_path: str, output_path: str):
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-i", input_path,
+        "-vn", "-ac", "1",
+        "-c:a", "libopus", "-b:a", ARCHIVE_BITRATE, "-application", "voip",
+        "-f", "ogg", output_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise ValueError(f"Error re-encoding audio: {result.stderr.decode('utf-8', 'replace')}")
+
+def cold_storage_path(transcription_id: int, created_at: str, extension: str) -> str:
+    """Location of an archived recording, grouped by the month it was uploaded."""
+    return os.path.join(COLD_STORAGE_DIR, created_at[:7], f"{transcription_id}.{extension}")
+
+def archive_recording(conn: sqlite3.Connection, row: sqlite3.Row) -> Optional[Dict[str, Any]]:
+    """
+    Move one recording to cold storage.
+
+    The Opus file is kept only if it is smaller than the upload; otherwise
+    the upload is moved as it is.
+
+    Returns:
+        Sizes before and after, or None if the row was deleted meanwhile
+    """
+    transcription_id = row["id"]
+    os.makedirs(COLD_STORAGE_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=COLD_STORAGE_DIR, prefix=".archive_")
+    try:
+        original_path = os.path.join(work_dir, f"original.{row['file_type']}")
+        original_bytes = copy_original_audio(transcription_id, original_path, conn)
+        encoded_path = os.path.join(work_dir, f"encoded.{ARCHIVE_FORMAT}")
+        _encode_opus(original_path, encoded_path)
+        if os.path.getsize(encoded_path) < original_bytes:
+            source, audio_format = encoded_path, ARCHIVE_FORMAT
+        else:
+            source, audio_format = original_path, row["file_type"]
+
+        path = cold_storage_path(transcription_id, row["created_at"], audio_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+        archived_bytes = os.path.getsize(path)
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+
+    # The file is in place before the row points at it, so a crash in
+    # between leaves at worst a stray file that the next run overwrites
+    cursor = conn.execute(
+        "UPDATE transcriptions SET original_audio = NULL, audio_path = ?, audio_format = ?, "
+        "archived_at = CURRENT_TIMESTAMP WHERE id = ? AND audio_path IS NULL",
+        (path, audio_format, transcription_id)
+    )
+    if cursor.rowcount == 0:
+        os.remove(path)
+        return None
+    return {"original_bytes": original_bytes, "archived_bytes": archived_bytes}
+
+def archive_old_recordings(days: int = ARCHIVE_AFTER_DAYS,
+                           time_budget: float = MAINTENANCE_TIME_BUDGET_SECONDS) -> Dict[str, Any]:
+    """
+    Move recordings older than a number of days to cold storage, oldest
+    first, until none are left or the time budget is spent.
+    """
+    report = {"archived": 0, "failed": 0, "original_bytes": 0, "archived_bytes": 0}
+    if days <= 0:
+        return report
+    deadline = time.monotonic() + time_budget
+    failed_ids: List[int] = []
+    conn = _connect()
+    try:
+        while time.monotonic() < deadline:
+            exclude = f"AND id NOT IN ({','.join('?' * len(failed_ids))})" if failed_ids else ""
+            row = conn.execute(f'''
+            SELECT id, file_type, created_at FROM transcriptions
+            WHERE original_audio IS NOT NULL AND audio_path IS NULL
+              AND created_at < datetime('now', ?) {exclude}
+            ORDER BY id LIMIT 1
+            ''', (f"-{days} days", *failed_ids)).fetchone()
+            if row is None:
+                break
+            try:
+                result = archive_recording(conn, row)
+            except Exception as e:
+                # Leave the recording in place and carry on with the next one
+                logger.error(f"Could not archive recording of transcription {row['id']}: {str(e)}")
+                failed_ids.append(row["id"])
+                report["failed"] += 1
+                continue
+            if result is None:
+                continue
+            report["archived"] += 1
+            report["original_bytes"] += result["original_bytes"]
+            report["archived_bytes"] += result["archived_bytes"]
+            metrics.RECORDINGS_ARCHIVED.inc()
+            logger.info(
+                f"Archived recording of transcription {row['id']}: "
+                f"{result['original_bytes'] / 1024:.0f} KB -> {result['archived_bytes'] / 1024:.0f} KB"
+            )
+    finally:
+        conn.close()
+    return report
+
+def incremental_vacuum(step_pages: int = VACUUM_STEP_PAGES, pause: float = VACUUM_STEP_PAUSE_SECONDS,
+                       time_budget: float = MAINTENANCE_TIME_BUDGET_SECONDS) -> Dict[str, Any]:
+    """
+    Return free pages to the filesystem in small transactions.
+
+    Other connections can read and write between steps, so this never
+    blocks requests for longer than one step.
+    """
+    conn = _connect()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        bytes_before = _database_bytes(conn)
+        report = {
+            "free_bytes_before": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+            "reclaimed_bytes": 0,
+            "steps": 0,
+            "incremental": conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL,
+        }
+        if not report["incremental"]:
+            # Free pages are still reused by new rows, but the file cannot shrink
+            return report
+
+        deadline = time.monotonic() + time_budget
+        while time.monotonic() < deadline and conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            # execute() steps the pragma only once, which frees a single page;
+            # executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)});")
+            report["steps"] += 1
+            time.sleep(pause)
+
+        report["reclaimed_bytes"] = max(0, bytes_before - _database_bytes(conn))
+        return report
+    finally:
+        conn.close()
+
+def enable_incremental_vacuum() -> Dict[str, Any]:
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL.
+
+    This rewrites the whole file with VACUUM and blocks all other access
+    while it runs; use it with the app stopped.
+    """
+    conn = _connect()
+    try:
+        bytes_before = _database_bytes(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            logger.info("Converting database to incremental auto-vacuum")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        return {"reclaimed_bytes": max(0, bytes_before - _database_bytes(conn))}
+    finally:
+        conn.close()
+
+def purge_response_cache() -> int:
+    """Delete expired post-processing responses; returns how many."""
+    from utils.response_cache import get_response_cache
+
+    try:
+        cache = get_response_cache()
+        return cache.purge_expired() if cache is not None else 0
+    except Exception as e:
+        logger.error(f"Could not purge the response cache: {str(e)}")
+        return 0
+
+def run_maintenance() -> Optional[Dict[str, Any]]:
+    """
+    Archive old recordings, vacuum, then purge expired cached responses.
+
+    Returns:
+        Report of the run, or None if another process is running maintenance
+    """
+    with maintenance_lock() as acquired:
+        if not acquired:
+            logger.debug("Maintenance is running in another process")
+            return None
+
+        started = time.monotonic()
+        archive = archive_old_recordings(ARCHIVE_AFTER_DAYS)
+        vacuum = incremental_vacuum()
+        conn = _connect()
+        try:
+            database_bytes = _database_bytes(conn)
+        finally:
+            conn.close()
+        expired_responses = purge_response_cache()
+
+    reencode_saved = archive["original_bytes"] - archive["archived_bytes"]
+    metrics.MAINTENANCE_RECLAIMED_BYTES.labels("reencode").inc(max(0, reencode_saved))
+    metrics.MAINTENANCE_RECLAIMED_BYTES.labels("vacuum").inc(vacuum["reclaimed_bytes"])
+    report = {
+        "archive": archive,
+        "vacuum": vacuum,
+        "database_bytes": database_bytes,
+        "expired_responses": expired_responses,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    logger.info(
+        f"Maintenance: archived {archive['archived']} recording(s) saving {reencode_saved / (1024 * 1024):.1f} MB, "
+        f"vacuum reclaimed {vacuum['reclaimed_bytes'] / (1024 * 1024):.1f} MB; "
+        f"database is {database_bytes / (1024 * 1024):.1f} MB; "
+        f"{expired_responses} expired cached response(s) purged"
+    )
+    if not vacuum["incremental"] and vacuum["free_bytes_before"]:
+        logger.warning(
+            f"{vacuum['free_bytes_before'] / (1024 * 1024):.1f} MB of the database is free but cannot be "
+            "returned to the filesystem; run `python maintenance.py --enable-incremental-vacuum` once"
+        )
+    return report
+
+def _maintenance_loop():
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            run_maintenance()
+        except Exception as e:
+            logger.error(f"Maintenance run failed: {str(e)}")
+
+_maintenance_thread: Optional[threading.Thread] = None
+
+def start_background_maintenance():
+    """Start the periodic maintenance thread for this worker if MAINTENANCE_ENABLED is set."""
+    global _maintenance_thread
+    if not MAINTENANCE_ENABLED or (_maintenance_thread is not None and _maintenance_thread.is_alive()):
+        return
+    _maintenance_thread = threading.Thread(target=_maintenance_loop, name="maintenance", daemon=True)
+    _maintenance_thread.start()
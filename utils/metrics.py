@@ -0,0 +1,494 @@
+import os
+import json
+import time
+import glob
+import fcntl
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Tuple
+
+# Prometheus text exposition format content type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets in seconds, tuned for pipeline stages that range
+# from sub-second ffprobe calls to multi-minute Whisper/GPT-4o requests
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# When set, each gunicorn worker periodically writes a snapshot of its metrics
+# here and /metrics merges the snapshots of all live workers
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Counters and histograms of exited workers are folded into this snapshot so
+# that totals never go down when gunicorn recycles a worker
+RETIRED_SNAPSHOT = "metrics_retired.json"
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """Base class for metrics. Label children are created once and cached."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        with _registry_lock:
+            _registry.append(self)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *labelvalues):
+        """Return the child for the given label values, creating it on first use."""
+        key = tuple(str(v) for v in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serialisable copy of the current values."""
+        with self._lock:
+            items = list(self._children.items())
+        return {
+            "type": self.type_name,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": [[list(key), child.snapshot()] for key, child in items],
+        }
+
+class _ValueChild:
+    __slots__ = ("_lock", "_value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def snapshot(self) -> float:
+        return self._value
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+class Gauge(_Metric):
+    """Value that can go up and down, e.g. queue depth."""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    @contextmanager
+    def track_inprogress(self):
+        """Increment the gauge for the duration of the block."""
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_buckets", "_counts", "_sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        # One slot per bucket plus the implicit +Inf bucket; counts are
+        # stored non-cumulatively and accumulated at render time
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the wall-clock duration of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"counts": list(self._counts), "sum": self._sum}
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values, e.g. stage latencies."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+# Pipeline metrics
+
+STAGE_DURATION = Histogram(
+    "transcribe_stage_duration_seconds",
+    "Duration of transcription pipeline stages",
+    ("stage",),
+)
+UPLOAD_BYTES = Counter(
+    "transcribe_upload_bytes_total",
+    "Bytes of audio received through uploads",
+)
+AUDIO_SECONDS = Counter(
+    "transcribe_audio_seconds_total",
+    "Seconds of audio processed by the pipeline",
+)
+OPENAI_TOKENS = Counter(
+    "transcribe_openai_tokens_total",
+    "Tokens consumed by OpenAI chat completions and embeddings",
+    ("model", "type"),
+)
+OPENAI_ERRORS = Counter(
+    "transcribe_openai_errors_total",
+    "Failed OpenAI API requests",
+    ("endpoint",),
+)
+QUEUE_DEPTH = Gauge(
+    "transcribe_queue_depth",
+    "Transcription jobs accepted but not yet finished",
+)
+INFLIGHT_CHUNKS = Gauge(
+    "transcribe_inflight_chunks",
+    "Audio chunks currently being transcribed by Whisper",
+)
+VAD_REMOVED_SECONDS = Counter(
+    "transcribe_vad_removed_seconds_total",
+    "Seconds of silence removed before transcription",
+)
+EXPORT_TIMEOUTS = Counter(
+    "transcribe_export_timeouts_total",
+    "Exports abandoned because rendering exceeded its deadline",
+    ("format",),
+)
+RECORDINGS_ARCHIVED = Counter(
+    "transcribe_recordings_archived_total",
+    "Recordings moved to cold storage by maintenance",
+)
+MAINTENANCE_RECLAIMED_BYTES = Counter(
+    "transcribe_maintenance_reclaimed_bytes_total",
+    "Storage reclaimed by maintenance",
+    ("step",),
+)
+BACKUPS = Counter(
+    "transcribe_backups_total",
+    "Database snapshots taken",
+    ("outcome",),
+)
+BACKUP_RESTARTS = Counter(
+    "transcribe_backup_restarts_total",
+    "Online backup copies restarted because the database changed underneath them",
+)
+SEMANTIC_SLICES_INDEXED = Counter(
+    "transcribe_semantic_slices_indexed_total",
+    "Transcript slices added to the semantic search index",
+)
+LIVE_WINDOWS_DROPPED = Counter(
+    "transcribe_live_windows_dropped_total",
+    "Live transcription windows dropped because Whisper fell behind",
+)
+ADMISSION_DECISIONS = Counter(
+    "transcribe_admission_decisions_total",
+    "Uploads and jobs admitted at once, admitted after waiting for memory or disk, or rejected",
+    ("outcome",),
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "transcribe_admission_wait_seconds",
+    "Time admitted jobs waited for memory or disk",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0),
+)
+DUPLICATE_UPLOADS = Counter(
+    "transcribe_duplicate_uploads_total",
+    "Uploads recognised as re-encoded copies of an earlier recording, and those whose transcription was reused",
+    ("action",),
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "transcribe_response_cache_lookups_total",
+    "Post-processing response cache lookups",
+    ("result",),
+)
+RESPONSE_CACHE_SAVED_TOKENS = Counter(
+    "transcribe_response_cache_saved_tokens_total",
+    "OpenAI tokens not spent because a cached response was served",
+    ("model", "type"),
+)
+RESPONSE_CACHE_EVICTIONS = Counter(
+    "transcribe_response_cache_evictions_total",
+    "Entries removed from the response cache",
+    ("reason",),
+)
+JOB_OUTCOMES = Counter(
+    "transcribe_jobs_total",
+    "Leased jobs finished by queue workers",
+    ("kind", "outcome"),
+)
+JOB_WAIT_SECONDS = Histogram(
+    "transcribe_job_wait_seconds",
+    "Time queued jobs waited before a worker claimed them",
+    ("kind", "priority", "size"),
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0),
+)
+LEASES_EXPIRED = Counter(
+    "transcribe_job_leases_expired_total",
+    "Job leases that expired and were requeued or failed",
+)
+
+def time_stage(stage: str):
+    """
+    Context manager that records the duration of a pipeline stage.
+
+    Args:
+        stage: Stage name (probe, vad, tempo, split, whisper_chunk, post_process, db_save,
+            embedding, semantic_search, export_render, fingerprint)
+    """
+    return STAGE_DURATION.labels(stage).time()
+
+def collect() -> Dict[str, Dict[str, Any]]:
+    """Return a snapshot of every registered metric keyed by name."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+def _merge(target: Dict[str, Dict[str, Any]], source: Dict[str, Dict[str, Any]]):
+    """Merge one snapshot into another by summing samples with equal labels."""
+    for name, data in source.items():
+        existing = target.get(name)
+        if existing is None:
+            target[name] = json.loads(json.dumps(data))
+            continue
+        samples = {tuple(labels): value for labels, value in existing["samples"]}
+        for labels, value in data["samples"]:
+            key = tuple(labels)
+            current = samples.get(key)
+            if current is None:
+                samples[key] = value
+            elif data["type"] == "histogram":
+                samples[key] = {
+                    "counts": [a + b for a, b in zip(current["counts"], value["counts"])],
+                    "sum": current["sum"] + value["sum"],
+                }
+            else:
+                samples[key] = current + value
+        existing["samples"] = [[list(key), value] for key, value in samples.items()]
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+@contextmanager
+def _retired_lock():
+    with open(os.path.join(METRICS_DIR, "metrics_retired.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _load_snapshot(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _retire(path: str):
+    """
+    Fold the snapshot of an exited worker into the retired snapshot and remove it.
+
+    Gauges describe the state of a live process (queue depth, in-flight chunks)
+    and are dropped; counters and histograms are kept, as in prometheus_client's
+    multiprocess mode.
+    """
+    retired_path = os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)
+    with _retired_lock():
+        # Another worker may have retired it while we waited for the lock
+        if not os.path.exists(path):
+            return
+        try:
+            snapshot = _load_snapshot(path)
+        except ValueError:
+            snapshot = {}
+        retired = _load_snapshot(retired_path)
+        _merge(retired, {name: data for name, data in snapshot.items() if data["type"] != "gauge"})
+        tmp_path = f"{retired_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(retired, f)
+        os.replace(tmp_path, retired_path)
+        os.remove(path)
+
+def collect_all_workers() -> Dict[str, Dict[str, Any]]:
+    """
+    Collect metrics from this process and, if METRICS_DIR is set, from the
+    snapshots written by the other live worker processes and the retired
+    snapshot of workers that have exited.
+
+    Returns:
+        Merged metric snapshot
+    """
+    merged = collect()
+    if not METRICS_DIR:
+        return merged
+
+    own_pid = os.getpid()
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics_*.json")):
+        try:
+            pid = int(os.path.basename(path)[len("metrics_"):-len(".json")])
+        except ValueError:
+            continue
+        if pid == own_pid:
+            continue
+        if not _pid_alive(pid):
+            try:
+                _retire(path)
+            except (OSError, ValueError):
+                # Leave the snapshot in place and retry on the next scrape
+                pass
+            continue
+        try:
+            _merge(merged, _load_snapshot(path))
+        except (OSError, ValueError):
+            # Snapshot is being rewritten or is corrupt; skip it this scrape
+            continue
+    try:
+        _merge(merged, _load_snapshot(os.path.join(METRICS_DIR, RETIRED_SNAPSHOT)))
+    except (OSError, ValueError):
+        pass
+    return merged
+
+def render(snapshot: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+    """
+    Render metrics in the Prometheus text exposition format.
+
+    Args:
+        snapshot: Snapshot to render (defaults to all workers)
+
+    Returns:
+        Exposition text
+    """
+    if snapshot is None:
+        snapshot = collect_all_workers()
+
+    lines = []
+    for name, data in sorted(snapshot.items()):
+        labelnames = data["labelnames"]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for labelvalues, value in sorted(data["samples"], key=lambda s: s[0]):
+            if data["type"] == "histogram":
+                cumulative = 0
+                bounds = list(data["buckets"]) + [float("inf")]
+                for bound, count in zip(bounds, value["counts"]):
+                    cumulative += count
+                    labels = _format_labels(labelnames, labelvalues, ("le", _format_value(bound)))
+                    lines.append(f"{name}_bucket{labels} {cumulative}")
+                labels = _format_labels(labelnames, labelvalues)
+                lines.append(f"{name}_sum{labels} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{labels} {cumulative}")
+            else:
+                labels = _format_labels(labelnames, labelvalues)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def _flush_loop():
+    path = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(collect(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+_flush_thread: Optional[threading.Thread] = None
+
+def start_worker_flush():
+    """Start the background snapshot writer for this worker if METRICS_DIR is set."""
+    global _flush_thread
+    if not METRICS_DIR or (_flush_thread is not None and _flush_thread.is_alive()):
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _flush_thread = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+    _flush_thread.start()
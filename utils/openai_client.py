@@ -1,13 +1,18 @@
 import os
+import re
 import time
+import asyncio
+import hashlib
 import tempfile
+import threading
 import traceback
 from typing import List, Dict, Any, Optional
 
-import openai
 from dotenv import load_dotenv
 
-from utils.logging_config import get_api_logger
+from utils.logging_config import get_api_logger, snippet
+from utils import metrics
+from utils.accounting import record_usage
 
 # Initialize logger
 logger = get_api_logger()
@@ -17,64 +22,325 @@ logger.info("Loading environment variables")
 load_dotenv()
 logger.info("Environment variables loaded")
 
-# Initialize OpenAI client
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    logger.error("OPENAI_API_KEY not found in environment variables")
-    raise ValueError("OPENAI_API_KEY is required but not found in environment variables")
+# OpenAI clients are created on first use: importing the SDK takes most of a
+# second, and code paths that never call the API (health checks, exports,
+# workers for other job kinds) should not need it or the API key
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
 
-logger.info("Initializing OpenAI client")
-client = openai.OpenAI(api_key=api_key)
-logger.info("OpenAI client initialized")
+def _get_client(kind: str):
+    with _clients_lock:
+        if kind not in _clients:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                logger.error("OPENAI_API_KEY not found in environment variables")
+                raise ValueError("OPENAI_API_KEY is required but not found in environment variables")
+            
+            import openai
+            logger.info(f"Initializing OpenAI {kind} client")
+            _clients[kind] = openai.AsyncOpenAI(api_key=api_key) if kind == "async" else openai.OpenAI(api_key=api_key)
+        return _clients[kind]
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    return _get_client("sync")
+
+def get_async_client():
+    """Return the shared async OpenAI client used by the ASGI serving mode."""
+    return _get_client("async")
 
 # Maximum file size for Whisper API in bytes (25MB)
 MAX_FILE_SIZE = 25 * 1024 * 1024
 
-def transcribe_audio(audio_file_path: str) -> str:
+POST_PROCESS_MODEL = "gpt-4o"
+POST_PROCESS_TEMPERATURE = 0.3
+
+# Transcripts longer than this are post-processed (and cached) in segments of
+# one to two times this many words, so an edited transcript only resends what
+# changed. Each segment is processed without the others, which suits cleanup
+# instructions but not summaries; 0 (the default) sends every transcript whole
+POST_PROCESS_SEGMENT_WORDS = int(os.getenv("POST_PROCESS_SEGMENT_WORDS", "0"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+class TranscriptSegmenter:
+    """
+    Splits a transcription that arrives in parts (Whisper chunks, joined by
+    spaces) into post-processing segments as soon as they are complete.
+    
+    A segment ends at a sentence whose hash picks it as a boundary once the
+    segment has the target words, or at twice the target regardless.
+    Boundaries depend only on nearby text, so an edit in one place leaves
+    the segments elsewhere, and their cache keys, unchanged. A transcription
+    of at most the target words is a single segment, so segments are only
+    handed out once the text has grown past the target.
+    """
+    
+    def __init__(self, target_words: Optional[int] = None):
+        self.target_words = POST_PROCESS_SEGMENT_WORDS if target_words is None else target_words
+        self._parts: Optional[List[str]] = []
+        self._words = 0
+        # Text after the last sentence end; the sentence may go on in the next part
+        self._pending = ""
+        self._current: List[str] = []
+        self._current_words = 0
+        self._ready: List[str] = []
+    
+    @property
+    def _long(self) -> bool:
+        return self.target_words > 0 and self._words > self.target_words
+    
+    def _add_sentence(self, sentence: str):
+        self._current.append(sentence)
+        self._current_words += len(sentence.split())
+        boundary = hashlib.blake2b(sentence.encode("utf-8"), digest_size=2).digest()[0] % 16 == 0
+        if self._current_words >= 2 * self.target_words or (self._current_words >= self.target_words and boundary):
+            self._ready.append(" ".join(self._current))
+            self._current, self._current_words = [], 0
+    
+    def _take_ready(self) -> List[str]:
+        if not self._long:
+            return []
+        ready, self._ready = self._ready, []
+        return ready
+    
+    def feed(self, text: str) -> List[str]:
+        """Add the next part; returns the segments it completed."""
+        if self._parts is not None:
+            self._parts.append(text)
+        self._words += len(text.split())
+        if self.target_words <= 0:
+            return []
+        
+        sentences = _SENTENCE_END.split(f"{self._pending} {text}" if self._pending else text.lstrip())
+        self._pending = sentences.pop()
+        for sentence in sentences:
+            self._add_sentence(sentence)
+        if self._long:
+            # Whole text is no longer needed once it will not be one segment
+            self._parts = None
+        return self._take_ready()
+    
+    def finish(self) -> List[str]:
+        """Returns the remaining segments once all parts have been fed."""
+        if not self._long:
+            return [" ".join(self._parts)]
+        if self._pending.strip():
+            self._add_sentence(self._pending.rstrip())
+        if self._current:
+            self._ready.append(" ".join(self._current))
+            self._current = []
+        return self._take_ready()
+
+def segment_transcription(transcription: str, target_words: Optional[int] = None) -> List[str]:
+    """Split a long transcription into segments at sentence ends (see TranscriptSegmenter)."""
+    segmenter = TranscriptSegmenter(target_words)
+    segments = segmenter.feed(transcription)
+    return segments + segmenter.finish()
+
+def _response_cache():
+    # Imported here: the cache module depends on the database module
+    from utils.response_cache import get_response_cache
+    try:
+        return get_response_cache()
+    except Exception as e:
+        logger.warning(f"Post-processing response cache unavailable: {str(e)}")
+        return None
+
+def _check_audio_file(audio_file_path: str):
+    """Validate and log the audio file before sending it to Whisper."""
+    # Check if file exists
+    if not os.path.exists(audio_file_path):
+        logger.error(f"File not found: {audio_file_path}")
+        raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
+    
+    # Log file size
+    file_size = os.path.getsize(audio_file_path)
+    file_size_mb = file_size / (1024 * 1024)  # Convert to MB
+    logger.info(f"File size: {file_size_mb:.2f} MB")
+    
+    # Check if file is within size limits
+    if file_size > MAX_FILE_SIZE:
+        logger.warning(f"File exceeds Whisper API size limit (25MB): {file_size_mb:.2f} MB")
+
+def _finish_transcription(response, start_time: float, audio_seconds: Optional[float]) -> str:
+    """Log and account for a completed Whisper request."""
+    elapsed_time = time.time() - start_time
+    logger.info(f"Transcription completed in {elapsed_time:.2f} seconds")
+    record_usage("transcription", "whisper-1", elapsed_time, audio_seconds=audio_seconds or 0.0)
+    
+    # Log some stats about the transcription
+    text_length = len(response.text)
+    logger.info(f"Transcription generated {text_length} characters")
+    
+    return response.text
+
+def _post_processing_messages(transcription: str, custom_instruction: str) -> List[Dict[str, str]]:
+    """Log the post-processing input and build the chat messages."""
+    # Log transcription length and instruction
+    transcription_length = len(transcription)
+    instruction_length = len(custom_instruction)
+    logger.info(f"Transcription length: {transcription_length} characters")
+    logger.info(f"Custom instruction length: {instruction_length} characters")
+    
+    # Log a snippet of the transcription for debugging
+    logger.debug(f"Transcription snippet: {snippet(transcription)}")
+    
+    return [
+        {"role": "system", "content": custom_instruction},
+        {"role": "user", "content": transcription}
+    ]
+
+def _finish_post_processing(response, start_time: float) -> Dict[str, Any]:
+    """Log and account for a completed GPT-4o request."""
+    elapsed_time = time.time() - start_time
+    logger.info(f"Post-processing completed in {elapsed_time:.2f} seconds")
+    
+    prompt_tokens = completion_tokens = 0
+    if response.usage is not None:
+        prompt_tokens = response.usage.prompt_tokens
+        completion_tokens = response.usage.completion_tokens
+        logger.info(f"Token usage: {prompt_tokens} prompt, {completion_tokens} completion")
+        metrics.OPENAI_TOKENS.labels(POST_PROCESS_MODEL, "prompt").inc(prompt_tokens)
+        metrics.OPENAI_TOKENS.labels(POST_PROCESS_MODEL, "completion").inc(completion_tokens)
+        record_usage("post_processing", POST_PROCESS_MODEL, elapsed_time,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    
+    processed_text = response.choices[0].message.content
+    processed_length = len(processed_text)
+    logger.info(f"Processed transcription length: {processed_length} characters")
+    
+    # Log a snippet of the processed text
+    logger.debug(f"Processed text snippet: {snippet(processed_text)}")
+    
+    return {"text": processed_text, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+def _log_segments(segments: List[str]):
+    if len(segments) > 1:
+        logger.info(f"Post-processing in {len(segments)} segments")
+
+def _cache_key(segment: str, custom_instruction: str) -> str:
+    from utils.response_cache import cache_key
+    return cache_key(POST_PROCESS_MODEL, POST_PROCESS_TEMPERATURE, custom_instruction, segment)
+
+def _store_response(cache, key: str, result: Dict[str, Any]):
+    try:
+        cache.put(key, POST_PROCESS_MODEL, result["text"],
+                  prompt_tokens=result["prompt_tokens"], completion_tokens=result["completion_tokens"])
+    except Exception as e:
+        # A full disk or locked cache file must not fail the upload
+        logger.warning(f"Could not cache post-processing response: {str(e)}")
+
+def _cached_response(cache, key: str) -> Optional[str]:
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"Could not read post-processing response cache: {str(e)}")
+        return None
+
+def _post_process_segment(segment: str, custom_instruction: str, cache) -> str:
+    key = _cache_key(segment, custom_instruction) if cache is not None else None
+    if key is not None:
+        cached = _cached_response(cache, key)
+        if cached is not None:
+            logger.info(f"Post-processing response served from cache ({len(cached)} characters)")
+            return cached
+    
+    messages = _post_processing_messages(segment, custom_instruction)
+    
+    start_time = time.time()
+    logger.info("Sending request to OpenAI GPT-4o API")
+    
+    with metrics.time_stage("post_process"):
+        response = get_client().chat.completions.create(
+            model=POST_PROCESS_MODEL,
+            messages=messages,
+            temperature=POST_PROCESS_TEMPERATURE,
+        )
+    
+    result = _finish_post_processing(response, start_time)
+    if key is not None:
+        _store_response(cache, key, result)
+    return result["text"]
+
+async def _post_process_segment_async(segment: str, custom_instruction: str, cache) -> str:
+    key = _cache_key(segment, custom_instruction) if cache is not None else None
+    if key is not None:
+        cached = await asyncio.to_thread(_cached_response, cache, key)
+        if cached is not None:
+            logger.info(f"Post-processing response served from cache ({len(cached)} characters)")
+            return cached
+    
+    messages = _post_processing_messages(segment, custom_instruction)
+    
+    start_time = time.time()
+    logger.info("Sending request to OpenAI GPT-4o API")
+    
+    with metrics.time_stage("post_process"):
+        response = await get_async_client().chat.completions.create(
+            model=POST_PROCESS_MODEL,
+            messages=messages,
+            temperature=POST_PROCESS_TEMPERATURE,
+        )
+    
+    result = _finish_post_processing(response, start_time)
+    if key is not None:
+        await asyncio.to_thread(_store_response, cache, key, result)
+    return result["text"]
+
+def transcribe_audio(audio_file_path: str, audio_seconds: Optional[float] = None) -> str:
     """
     Transcribe audio file using OpenAI's Whisper model.
     
     Args:
         audio_file_path: Path to the audio file
-        
+        audio_seconds: Duration of the audio, recorded as billed Whisper usage
+    
     Returns:
         Transcription text
     """
     logger.info(f"Starting transcription for file: {audio_file_path}")
     
     try:
-        # Check if file exists
-        if not os.path.exists(audio_file_path):
-            logger.error(f"File not found: {audio_file_path}")
-            raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
-        
-        # Log file size
-        file_size = os.path.getsize(audio_file_path)
-        file_size_mb = file_size / (1024 * 1024)  # Convert to MB
-        logger.info(f"File size: {file_size_mb:.2f} MB")
-        
-        # Check if file is within size limits
-        if file_size > MAX_FILE_SIZE:
-            logger.warning(f"File exceeds Whisper API size limit (25MB): {file_size_mb:.2f} MB")
+        _check_audio_file(audio_file_path)
         
         start_time = time.time()
         logger.info("Sending request to OpenAI Whisper API")
         
-        with open(audio_file_path, "rb") as audio_file:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
+        with metrics.INFLIGHT_CHUNKS.track_inprogress(), metrics.time_stage("whisper_chunk"):
+            with open(audio_file_path, "rb") as audio_file:
+                response = get_client().audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio_file
+                )
         
-        elapsed_time = time.time() - start_time
-        logger.info(f"Transcription completed in {elapsed_time:.2f} seconds")
+        return _finish_transcription(response, start_time, audio_seconds)
+    except Exception as e:
+        metrics.OPENAI_ERRORS.labels("audio.transcriptions").inc()
+        logger.error(f"Error transcribing audio: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+async def transcribe_audio_async(audio_file_path: str, audio_seconds: Optional[float] = None) -> str:
+    """Awaitable version of transcribe_audio using the async OpenAI client."""
+    logger.info(f"Starting transcription for file: {audio_file_path}")
+    
+    try:
+        _check_audio_file(audio_file_path)
         
-        # Log some stats about the transcription
-        text_length = len(response.text)
-        logger.info(f"Transcription generated {text_length} characters")
+        start_time = time.time()
+        logger.info("Sending request to OpenAI Whisper API")
         
-        return response.text
+        with metrics.INFLIGHT_CHUNKS.track_inprogress(), metrics.time_stage("whisper_chunk"):
+            with open(audio_file_path, "rb") as audio_file:
+                response = await get_async_client().audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio_file
+                )
+        
+        return _finish_transcription(response, start_time, audio_seconds)
     except Exception as e:
+        metrics.OPENAI_ERRORS.labels("audio.transcriptions").inc()
         logger.error(f"Error transcribing audio: {str(e)}")
         logger.error(traceback.format_exc())
         raise
@@ -86,48 +352,102 @@ def post_process_transcription(transcription: str, custom_instruction: str) -> s
     Args:
         transcription: Raw transcription text
         custom_instruction: Custom instruction for post-processing
-        
+    
     Returns:
         Processed transcription text
+    
+    Responses are looked up in and saved to the response cache; long
+    transcriptions are processed segment by segment and joined by blank lines.
     """
     logger.info("Starting GPT-4o post-processing")
     
     try:
-        # Log transcription length and instruction
-        transcription_length = len(transcription)
-        instruction_length = len(custom_instruction)
-        logger.info(f"Transcription length: {transcription_length} characters")
-        logger.info(f"Custom instruction length: {instruction_length} characters")
+        cache = _response_cache()
+        segments = segment_transcription(transcription)
+        _log_segments(segments)
         
-        # Log a snippet of the transcription for debugging
-        logger.info(f"Transcription snippet: {transcription[:100]}...")
+        processed = [_post_process_segment(segment, custom_instruction, cache) for segment in segments]
+        return "\n\n".join(processed)
+    except Exception as e:
+        metrics.OPENAI_ERRORS.labels("chat.completions").inc()
+        logger.error(f"Error post-processing transcription: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+def post_process_segment(segment: str, custom_instruction: str) -> str:
+    """
+    Post-process one segment of a transcription (see TranscriptSegmenter).
+    
+    Joining the processed segments with blank lines gives the result of
+    post_process_transcription for the whole text.
+    """
+    try:
+        return _post_process_segment(segment, custom_instruction, _response_cache())
+    except Exception as e:
+        metrics.OPENAI_ERRORS.labels("chat.completions").inc()
+        logger.error(f"Error post-processing transcription segment: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+async def post_process_segment_async(segment: str, custom_instruction: str) -> str:
+    """Awaitable version of post_process_segment using the async OpenAI client."""
+    try:
+        cache = await asyncio.to_thread(_response_cache)
+        return await _post_process_segment_async(segment, custom_instruction, cache)
+    except Exception as e:
+        metrics.OPENAI_ERRORS.labels("chat.completions").inc()
+        logger.error(f"Error post-processing transcription segment: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+async def post_process_transcription_async(transcription: str, custom_instruction: str) -> str:
+    """Awaitable version of post_process_transcription using the async OpenAI client."""
+    logger.info("Starting GPT-4o post-processing")
+    
+    try:
+        cache = await asyncio.to_thread(_response_cache)
+        segments = segment_transcription(transcription)
+        _log_segments(segments)
         
+        processed = []
+        for segment in segments:
+            processed.append(await _post_process_segment_async(segment, custom_instruction, cache))
+        return "\n\n".join(processed)
+    except Exception as e:
+        metrics.OPENAI_ERRORS.labels("chat.completions").inc()
+        logger.error(f"Error post-processing transcription: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+def embed_texts(texts: List[str], model: str, dimensions: Optional[int] = None) -> List[List[float]]:
+    """
+    Embed texts for semantic search.
+    
+    Args:
+        texts: Texts to embed, in one request
+        model: Embedding model, e.g. text-embedding-3-small
+        dimensions: Shorten the vectors to this many dimensions
+    
+    Returns:
+        One vector per text, in order
+    """
+    logger.info(f"Embedding {len(texts)} text(s) with {model}")
+    
+    try:
         start_time = time.time()
-        logger.info("Sending request to OpenAI GPT-4o API")
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": custom_instruction},
-                {"role": "user", "content": transcription}
-            ],
-            temperature=0.3,
-        )
-        
+        with metrics.time_stage("embedding"):
+            kwargs = {"dimensions": dimensions} if dimensions else {}
+            response = get_client().embeddings.create(model=model, input=texts, **kwargs)
         elapsed_time = time.time() - start_time
-        logger.info(f"Post-processing completed in {elapsed_time:.2f} seconds")
         
-        processed_text = response.choices[0].message.content
-        processed_length = len(processed_text)
-        logger.info(f"Processed transcription length: {processed_length} characters")
+        if response.usage is not None:
+            metrics.OPENAI_TOKENS.labels(model, "prompt").inc(response.usage.prompt_tokens)
+            record_usage("embedding", model, elapsed_time, prompt_tokens=response.usage.prompt_tokens)
         
-        # Log a snippet of the processed text
-        logger.info(f"Processed text snippet: {processed_text[:100]}...")
-        
-        return processed_text
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
     except Exception as e:
-        logger.error(f"Error post-processing transcription: {str(e)}")
-        logger.error(traceback.format_exc())
+        metrics.OPENAI_ERRORS.labels("embeddings").inc()
+        logger.error(f"Error embedding texts: {str(e)}")
         raise
 
 def check_file_size(file_path: str) -> bool:
@@ -136,7 +456,7 @@ def check_file_size(file_path: str) -> bool:
     
     Args:
         file_path: Path to the file
-        
+    
     Returns:
         True if the file size is within the limit, False otherwise
     """
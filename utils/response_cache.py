@@ -0,0 +1,196 @@
+"""
+Durable cache of GPT-4o post-processing responses.
+
+Post-processing the same text with the same instruction again, e.g. when a
+user retries a failed upload or the same recording is uploaded twice, would
+cost a full GPT-4o call. Responses are stored in a SQLite file under a key
+that hashes everything the response depends on: model, temperature,
+instruction text and input text. Long transcripts are post-processed in
+segments (see openai_client.segment_transcription), each cached on its own,
+so only segments whose text changed are sent again.
+
+Entries expire after RESPONSE_CACHE_TTL_DAYS. When the stored responses
+exceed RESPONSE_CACHE_MAX_MB, the least recently used entries are evicted.
+Hits and misses are counted in metrics and, across restarts, in the cache
+file itself; stats() reports both.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import DB_DIR
+
+# Initialize logger
+logger = get_app_logger()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(DB_DIR, "response_cache.db"))
+RESPONSE_CACHE_TTL_DAYS = float(os.getenv("RESPONSE_CACHE_TTL_DAYS", "30"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "256"))
+
+# Part of every key; bump to invalidate all entries after a prompt format change
+KEY_VERSION = 1
+
+def cache_key(model: str, temperature: float, instruction: str, text: str) -> str:
+    """Key of a response: a hash over the hashes of everything it depends on."""
+    parts = [
+        str(KEY_VERSION),
+        model,
+        repr(float(temperature)),
+        hashlib.sha256(instruction.encode("utf-8")).hexdigest(),
+        hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    ]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Response cache in a SQLite file, shared by all processes.
+
+    Args:
+        path: Database file
+        ttl_seconds: Age after which an entry is no longer served
+        max_bytes: Size of the stored responses above which LRU entries are evicted
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl_seconds: float = RESPONSE_CACHE_TTL_DAYS * 86400,
+                 max_bytes: float = RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used_at)")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS lookups (
+                result TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached response and mark it as used, or None."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE responses SET hits = hits + 1, last_used_at = ? WHERE key = ? AND created_at >= ? "
+                "RETURNING response, prompt_tokens, completion_tokens, model",
+                (now, key, now - self.ttl_seconds)
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO lookups (result, count) VALUES (?, 1) "
+                "ON CONFLICT (result) DO UPDATE SET count = count + 1",
+                ("miss" if row is None else "hit",)
+            )
+        if row is None:
+            metrics.RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        metrics.RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+        metrics.RESPONSE_CACHE_SAVED_TOKENS.labels(row["model"], "prompt").inc(row["prompt_tokens"])
+        metrics.RESPONSE_CACHE_SAVED_TOKENS.labels(row["model"], "completion").inc(row["completion_tokens"])
+        return row["response"]
+
+    def put(self, key: str, model: str, response: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        """Store a response, evicting least recently used entries if the cache is full."""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, response, bytes, prompt_tokens, completion_tokens, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, prompt_tokens, completion_tokens, now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        # Oldest-used entries first, until a tenth of the budget is free again
+        excess = total - 0.9 * self.max_bytes
+        cursor = conn.execute('''
+        DELETE FROM responses WHERE key IN (
+            SELECT key FROM (
+                SELECT key, bytes, SUM(bytes) OVER (ORDER BY last_used_at, key ROWS UNBOUNDED PRECEDING) AS freed
+                FROM responses
+            ) WHERE freed - bytes < ?
+        )
+        ''', (excess,))
+        if cursor.rowcount:
+            metrics.RESPONSE_CACHE_EVICTIONS.labels("lru").inc(cursor.rowcount)
+            logger.info(f"Response cache full: evicted {cursor.rowcount} least recently used entries")
+        return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the TTL; returns how many."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        if cursor.rowcount:
+            metrics.RESPONSE_CACHE_EVICTIONS.labels("expired").inc(cursor.rowcount)
+        return cursor.rowcount
+
+    def clear(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM responses").rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookups since the cache was created, and the entries, size and hits of the stored responses."""
+        with self._connect() as conn:
+            lookups = dict(conn.execute("SELECT result, count FROM lookups").fetchall())
+            row = conn.execute(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(bytes), 0) AS bytes, COALESCE(SUM(hits), 0) AS hits, "
+                "COALESCE(SUM(hits * prompt_tokens), 0) AS saved_prompt_tokens, "
+                "COALESCE(SUM(hits * completion_tokens), 0) AS saved_completion_tokens, "
+                "MIN(created_at) AS oldest FROM responses"
+            ).fetchone()
+        stats = dict(row)
+        stats["lookups"] = {"hit": lookups.get("hit", 0), "miss": lookups.get("miss", 0)}
+        total = stats["lookups"]["hit"] + stats["lookups"]["miss"]
+        stats["hit_rate"] = round(stats["lookups"]["hit"] / total, 4) if total else None
+        stats["max_bytes"] = int(self.max_bytes)
+        stats["ttl_days"] = self.ttl_seconds / 86400
+        return stats
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if RESPONSE_CACHE_ENABLED is off."""
+    global _cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,554 @@
+"""
+Semantic search over processed transcripts.
+
+Transcripts are cut into paragraph-sized slices, and each slice is embedded
+as a unit-length float32 vector. A question such as "where did the client
+talk about ending the lease" is embedded the same way, and the slices with
+the highest cosine similarity are returned with their transcription.
+
+The index lives in SEMANTIC_INDEX_DIR as memory-mapped files shared by every
+worker process:
+
+    meta.json              counts, generation and embedder of the index
+    vectors-<gen>.f32      one row of float32 per slice
+    slices-<gen>.i64       (transcription ID, start, end) of each slice in
+                           processed_transcription; ID -1 marks a removed slice
+    centroids-<gen>.npy    IVF centroids, once trained
+    lists-<gen>.i32        IVF list of each slice
+
+Rows are only ever appended, under a file lock; meta.json is replaced after
+the rows are written, so readers never see half-written slices. Small
+indexes are searched exhaustively in blocks. Once an IVF (inverted file)
+index has been trained and the index holds at least SEMANTIC_IVF_MIN_SLICES
+slices, a query compares the vectors of the SEMANTIC_IVF_PROBES lists whose
+centroids are closest to it, a small fraction of the collection.
+
+Embedding providers are pluggable (register_embedder). "openai" uses the
+embeddings API; "hash" is a deterministic local stand-in based on hashed
+words, for tests and offline use. An index only answers queries embedded by
+the provider that built it; switching providers needs a rebuild.
+"""
+import os
+import re
+import json
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+import numpy as np
+
+from utils.logging_config import get_app_logger
+from utils import metrics
+from database import DB_DIR
+
+# Initialize logger
+logger = get_app_logger()
+
+# Index transcriptions as they are saved
+SEMANTIC_SEARCH_ENABLED = os.getenv("SEMANTIC_SEARCH_ENABLED", "1") == "1"
+SEMANTIC_INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", os.path.join(DB_DIR, "semantic_index"))
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Shortened embeddings keep a million slices at 1 GB and queries fast
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "256"))
+# Slices sent to the provider per request
+EMBEDDING_BATCH_SIZE = 256
+
+# Paragraphs longer than this are split; shorter slices are merged with the next paragraph
+SLICE_MAX_WORDS = int(os.getenv("SEMANTIC_SLICE_MAX_WORDS", "200"))
+SLICE_MIN_WORDS = int(os.getenv("SEMANTIC_SLICE_MIN_WORDS", "25"))
+
+# Use the IVF index (once trained) from this many slices on
+IVF_MIN_SLICES = int(os.getenv("SEMANTIC_IVF_MIN_SLICES", "100000"))
+IVF_PROBES = int(os.getenv("SEMANTIC_IVF_PROBES", "32"))
+# Hits scoring at or below this cosine similarity are not shown
+SEMANTIC_MIN_SCORE = float(os.getenv("SEMANTIC_MIN_SCORE", "0"))
+
+# Rows scored per matrix product in exhaustive search
+SEARCH_BLOCK_ROWS = 65536
+INITIAL_CAPACITY = 1024
+
+PARAGRAPH = re.compile(r"[^\n]*\S[^\n]*(?:\n[^\n]*\S[^\n]*)*")
+WORD = re.compile(r"\S+")
+
+def slice_text(text: str) -> List[Tuple[int, int]]:
+    """
+    Cut a transcript into slices of roughly paragraph size.
+
+    Returns:
+        (start, end) character offsets of each slice
+    """
+    slices: List[List[int]] = []  # [start, end, words]
+    for paragraph in PARAGRAPH.finditer(text):
+        words = [m.span() for m in WORD.finditer(text, paragraph.start(), paragraph.end())]
+        for i in range(0, len(words), SLICE_MAX_WORDS):
+            chunk = words[i:i + SLICE_MAX_WORDS]
+            if slices and slices[-1][2] < SLICE_MIN_WORDS and slices[-1][2] + len(chunk) <= SLICE_MAX_WORDS:
+                slices[-1][1] = chunk[-1][1]
+                slices[-1][2] += len(chunk)
+            else:
+                slices.append([chunk[0][0], chunk[-1][1], len(chunk)])
+    # A short closing paragraph joins the slice before it
+    if len(slices) > 1 and slices[-1][2] < SLICE_MIN_WORDS and slices[-2][2] + slices[-1][2] <= SLICE_MAX_WORDS:
+        last = slices.pop()
+        slices[-1][1] = last[1]
+        slices[-1][2] += last[2]
+    return [(start, end) for start, end, _ in slices]
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class Embedder:
+    """Turns texts into unit-length float32 vectors."""
+
+    name = "base"
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    @property
+    def identity(self) -> str:
+        """Recorded with the index; vectors of different identities are not comparable."""
+        return f"{self.name}:{self.dimensions}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic local embedder: words and word pairs hashed into signed buckets.
+
+    It only matches on shared vocabulary, so it is no substitute for a real
+    model, but it needs no network and gives the same vectors on every run.
+    """
+
+    name = "hash"
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = re.findall(r"[\w']+", text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        return vector
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return _normalize(np.stack([self._vector(text) for text in texts]))
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API, billed to the job in the current context."""
+
+    name = "openai"
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, model: str = EMBEDDING_MODEL):
+        super().__init__(dimensions)
+        self.model = model
+
+    @property
+    def identity(self) -> str:
+        return f"{self.name}:{self.model}:{self.dimensions}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        from utils.openai_client import embed_texts
+
+        vectors = []
+        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            vectors.extend(embed_texts(texts[i:i + EMBEDDING_BATCH_SIZE], self.model, self.dimensions))
+        if not vectors:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return _normalize(vectors)
+
+# Provider name -> factory taking no arguments
+_embedders: Dict[str, Callable[[], Embedder]] = {
+    "hash": HashingEmbedder,
+    "openai": OpenAIEmbedder,
+}
+
+def register_embedder(name: str, factory: Callable[[], Embedder]):
+    """Make an embedding provider available under an EMBEDDING_PROVIDER name."""
+    _embedders[name] = factory
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    """Create the embedder for a provider name (EMBEDDING_PROVIDER by default)."""
+    name = name or EMBEDDING_PROVIDER
+    if name not in _embedders:
+        raise ValueError(f"Unknown embedding provider: {name}")
+    return _embedders[name]()
+
+class IndexMismatch(Exception):
+    """Raised when the index was built by a different embedder than the one in use."""
+
+class VectorIndex:
+    """
+    Append-only, memory-mapped store of slice vectors shared between processes.
+
+    Args:
+        path: Directory of the index files
+    """
+
+    def __init__(self, path: str = SEMANTIC_INDEX_DIR):
+        self.path = path
+        self._local = threading.Lock()
+        self._meta: Optional[Dict[str, Any]] = None
+        self._meta_stamp = None
+        self._maps: Dict[str, Any] = {}
+
+    # Files and metadata
+
+    def _file(self, kind: str, generation: int) -> str:
+        extension = {"vectors": "f32", "slices": "i64", "lists": "i32", "centroids": "npy"}[kind]
+        return os.path.join(self.path, f"{kind}-{generation}.{extension}")
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.path, "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".meta_")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(self.path, "meta.json"))
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "index.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _map(self, kind: str, meta: Dict[str, Any], mode: str = "r+"):
+        shape = {
+            "vectors": (meta["capacity"], meta["dimensions"]),
+            "slices": (meta["capacity"], 3),
+            "lists": (meta["capacity"],),
+        }[kind]
+        dtype = {"vectors": np.float32, "slices": np.int64, "lists": np.int32}[kind]
+        generation = meta["ivf_generation"] if kind == "lists" else meta["generation"]
+        return np.memmap(self._file(kind, generation), dtype=dtype, mode=mode, shape=shape)
+
+    def _create_files(self, meta: Dict[str, Any], kinds=("vectors", "slices")):
+        for kind in kinds:
+            generation = meta["ivf_generation"] if kind == "lists" else meta["generation"]
+            itemsize = {"vectors": 4 * meta["dimensions"], "slices": 24, "lists": 4}[kind]
+            with open(self._file(kind, generation), "ab") as f:
+                f.truncate(meta["capacity"] * itemsize)
+
+    def _refresh(self) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Re-read meta.json if another process changed it, remapping files as needed.
+
+        Returns:
+            The metadata (None for a missing index) and the mapped arrays
+        """
+        try:
+            stat = os.stat(os.path.join(self.path, "meta.json"))
+        except FileNotFoundError:
+            return None, {}
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._local:
+            if stamp != self._meta_stamp:
+                meta = self._read_meta()
+                layout = lambda m: m and (m["generation"], m["ivf_generation"], m["capacity"], m["ivf_lists"])
+                if layout(meta) != layout(self._meta):
+                    self._maps = {kind: self._map(kind, meta) for kind in ("vectors", "slices")}
+                    if meta["ivf_lists"]:
+                        self._maps["lists"] = self._map("lists", meta)
+                        self._maps["centroids"] = np.load(self._file("centroids", meta["ivf_generation"]))
+                self._meta, self._meta_stamp = meta, stamp
+            return self._meta, self._maps
+
+    def _new_meta(self, embedder: str, dimensions: int, generation: int) -> Dict[str, Any]:
+        return {
+            "embedder": embedder,
+            "dimensions": dimensions,
+            "generation": generation,
+            "capacity": INITIAL_CAPACITY,
+            "count": 0,
+            "removed": 0,
+            "ivf_generation": 0,
+            "ivf_lists": 0,
+        }
+
+    # Writes
+
+    def reset(self, embedder: str, dimensions: int):
+        """Start an empty index for an embedder; the old files are deleted."""
+        with self._write_lock():
+            old = self._read_meta()
+            meta = self._new_meta(embedder, dimensions, (old["generation"] + 1) if old else 1)
+            self._create_files(meta)
+            self._write_meta(meta)
+            for name in os.listdir(self.path):
+                if re.match(r"^(vectors|slices|lists|centroids)-\d+\.", name) and \
+                        not name.startswith((f"vectors-{meta['generation']}.", f"slices-{meta['generation']}.")):
+                    os.remove(os.path.join(self.path, name))
+
+    def add(self, embedder: str, transcription_id: int, spans: List[Tuple[int, int]], vectors: np.ndarray):
+        """Append the slices of one transcription."""
+        if not spans:
+            return
+        with self._write_lock():
+            meta = self._read_meta()
+            if meta is None:
+                meta = self._new_meta(embedder, vectors.shape[1], 1)
+                self._create_files(meta)
+            if meta["embedder"] != embedder or meta["dimensions"] != vectors.shape[1]:
+                raise IndexMismatch(f"Index was built with {meta['embedder']}, not {embedder}; rebuild it")
+
+            start, end = meta["count"], meta["count"] + len(spans)
+            if end > meta["capacity"]:
+                while meta["capacity"] < end:
+                    meta["capacity"] *= 2
+                self._create_files(meta, ("vectors", "slices", "lists") if meta["ivf_lists"] else ("vectors", "slices"))
+
+            stored = {kind: self._map(kind, meta) for kind in ("vectors", "slices")}
+            stored["vectors"][start:end] = vectors
+            stored["slices"][start:end] = [(transcription_id, s, e) for s, e in spans]
+            if meta["ivf_lists"]:
+                centroids = np.load(self._file("centroids", meta["ivf_generation"]))
+                stored["lists"] = self._map("lists", meta)
+                stored["lists"][start:end] = np.argmax(vectors @ centroids.T, axis=1)
+            for array in stored.values():
+                array.flush()
+
+            # Rows are on disk before the count that makes them visible
+            meta["count"] = end
+            self._write_meta(meta)
+
+    def remove(self, transcription_id: int) -> int:
+        """Mark the slices of a transcription as removed; returns how many there were."""
+        with self._write_lock():
+            meta = self._read_meta()
+            if not meta or not meta["count"]:
+                return 0
+            slices = self._map("slices", meta)
+            rows = np.flatnonzero(slices[:meta["count"], 0] == transcription_id)
+            if len(rows):
+                slices[rows, 0] = -1
+                slices.flush()
+                meta["removed"] += len(rows)
+                self._write_meta(meta)
+            return len(rows)
+
+    def indexed_transcriptions(self) -> set:
+        meta, maps = self._refresh()
+        if not meta:
+            return set()
+        ids = np.unique(maps["slices"][:meta["count"], 0])
+        return set(int(i) for i in ids if i >= 0)
+
+    def train_ivf(self, lists: Optional[int] = None, iterations: int = 10, sample_per_list: int = 64,
+                  seed: int = 0) -> Dict[str, Any]:
+        """
+        Cluster the vectors with k-means into IVF lists and assign every slice.
+
+        Args:
+            lists: Number of lists; defaults to the square root of the slice count
+        """
+        with self._write_lock():
+            meta = self._read_meta()
+            if not meta or meta["count"] == 0:
+                raise ValueError("The index is empty")
+            count = meta["count"]
+            lists = lists or max(1, int(np.sqrt(count)))
+            vectors = self._map("vectors", meta, mode="r")
+
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(count, size=min(count, lists * sample_per_list), replace=False))
+            training = np.asarray(vectors[sample])
+            centroids = training[rng.choice(len(training), size=lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(training @ centroids.T, axis=1)
+                sizes = np.bincount(assignment, minlength=lists)
+                offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+                sums = np.zeros_like(centroids)
+                filled = sizes > 0
+                sums[filled] = np.add.reduceat(training[np.argsort(assignment, kind="stable")], offsets[filled])
+                # Reseed empty lists with random training vectors
+                sums[~filled] = training[rng.choice(len(training), size=int((~filled).sum()))]
+                centroids = _normalize(sums)
+
+            meta["ivf_generation"] += 1
+            meta["ivf_lists"] = lists
+            np.save(self._file("centroids", meta["ivf_generation"]), centroids)
+            self._create_files(meta, ("lists",))
+            assigned = self._map("lists", meta)
+            for block in range(0, count, SEARCH_BLOCK_ROWS):
+                end = min(count, block + SEARCH_BLOCK_ROWS)
+                assigned[block:end] = np.argmax(vectors[block:end] @ centroids.T, axis=1)
+            assigned.flush()
+            self._write_meta(meta)
+            for name in os.listdir(self.path):
+                match = re.match(r"^(lists|centroids)-(\d+)\.", name)
+                if match and int(match.group(2)) != meta["ivf_generation"]:
+                    os.remove(os.path.join(self.path, name))
+            return {"slices": count, "lists": lists, "iterations": iterations}
+
+    # Queries
+
+    def stats(self) -> Dict[str, Any]:
+        meta, _ = self._refresh()
+        if not meta:
+            return {"slices": 0, "removed": 0}
+        return {
+            "embedder": meta["embedder"],
+            "dimensions": meta["dimensions"],
+            "slices": meta["count"] - meta["removed"],
+            "removed": meta["removed"],
+            "ivf_lists": meta["ivf_lists"],
+            "uses_ivf": bool(meta["ivf_lists"]) and meta["count"] >= IVF_MIN_SLICES,
+        }
+
+    def search(self, query: np.ndarray, k: int = 10, embedder: Optional[str] = None,
+               probes: Optional[int] = None, exact: bool = False) -> List[Tuple[float, int, int, int]]:
+        """
+        Slices most similar to a unit-length query vector.
+
+        Args:
+            exact: Score every slice even when an IVF index is available
+
+        Returns:
+            (cosine similarity, transcription ID, start, end), best first
+        """
+        meta, maps = self._refresh()
+        if not meta or meta["count"] == 0:
+            return []
+        if embedder is not None and meta["embedder"] != embedder:
+            raise IndexMismatch(f"Index was built with {meta['embedder']}, not {embedder}; rebuild it")
+        count = meta["count"]
+        vectors, slices = maps["vectors"], maps["slices"]
+        query = np.asarray(query, dtype=np.float32)
+
+        if meta["ivf_lists"] and count >= IVF_MIN_SLICES and not exact:
+            probes = min(probes or IVF_PROBES, meta["ivf_lists"])
+            nearest_lists = np.argpartition(-(maps["centroids"] @ query), probes - 1)[:probes]
+            rows = np.flatnonzero(np.isin(maps["lists"][:count], nearest_lists))
+            scores = vectors[rows] @ query
+        else:
+            # Keep the best of every block so memory stays flat; removed slices
+            # may take some of those places, so keep that many more
+            keep = k + meta["removed"]
+            rows_parts, score_parts = [], []
+            for block in range(0, count, SEARCH_BLOCK_ROWS):
+                block_scores = vectors[block:min(count, block + SEARCH_BLOCK_ROWS)] @ query
+                best = np.argpartition(-block_scores, min(keep, len(block_scores)) - 1)[:keep]
+                rows_parts.append(best + block)
+                score_parts.append(block_scores[best])
+            rows, scores = np.concatenate(rows_parts), np.concatenate(score_parts)
+
+        live = slices[rows, 0] >= 0
+        rows, scores = rows[live], scores[live]
+        top = np.argsort(-scores)[:k]
+        return [(float(scores[i]), int(slices[rows[i], 0]), int(slices[rows[i], 1]), int(slices[rows[i], 2]))
+                for i in top]
+
+_index: Optional[VectorIndex] = None
+_embedder: Optional[Embedder] = None
+_default_lock = threading.Lock()
+
+def get_index() -> VectorIndex:
+    """Return the process-wide index at SEMANTIC_INDEX_DIR."""
+    global _index
+    with _default_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
+
+def get_default_embedder() -> Embedder:
+    """Return the process-wide embedder for EMBEDDING_PROVIDER."""
+    global _embedder
+    with _default_lock:
+        if _embedder is None:
+            _embedder = get_embedder()
+        return _embedder
+
+def index_transcription(transcription_id: int, text: str) -> int:
+    """
+    Embed and index the slices of a processed transcript.
+
+    Returns:
+        Number of slices added
+    """
+    if not SEMANTIC_SEARCH_ENABLED or not text:
+        return 0
+    embedder = get_default_embedder()
+    spans = slice_text(text)
+    vectors = embedder.embed([text[start:end] for start, end in spans])
+    get_index().add(embedder.identity, transcription_id, spans, vectors)
+    metrics.SEMANTIC_SLICES_INDEXED.inc(len(spans))
+    logger.info(f"Indexed {len(spans)} slice(s) of transcription {transcription_id} for semantic search")
+    return len(spans)
+
+def remove_transcription(transcription_id: int) -> int:
+    """Drop a deleted transcription from the index."""
+    return get_index().remove(transcription_id)
+
+def search(query: str, k: int = 10) -> List[Dict[str, Any]]:
+    """
+    Find the transcript passages closest in meaning to a question.
+
+    Returns:
+        Up to k hits, best first, with the passage text and its transcription
+    """
+    from database import get_transcription
+
+    embedder = get_default_embedder()
+    with metrics.time_stage("semantic_search"):
+        query_vector = embedder.embed([query])[0]
+        matches = get_index().search(query_vector, k, embedder=embedder.identity)
+
+    transcriptions: Dict[int, Optional[Dict[str, Any]]] = {}
+    hits = []
+    for score, transcription_id, start, end in matches:
+        if score <= SEMANTIC_MIN_SCORE:
+            break
+        if transcription_id not in transcriptions:
+            transcriptions[transcription_id] = get_transcription(transcription_id)
+        transcription = transcriptions[transcription_id]
+        if transcription is None or not transcription.get("processed_transcription"):
+            continue
+        hits.append({
+            "transcription_id": transcription_id,
+            "original_filename": transcription["original_filename"],
+            "created_at": transcription["created_at"],
+            "score": round(score, 4),
+            "start": start,
+            "end": end,
+            "text": transcription["processed_transcription"][start:end],
+        })
+    return hits
+
+def backfill(limit: Optional[int] = None) -> Dict[str, Any]:
+    """Index saved transcriptions that are not in the index yet, oldest first."""
+    from database import get_all_transcriptions, get_transcription
+
+    indexed = get_index().indexed_transcriptions()
+    pending = sorted(t["id"] for t in get_all_transcriptions() if t["id"] not in indexed)
+    report = {"transcriptions": 0, "slices": 0, "pending": len(pending)}
+    for transcription_id in pending[:limit]:
+        transcription = get_transcription(transcription_id)
+        if transcription is None:
+            continue
+        report["slices"] += index_transcription(transcription_id, transcription.get("processed_transcription") or "")
+        report["transcriptions"] += 1
+    return report
+
+def rebuild() -> Dict[str, Any]:
+    """Re-index every transcription with the current embedder."""
+    embedder = get_default_embedder()
+    get_index().reset(embedder.identity, embedder.dimensions)
+    return backfill()
@@ -0,0 +1,154 @@
+"""
+Rolling audio windows for live transcription.
+
+Clients stream 16-bit little-endian mono PCM. WindowBuffer collects it and
+closes a window once it is long enough and followed by a pause, so Whisper
+sees whole phrases instead of words cut in half. A window that runs
+MAX_WINDOW_SECONDS without a pause is cut at its quietest frame, which bounds
+the latency of a partial transcript.
+"""
+import os
+import io
+import wave
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Sample rate the browser client resamples to; Whisper works at 16 kHz
+STREAM_SAMPLE_RATE = int(os.getenv("STREAM_SAMPLE_RATE", "16000"))
+# Windows shorter than this are never closed at a pause
+MIN_WINDOW_SECONDS = float(os.getenv("STREAM_MIN_WINDOW_SECONDS", "4"))
+# Windows are force-closed at this length
+MAX_WINDOW_SECONDS = float(os.getenv("STREAM_MAX_WINDOW_SECONDS", "15"))
+# Length of the pause that closes a window
+SILENCE_SECONDS = float(os.getenv("STREAM_SILENCE_SECONDS", "0.6"))
+# Frames quieter than this RMS level (in dBFS) count as silence
+SILENCE_DBFS = float(os.getenv("STREAM_SILENCE_DBFS", "-45"))
+
+# Accepted range of the sample_rate a client streams at
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+# Closed windows waiting for Whisper; while it falls this far behind, new
+# windows are dropped instead of queued
+MAX_PENDING_WINDOWS = int(os.getenv("STREAM_MAX_PENDING_WINDOWS", "4"))
+# Longest session: its recording is reserved in admission control, and a
+# session that reaches it is ended and saved
+RESERVE_SECONDS = float(os.getenv("STREAM_RESERVE_SECONDS", "3600"))
+# A session that sends nothing for this long is ended and saved
+IDLE_TIMEOUT_SECONDS = float(os.getenv("STREAM_IDLE_TIMEOUT_SECONDS", "60"))
+
+# Energy is measured over 20 ms frames
+FRAME_SECONDS = 0.02
+
+def frame_dbfs(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """RMS level of each complete frame of int16 samples, in dBFS."""
+    frames = len(samples) // frame_length
+    if frames == 0:
+        return np.empty(0)
+    framed = samples[:frames * frame_length].reshape(frames, frame_length).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(framed * framed, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def is_silent(samples: np.ndarray, sample_rate: int = STREAM_SAMPLE_RATE) -> bool:
+    """True if no frame of the samples rises above the silence threshold."""
+    levels = frame_dbfs(samples, max(1, int(sample_rate * FRAME_SECONDS)))
+    return levels.size == 0 or bool(np.all(levels < SILENCE_DBFS))
+
+def pcm_to_wav(samples: np.ndarray, sample_rate: int = STREAM_SAMPLE_RATE) -> bytes:
+    """Encode int16 mono samples as a WAV file."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(samples.astype("<i2").tobytes())
+    return buffer.getvalue()
+
+class WindowBuffer:
+    """
+    Accumulates streamed PCM and cuts it into windows at pauses.
+
+    Args:
+        sample_rate: Sample rate of the incoming PCM
+    """
+
+    def __init__(self, sample_rate: int = STREAM_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.frame_length = max(1, int(sample_rate * FRAME_SECONDS))
+        self.min_samples = int(MIN_WINDOW_SECONDS * sample_rate)
+        self.max_samples = int(MAX_WINDOW_SECONDS * sample_rate)
+        self.silence_frames = max(1, int(SILENCE_SECONDS / FRAME_SECONDS))
+        self._chunks: List[np.ndarray] = []
+        self._length = 0
+        self._remainder = b""
+        # Offset of the open window in the whole stream, in samples
+        self.window_start = 0
+
+    def _pending(self) -> np.ndarray:
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.empty(0, dtype=np.int16)
+
+    def _cut(self, end: int) -> Tuple[int, np.ndarray]:
+        pending = self._pending()
+        window, rest = pending[:end], pending[end:]
+        self._chunks = [rest] if len(rest) else []
+        self._length = len(rest)
+        start = self.window_start
+        self.window_start += end
+        return start, window
+
+    def _find_cut(self, pending: np.ndarray) -> Optional[int]:
+        """Sample index to close the window at, or None to keep buffering."""
+        if len(pending) < self.min_samples:
+            return None
+        levels = frame_dbfs(pending, self.frame_length)
+        silent = levels < SILENCE_DBFS
+        # Latest pause of silence_frames frames after the minimum length;
+        # cut in its middle so both windows keep a little padding
+        min_frame = self.min_samples // self.frame_length
+        run = 0
+        cut_frame = None
+        for index in range(len(silent) - 1, min_frame - 1, -1):
+            run = run + 1 if silent[index] else 0
+            if run >= self.silence_frames:
+                cut_frame = index + run // 2
+                break
+        if cut_frame is not None:
+            return cut_frame * self.frame_length
+        if len(pending) >= self.max_samples:
+            # No pause: cut at the quietest frame of the last third
+            max_frame = self.max_samples // self.frame_length
+            tail_start = max_frame * 2 // 3
+            quietest = tail_start + int(np.argmin(levels[tail_start:max_frame]))
+            return quietest * self.frame_length
+        return None
+
+    def add(self, data: bytes) -> List[Tuple[int, np.ndarray]]:
+        """
+        Add streamed PCM bytes.
+
+        Returns:
+            Closed windows as (start sample, samples) pairs
+        """
+        data = self._remainder + data
+        usable = len(data) - len(data) % 2
+        self._remainder = data[usable:]
+        if usable:
+            samples = np.frombuffer(data[:usable], dtype="<i2")
+            self._chunks.append(samples)
+            self._length += len(samples)
+
+        windows = []
+        while self._length >= self.min_samples:
+            cut = self._find_cut(self._pending())
+            if cut is None:
+                break
+            windows.append(self._cut(cut))
+        return windows
+
+    def flush(self) -> Optional[Tuple[int, np.ndarray]]:
+        """Close whatever is buffered as a final window."""
+        if self._length == 0:
+            return None
+        return self._cut(self._length)
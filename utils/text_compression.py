@@ -0,0 +1,96 @@
+"""
+Codecs for transcript text stored in the database.
+
+Transcripts compress well on their own, and the processed transcript is a
+near-copy of the Whisper transcript of the same recording. The Whisper text
+is therefore compressed with a dictionary trained on earlier transcripts,
+and the processed text is compressed with the Whisper text itself as the
+dictionary. Usually only the edits GPT-4o made are left to encode.
+
+zlib is always available; zstd is used when the optional zstandard package
+is installed.
+"""
+from typing import List, Optional
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used without it
+    zstandard = None
+
+# zlib only looks back this far, so longer dictionaries are truncated from the front
+ZLIB_WINDOW = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 64 * 1024
+
+CODECS = ("zlib", "zstd")
+
+def available(codec: str) -> bool:
+    """True if the codec can be used in this environment."""
+    return codec == "zlib" or (codec == "zstd" and zstandard is not None)
+
+def _zlib_dictionary(dictionary: Optional[bytes], reference: Optional[bytes]) -> Optional[bytes]:
+    zdict = (dictionary or b"") + (reference or b"")
+    return zdict[-ZLIB_WINDOW:] or None
+
+def _zstd_dictionary(dictionary: Optional[bytes], reference: Optional[bytes]):
+    if reference:
+        # The reference text is raw content, not a trained dictionary
+        return zstandard.ZstdCompressionDict((dictionary or b"") + reference,
+                                             dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    if dictionary:
+        return zstandard.ZstdCompressionDict(dictionary)
+    return None
+
+def compress(text: str, codec: str, level: int, dictionary: Optional[bytes] = None,
+             reference: Optional[str] = None) -> bytes:
+    """
+    Compress transcript text.
+
+    Args:
+        text: Text to compress
+        codec: "zlib" or "zstd"
+        level: Compression level
+        dictionary: Trained dictionary shared by many rows
+        reference: Similar text of the same row that is decompressed first
+    """
+    data = text.encode("utf-8")
+    reference_bytes = reference.encode("utf-8") if reference else None
+    if codec == "zlib":
+        zdict = _zlib_dictionary(dictionary, reference_bytes)
+        compressor = zlib.compressobj(level, zdict=zdict) if zdict else zlib.compressobj(level)
+        return compressor.compress(data) + compressor.flush()
+    if codec == "zstd":
+        zdict = _zstd_dictionary(dictionary, reference_bytes)
+        return zstandard.ZstdCompressor(level=level, dict_data=zdict).compress(data)
+    raise ValueError(f"Unknown transcript codec: {codec}")
+
+def decompress(data: bytes, codec: str, dictionary: Optional[bytes] = None,
+               reference: Optional[str] = None) -> str:
+    """Reverse compress() given the same dictionary and reference."""
+    reference_bytes = reference.encode("utf-8") if reference else None
+    if codec == "zlib":
+        zdict = _zlib_dictionary(dictionary, reference_bytes)
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+    if codec == "zstd":
+        zdict = _zstd_dictionary(dictionary, reference_bytes)
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown transcript codec: {codec}")
+
+def train_dictionary(codec: str, samples: List[str]) -> Optional[bytes]:
+    """
+    Build a shared dictionary from sample transcripts.
+
+    Returns:
+        The dictionary, or None if there are too few samples to be useful
+    """
+    encoded = [sample.encode("utf-8") for sample in samples if sample]
+    if len(encoded) < 10:
+        return None
+    if codec == "zstd":
+        return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, encoded).as_bytes()
+    # zlib has no trainer; a slice of every sample gives it the shared
+    # vocabulary, with the most recent samples nearest the end of the window
+    per_sample = max(256, ZLIB_WINDOW // len(encoded))
+    return b" ".join(sample[:per_sample] for sample in reversed(encoded))[-ZLIB_WINDOW:]
@@ -0,0 +1,275 @@
+"""
+Voice activity detection used to strip long silences before Whisper.
+
+Whisper bills every second it is sent, and depositions and client meetings
+contain long stretches where nobody speaks. strip_silence() decodes the
+recording to 16 kHz mono once to measure frame energy and zero-crossing
+rate, then writes a compact MP3 that contains only the speech spans (with a
+little padding). The kept spans form a TimeMap, so times in the stripped
+audio can be mapped back to the original recording.
+"""
+import os
+import math
+import bisect
+import tempfile
+import subprocess
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from utils.logging_config import get_app_logger
+from utils.streaming import frame_dbfs
+
+# Initialize logger
+logger = get_app_logger()
+
+# Set to 0 to send recordings to Whisper unmodified
+VAD_ENABLED = os.getenv("VAD_ENABLED", "1") == "1"
+# Only pauses at least this long are removed
+VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", "1.0"))
+# Audio kept on each side of a speech span so words are not clipped
+VAD_PADDING_SECONDS = float(os.getenv("VAD_PADDING_SECONDS", "0.25"))
+# Frames this many dB above the recording's noise floor count as speech
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))
+# The speech threshold is clamped to this range (dBFS)
+VAD_MIN_THRESHOLD_DBFS = float(os.getenv("VAD_MIN_THRESHOLD_DBFS", "-60"))
+VAD_MAX_THRESHOLD_DBFS = float(os.getenv("VAD_MAX_THRESHOLD_DBFS", "-30"))
+# Recordings are left alone unless at least this fraction would be removed
+VAD_MIN_REMOVED_FRACTION = float(os.getenv("VAD_MIN_REMOVED_FRACTION", "0.05"))
+# Bitrate of the stripped MP3 sent to Whisper
+VAD_OUTPUT_BITRATE = os.getenv("VAD_OUTPUT_BITRATE", "48k")
+
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 320  # 20 ms
+# Quiet frames with this many zero crossings per sample are unvoiced
+# consonants (s, f, sh) rather than background noise
+FRICATIVE_ZCR = 0.3
+FRICATIVE_MARGIN_DB = 6
+# Decoded PCM is processed in blocks of this many frames
+BLOCK_FRAMES = 1500
+
+class TimeMap:
+    """
+    Maps times in stripped audio back to the original recording.
+
+    Args:
+        segments: Kept (start, end) spans of the original recording, in seconds
+    """
+
+    def __init__(self, segments: List[Tuple[float, float]]):
+        self.segments = [(float(start), float(end)) for start, end in segments]
+        self._stripped_starts = []
+        offset = 0.0
+        for start, end in self.segments:
+            self._stripped_starts.append(offset)
+            offset += end - start
+        self.duration = offset
+
+    def to_original(self, seconds: float) -> float:
+        """Time in the original recording of a time in the stripped audio."""
+        if not self.segments:
+            return seconds
+        index = max(0, bisect.bisect_right(self._stripped_starts, seconds) - 1)
+        start, end = self.segments[index]
+        return min(start + seconds - self._stripped_starts[index], end)
+
+    def to_json(self) -> List[List[float]]:
+        return [[round(start, 3), round(end, 3)] for start, end in self.segments]
+
+def _decode_cmd(file_path: str) -> List[str]:
+    return [
+        "ffmpeg", "-v", "error",
+        "-i", file_path,
+        "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-f", "s16le", "-"
+    ]
+
+def _frame_features(file_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Level (dBFS) and zero-crossing rate of every 20 ms frame, streamed from FFmpeg."""
+    block_bytes = BLOCK_FRAMES * FRAME_LENGTH * 2
+    levels, zcrs = [], []
+    process = subprocess.Popen(_decode_cmd(file_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype="<i2")
+            frames = len(samples) // FRAME_LENGTH
+            if frames == 0:
+                continue
+            levels.append(frame_dbfs(samples, FRAME_LENGTH))
+            signs = np.signbit(samples[:frames * FRAME_LENGTH].reshape(frames, FRAME_LENGTH))
+            zcrs.append(np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / FRAME_LENGTH)
+        _, stderr = process.communicate()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    if process.returncode != 0:
+        raise ValueError(f"Error decoding audio for VAD: {stderr.decode('utf-8', 'replace')}")
+    if not levels:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(levels), np.concatenate(zcrs)
+
+def detect_speech(levels: np.ndarray, zcrs: np.ndarray) -> List[Tuple[float, float]]:
+    """
+    Find the spans of a recording to keep.
+
+    Args:
+        levels: Per-frame level in dBFS
+        zcrs: Per-frame zero-crossing rate
+
+    Returns:
+        Kept (start, end) spans in seconds; pauses shorter than
+        VAD_MIN_SILENCE_SECONDS stay inside a span
+    """
+    if levels.size == 0:
+        return []
+    frame_seconds = FRAME_LENGTH / SAMPLE_RATE
+    noise_floor = float(np.percentile(levels, 10))
+    threshold = min(max(noise_floor + VAD_MARGIN_DB, VAD_MIN_THRESHOLD_DBFS), VAD_MAX_THRESHOLD_DBFS)
+    speech = (levels >= threshold) | ((levels >= threshold - FRICATIVE_MARGIN_DB) & (zcrs >= FRICATIVE_ZCR))
+
+    # Speech frames grow by the padding, then gaps shorter than the minimum
+    # silence are closed
+    padding = int(round(VAD_PADDING_SECONDS / frame_seconds))
+    min_gap = int(round(VAD_MIN_SILENCE_SECONDS / frame_seconds))
+    indices = np.flatnonzero(speech)
+    if indices.size == 0:
+        return []
+    # Split the speech frames into runs wherever the gap to the next
+    # speech frame is long enough to remove
+    breaks = np.flatnonzero(np.diff(indices) > min_gap + 2 * padding)
+    run_starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    run_ends = np.concatenate((indices[breaks], [indices[-1]]))
+
+    total = levels.size
+    segments = []
+    for start, end in zip(run_starts, run_ends):
+        start = max(0, start - padding)
+        end = min(total, end + 1 + padding)
+        segments.append((start * frame_seconds, end * frame_seconds))
+    return segments
+
+def _write_segments(file_path: str, segments: List[Tuple[float, float]], output_path: str):
+    """Re-encode only the kept spans of a recording as a mono MP3."""
+    encode_cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "-",
+        "-c:a", "libmp3lame", "-b:a", VAD_OUTPUT_BITRATE,
+        output_path
+    ]
+    bounds = [(int(start * SAMPLE_RATE) * 2, int(end * SAMPLE_RATE) * 2) for start, end in segments]
+    decoder = subprocess.Popen(_decode_cmd(file_path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        position = 0
+        index = 0
+        while index < len(bounds):
+            data = decoder.stdout.read(BLOCK_FRAMES * FRAME_LENGTH * 2)
+            if not data:
+                break
+            block_end = position + len(data)
+            # Copy every part of this block that falls inside a kept span
+            while index < len(bounds) and bounds[index][0] < block_end:
+                start, end = bounds[index]
+                encoder.stdin.write(data[max(start, position) - position:min(end, block_end) - position])
+                if end > block_end:
+                    break
+                index += 1
+            position = block_end
+        # communicate() closes stdin, which ends the encoder's input
+        _, stderr = encoder.communicate()
+    finally:
+        for process in (decoder, encoder):
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    if encoder.returncode != 0:
+        raise ValueError(f"Error encoding stripped audio: {stderr.decode('utf-8', 'replace')}")
+
+class VadResult:
+    """
+    Outcome of strip_silence.
+
+    Attributes:
+        file_path: Stripped recording to transcribe
+        time_map: Maps stripped times back to the original
+        original_seconds: Duration of the original recording
+        kept_seconds: Duration of the stripped recording
+    """
+
+    def __init__(self, file_path: str, time_map: TimeMap, original_seconds: float):
+        self.file_path = file_path
+        self.time_map = time_map
+        self.original_seconds = original_seconds
+        self.kept_seconds = time_map.duration
+
+    @property
+    def removed_seconds(self) -> float:
+        return max(0.0, self.original_seconds - self.kept_seconds)
+
+    def stats(self, chunks_before: int, chunks_after: int, transcribe_seconds: float) -> Dict[str, Any]:
+        """
+        Per-job report stored with the transcription.
+
+        Args:
+            chunks_before: Whisper chunks the original recording would have needed
+            chunks_after: Whisper chunks actually sent
+            transcribe_seconds: Wall time spent transcribing the stripped audio
+        """
+        rate = transcribe_seconds / self.kept_seconds if self.kept_seconds else 0.0
+        return {
+            "original_seconds": round(self.original_seconds, 2),
+            "kept_seconds": round(self.kept_seconds, 2),
+            "removed_seconds": round(self.removed_seconds, 2),
+            "removed_fraction": round(self.removed_seconds / self.original_seconds, 4) if self.original_seconds else 0.0,
+            "chunks_before": chunks_before,
+            "chunks_after": chunks_after,
+            "latency_saved_seconds": round(self.removed_seconds * rate, 2),
+            "time_map": self.time_map.to_json(),
+        }
+
+def strip_silence(file_path: str, duration: float, temp_dir: Optional[str] = None) -> Optional[VadResult]:
+    """
+    Remove long silences from a recording.
+
+    Args:
+        file_path: Path to the recording
+        duration: Its duration in seconds
+        temp_dir: Directory for the stripped file
+
+    Returns:
+        The stripped recording, or None when VAD is disabled or would remove
+        less than VAD_MIN_REMOVED_FRACTION of the audio
+    """
+    if not VAD_ENABLED:
+        return None
+
+    levels, zcrs = _frame_features(file_path)
+    segments = detect_speech(levels, zcrs)
+    time_map = TimeMap(segments)
+    removed = duration - time_map.duration
+    if not segments or removed < duration * VAD_MIN_REMOVED_FRACTION:
+        logger.info(f"VAD: keeping the original recording ({max(0.0, removed):.1f}s of silence found)")
+        return None
+
+    fd, output_path = tempfile.mkstemp(suffix=".mp3", dir=temp_dir)
+    os.close(fd)
+    try:
+        _write_segments(file_path, segments, output_path)
+    except Exception:
+        os.remove(output_path)
+        raise
+    logger.info(
+        f"VAD: removed {removed:.1f}s of {duration:.1f}s "
+        f"({removed / duration:.0%}) in {len(segments)} speech spans"
+    )
+    return VadResult(output_path, time_map, duration)
+
+def estimate_chunks(file_size: int, max_chunk_bytes: int) -> int:
+    """Number of Whisper chunks split_audio_file produces for a file of this size."""
+    if file_size <= max_chunk_bytes:
+        return 1
+    return math.ceil(file_size / (max_chunk_bytes * 0.95))
@@ -0,0 +1,75 @@
+"""
+Queue worker for the leased-job mode (JOB_QUEUE=1).
+
+    python worker.py --threads 2
+
+Run any number of these, in any number of containers, against the shared
+db/ and uploads/ volumes. Each thread claims one transcription job at a time
+from the job store and heartbeats its lease while the pipeline runs.
+"""
+import os
+import signal
+import argparse
+import threading
+from typing import Dict, Any
+
+from utils.logging_config import get_app_logger
+from utils.job_queue import Worker, RetryLater, get_job_store, JOB_LEASE_SECONDS
+from utils.accounting import BudgetExceeded, seconds_until_budget_reset
+from utils import admission
+from database import init_db
+from pipeline import run_pipeline
+
+# Initialize logger
+logger = get_app_logger()
+
+def transcribe_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler for "transcribe" jobs enqueued by the upload route."""
+    # Wait for memory and disk while the lease is heartbeated; a rejection
+    # after that defers the job without using up one of its attempts
+    try:
+        reservation = admission.admit(
+            os.path.getsize(payload['file_path']),
+            wait_seconds=admission.ADMISSION_WORKER_WAIT_SECONDS,
+            label=payload['original_filename']
+        )
+    except admission.AdmissionRejected as e:
+        raise RetryLater(str(e), e.retry_after) from e
+    try:
+        with reservation:
+            transcription_id = run_pipeline(**payload)
+    except BudgetExceeded as e:
+        # Retrying later today would be refused again; wait for the budgets to start over
+        raise RetryLater(str(e), seconds_until_budget_reset()) from e
+    return {"transcription_id": transcription_id}
+
+HANDLERS = {
+    "transcribe": transcribe_job,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run transcription queue workers")
+    parser.add_argument("--threads", type=int, default=1, help="Jobs processed concurrently by this process")
+    parser.add_argument("--lease-seconds", type=float, default=JOB_LEASE_SECONDS)
+    args = parser.parse_args()
+    
+    init_db()
+    store = get_job_store()
+    workers = [Worker(store, HANDLERS, lease_seconds=args.lease_seconds) for _ in range(args.threads)]
+    
+    def stop(signum, frame):
+        logger.info("Stopping workers after their current job")
+        for worker in workers:
+            worker.stop()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    threads = [threading.Thread(target=worker.run, name=worker.worker_id) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+if __name__ == "__main__":
+    main()